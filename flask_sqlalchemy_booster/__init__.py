@@ -5,10 +5,10 @@ A wrapper over Flask-SQLAlchemy
 """
 
 from __future__ import absolute_import
-from .core import FlaskSQLAlchemyBooster, FlaskBooster
+from .core import FlaskSQLAlchemyBooster, FlaskBooster, skip_sanitization
 from .model_booster import ModelBooster
 from .query_booster import QueryBooster
-from .json_encoder import json_encoder
+from .json_encoder import json_encoder, register_json_encoder
 from .json_columns import JSONEncodedStruct, MutableDict, MutableList
 from .schema_generators import generate_input_data_schema
 from .entities_router import EntitiesRouter, Entity, Get, Index, Post, Put, Patch, Delete, BatchSave
@@ -1,16 +1,17 @@
 from __future__ import absolute_import
-from flask import Flask, g, request
+from flask import Flask, g, request, current_app, has_request_context
+from flask.ctx import _AppCtxGlobals
 from flask_sqlalchemy import SQLAlchemy
 from flask_sqlalchemy import _QueryProperty
 from sqlalchemy.ext.declarative import declarative_base
 from .model_booster import ModelBooster
 from .query_booster import QueryBooster
 from .flask_client_booster import FlaskClientBooster
+from .json_encoder import set_app_json_backend
 import bleach
 from werkzeug.datastructures import MultiDict
-from decimal import Decimal
+import re
 import six
-from flask.json import _json as json
 
 class QueryPropertyWithModelClass(_QueryProperty):
     """Subclassed to add the cls attribute to a query instance.
@@ -50,14 +51,28 @@ class FlaskSQLAlchemyBooster(SQLAlchemy):
 
     >>> u.todict()
 
+    The `json_backend` keyword argument picks the library used to dump the
+    JSON responses and `tojson` outputs of the apps the extension is
+    initialized on: 'orjson', 'rapidjson', 'ujson', 'stdlib' or 'auto' (see
+    `json_encoder.set_app_json_backend`). JSON columns are dumped with the
+    default backend set by `json_encoder.set_json_backend`.
+
+    >>> db = FlaskSQLAlchemyBooster(json_backend='auto')
+
     """
 
     def __init__(self, *args, **kwargs):
         kwargs["model_class"] = ModelBooster
         kwargs["query_class"] = QueryBooster
+        self.json_backend = kwargs.pop("json_backend", None)
         super(FlaskSQLAlchemyBooster, self).__init__(*args, **kwargs)
         # self.Query = QueryBooster
 
+    def init_app(self, app):
+        super(FlaskSQLAlchemyBooster, self).init_app(app)
+        if self.json_backend is not None:
+            set_app_json_backend(app, self.json_backend)
+
     def make_declarative_base(self, model, metadata=None):
         base = super(FlaskSQLAlchemyBooster, self).make_declarative_base(
             model, metadata)
@@ -65,15 +80,41 @@ class FlaskSQLAlchemyBooster(SQLAlchemy):
         base.session = self.session
         return base
 
-def _sanitize_object(obj):
+# The characters bleach.clean escapes or strips. Strings without any of
+# them come out of it unchanged, so they are not cleaned at all.
+MARKUP_CHARS_RE = re.compile(u'[<>&\x00-\x08\x0b-\x1f]')
+
+
+def sanitize_string(value):
+    if MARKUP_CHARS_RE.search(value) is None:
+        return value
+    return bleach.clean(value)
+
+
+def sanitize_value(value):
+    """Cleans the strings in a value decoded from JSON, walking nested
+    dicts and lists in place of re-encoding them.
+    """
+    if isinstance(value, six.string_types):
+        return sanitize_string(value)
+    if isinstance(value, dict):
+        return {
+            sanitize_string(k) if isinstance(k, six.string_types) else k:
+            sanitize_value(v) for k, v in value.items()}
+    if isinstance(value, list):
+        return [sanitize_value(v) for v in value]
+    return value
+
+
+def _sanitize_object(obj, exempt_fields=frozenset()):
+    if not isinstance(obj, dict):
+        return sanitize_value(obj)
     result = {}
     for k, v in obj.items():
-        if isinstance(v, int) or isinstance(v, Decimal):
+        if k in exempt_fields:
             result[k] = v
-        elif not (isinstance(v, str) or isinstance(v, six.text_type)):
-            result[k] = json.loads(bleach.clean(json.dumps(v)))
-        else:
-            result[k] = bleach.clean(v)
+            continue
+        result[k] = sanitize_value(v)
         if result[k] == '':
             result[k] = None
         # Making an assumption that there is no good usecase
@@ -82,42 +123,138 @@ def _sanitize_object(obj):
         # not clearing form fields to null
     return result
 
-def sanitize_args():
-    if 'args' not in g:
-        g.args = {}
-    for arg, argv in request.args.items():
-        g.args[arg] = bleach.clean(argv)
 
-def sanitize_json():
-    g.json = None
-    json_data = request.get_json()
+def skip_sanitization(view_func=None, fields=None):
+    """Exempts a view from the sanitization of the request json, args and
+    form, or exempts only the given fields if `fields` is passed.
+
+    >>> @app.route('/pages', methods=['POST'])
+    ... @skip_sanitization(fields=['html_content'])
+    ... def create_page():
+    ...     ...
+    """
+    def decorator(view_func):
+        view_func._sanitization_exemptions_ = (
+            frozenset(fields) if fields else True)
+        return view_func
+    if view_func is not None:
+        return decorator(view_func)
+    return decorator
+
+
+def _sanitization_exemptions():
+    # True if the view of the request is exempt, else its exempt fields
+    view_func = current_app.view_functions.get(request.endpoint)
+    return getattr(view_func, '_sanitization_exemptions_', frozenset())
+
+
+def sanitized_args():
+    exemptions = _sanitization_exemptions()
+    if exemptions is True:
+        return request.args.to_dict()
+    return {
+        arg: argv if arg in exemptions else sanitize_string(argv)
+        for arg, argv in request.args.items()}
+
+
+def sanitized_json(json_data=None):
+    """Returns the request json (or `json_data` if given) with its strings
+    cleaned, unless the view is exempt.
+    """
+    if json_data is None:
+        json_data = request.get_json()
+    exemptions = _sanitization_exemptions()
+    if exemptions is True:
+        return json_data if isinstance(json_data, (dict, list)) else None
     if isinstance(json_data, dict):
-        g.json = _sanitize_object(json_data)
+        return _sanitize_object(json_data, exemptions)
     elif isinstance(json_data, list):
-        g.json = [_sanitize_object(o) for o in json_data]
-    else:
-        g.json = None
+        return [_sanitize_object(o, exemptions) for o in json_data]
+    return None
+
+
+def sanitized_form():
+    form = MultiDict(request.form)
+    exemptions = _sanitization_exemptions()
+    if exemptions is True:
+        return form
+    for k, v in request.form.items():
+        if k in exemptions:
+            continue
+        form[k] = sanitize_string(v)
+        if form[k] == '':
+            form[k] = None
+    return form
+
+
+def sanitize_args():
+    g.args = sanitized_args()
+
+
+def sanitize_json():
+    g.json = sanitized_json()
+
 
 def sanitize_form():
-    if 'form' not in g:
-        g.form = MultiDict(request.form)
-    if request.form is not None:
-        for k, v in request.form.items():
-            g.form[k] = bleach.clean(v)
-            if g.form[k] == '':
-                g.form[k] = None
+    g.form = sanitized_form()
+
+
+LAZILY_SANITIZED = {
+    'json': sanitized_json,
+    'args': sanitized_args,
+    'form': sanitized_form
+}
+
+
+class SanitizingAppCtxGlobals(_AppCtxGlobals):
+    """The `g` of `FlaskBooster` apps. `g.json`, `g.args` and `g.form` are
+    sanitized the first time they are read during a request, so requests
+    which never read them skip the sanitization.
+    """
+
+    def __getattr__(self, name):
+        if name in LAZILY_SANITIZED and has_request_context():
+            value = LAZILY_SANITIZED[name]()
+            setattr(self, name, value)
+            return value
+        raise AttributeError(name)
+
+    def get(self, name, default=None):
+        return getattr(self, name, default)
+
+    def __contains__(self, item):
+        return item in self.__dict__ or (
+            item in LAZILY_SANITIZED and has_request_context())
+
+
+def reset_sanitized_globals():
+    # The app context, and with it g, can outlive a request
+    for name in LAZILY_SANITIZED:
+        g.pop(name, None)
+
 
 class FlaskBooster(Flask):
+    """A Flask app whose `g.json`, `g.args` and `g.form` hold the request
+    json, args and form with the markup in their strings cleaned by bleach,
+    and empty strings replaced with None. They are sanitized lazily, when
+    first read. Views can opt out with `skip_sanitization`. Passing
+    `json_sanitizer`, `args_sanitizer` or `form_sanitizer` replaces the
+    sanitizer with a function run before every request instead.
+    """
     test_client_class = FlaskClientBooster
+    app_ctx_globals_class = SanitizingAppCtxGlobals
 
     def __init__(self, *args, **kwargs):
-        json_sanitizer = kwargs.pop('json_sanitizer', sanitize_json)
-        args_sanitizer = kwargs.pop('args_sanitizer', sanitize_args)
-        form_sanitizer = kwargs.pop('form_sanitizer', sanitize_form)
+        sanitizers = [
+            kwargs.pop('json_sanitizer', None),
+            kwargs.pop('args_sanitizer', None),
+            kwargs.pop('form_sanitizer', None)]
 
         super(FlaskBooster, self).__init__(*args, **kwargs)
 
-        self.before_request_funcs.setdefault(None, []).append(json_sanitizer)
-        self.before_request_funcs.setdefault(None, []).append(args_sanitizer)
-        self.before_request_funcs.setdefault(None, []).append(form_sanitizer)
-
+        self.sanitizes_json_lazily = sanitizers[0] is None
+        self.before_request_funcs.setdefault(None, []).append(
+            reset_sanitized_globals)
+        for sanitizer in sanitizers:
+            if sanitizer is not None:
+                self.before_request_funcs.setdefault(None, []).append(sanitizer)
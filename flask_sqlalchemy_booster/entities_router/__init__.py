@@ -1,5 +1,8 @@
-from flask import Response
+from flask import Response, Blueprint
+from collections import OrderedDict
+from timeit import default_timer
 import json
+import threading
 from schemalite.core import json_encoder
 
 from .crud_constructors import (
@@ -8,10 +11,12 @@ from .crud_constructors import (
     construct_put_view_function, construct_delete_view_function,
     construct_patch_view_function, construct_batch_save_view_function)
 from . import entity_definition_keys as edk
+from ..json_encoder import set_app_json_backend
+from ..validation_plans import compile_schema
+from ..utils import copy_schema
 from toolspy import (
     all_subclasses, fetch_nested_key_from_dict, fetch_nested_key,
     delete_dict_keys, union, merge, difference, transform_dict)
-from copy import deepcopy
 
 
 class EntityOperation(object):
@@ -104,6 +109,28 @@ class Get(EntityOperation):
         access the currently logged in account without knowing the id, then you would need
         to set this url parameter
 
+    eager_load: bool, optional
+        By default the relationships requested in the response dict_struct (including
+        the ones requested with the `_ds` query argument) are loaded along with the
+        object using `selectinload`/`joinedload`. Set this to False to let them be
+        lazy loaded instead.
+
+    invalidate_cache_on_write: bool, optional
+        When caching is enabled, drops the cached responses as soon as a commit
+        writes the data they were built from, instead of waiting for
+        `cache_timeout`. A Get of an instance by its primary key is invalidated
+        by writes to that instance, and any other Get by writes to the model's
+        table. Writes to the relationships in the response dict_struct invalidate
+        it too. Defaults to the entity's setting.
+
+    etag: bool, optional
+        Sends a strong ETag with the response and answers requests whose
+        If-None-Match matches it with a 304 Not Modified. If the model has a
+        version attribute (see `_version_attr_`) and the response holds only the
+        instance's own columns, the ETag is derived from its primary key and
+        version, so unchanged instances are not serialized. Otherwise it is
+        derived from the body. Defaults to the entity's setting.
+
     
     """
 
@@ -115,9 +142,13 @@ class Get(EntityOperation):
             permitted_object_getter=None, id_attr=None, response_dict_struct=None,
             response_dict_modifiers=None, exception_handler=None, access_checker=None,
             url=None, enable_caching=False, cache_key_determiner=None,
-            cache_timeout=None, ):
+            cache_timeout=None, eager_load=True, invalidate_cache_on_write=None,
+            etag=None):
         super(Get, self).__init__(entity=entity)
         self.url = url
+        self.eager_load = eager_load
+        self.invalidate_cache_on_write = invalidate_cache_on_write
+        self.etag = etag
         self.enable_caching = enable_caching
         self.cache_key_determiner = cache_key_determiner
         self.cache_timeout = cache_timeout
@@ -143,10 +174,88 @@ class Get(EntityOperation):
             edk.RESPONSE_DICT_MODIFIERS: self.response_dict_modifiers,
             edk.EXCEPTION_HANDLER: self.exception_handler,
             edk.ACCESS_CHECKER: self.access_checker,
+            edk.EAGER_LOAD: self.eager_load,
+            edk.INVALIDATE_CACHE_ON_WRITE: self.invalidate_cache_on_write,
+            edk.ETAG: self.etag,
         }, skip_none_vals=True)
 
 
 class Index(EntityOperation):
+    """This class represents an index operation on an entity.
+    Registers a GET endpoint at /<entity.url_slug>
+
+    Parameters
+    ------------
+    eager_load: bool, optional
+        By default the relationships requested in the response dict_struct (including
+        the ones requested with the `_ds` query argument) are loaded for the whole
+        page with `selectinload`/`joinedload`, so that the number of queries does not
+        grow with the number of rows. Set this to False to let them be lazy loaded
+        instead.
+
+    use_column_projection: bool, optional
+        When the response dict_struct asks only for plain column attributes, the
+        index selects just those columns and builds the response dicts from the rows
+        without loading model instances. Set this to False to always load instances.
+        The projection is never used when a custom_response_creator is set.
+
+    stream: bool or str, optional
+        Streams unpaginated responses instead of building them in memory. The
+        query is iterated with `yield_per` and the rows are serialized and written
+        out `stream_chunk_size` at a time. Pass 'json' to stream the usual JSON
+        document, 'ndjson' to write one JSON document per row with the
+        application/x-ndjson mimetype, or True to send NDJSON to clients which
+        prefer it in their Accept header and JSON to the rest.
+
+    stream_chunk_size: int, optional
+        The number of rows fetched and serialized at a time while streaming.
+        Defaults to 1000.
+
+    keyset_pagination: bool, optional
+        Lets clients page through the index with cursors instead of page numbers.
+        A request with an `after` (or `before`) argument gets the `per_page` rows
+        following (or preceding) the row the cursor points to, ordered by `orderby`
+        and the primary key, along with the `next_cursor` and `prev_cursor` to
+        pass on. An empty `after` gets the first page. Since rows are located with
+        a WHERE clause instead of an OFFSET, deep pages cost the same as the first.
+        Enabled by default.
+
+    pagination_total: bool or str, optional
+        How `total_items` is found for page numbered requests. True (the default)
+        counts the matching rows, unless the page is the last one, in which case
+        the total is known without counting. False skips the count and reports
+        `has_next` instead of the totals. 'estimate' uses the query planner's row
+        estimate on PostgreSQL (and counts on other databases), and marks the
+        response with `total_is_estimate`. 'cached' reuses the count of an earlier
+        request for the same filters until `pagination_total_cache_timeout` expires,
+        keeping it in the router's cache_handler if there is one. 'approximate' stops
+        counting at `pagination_total_cap` + 1 rows; when there are more, the response
+        reports the cap as `total_items` along with `total_is_capped` and `has_next`,
+        meaning "more than total_items".
+
+    pagination_total_cap: int, optional
+        The cap for 'approximate' totals. Defaults to 1000.
+
+    pagination_total_cache_timeout: int, optional
+        The number of seconds 'cached' totals are reused for. Defaults to 300.
+
+    invalidate_cache_on_write: bool, optional
+        When caching is enabled, drops the cached responses as soon as a commit
+        writes to the model's table, to the tables of the relationships in the
+        response dict_struct, or to the tables joined by the request's filters,
+        instead of waiting for `cache_timeout`. Defaults to the entity's setting.
+
+    etag: bool, optional
+        Sends a strong ETag with unstreamed responses and answers requests whose
+        If-None-Match matches it with a 304 Not Modified. If the model has a
+        version attribute (see `_version_attr_`) and the rows are serialized
+        with their own columns only, the ETag is derived from a query fetching
+        only the primary keys and versions of the requested page, conditional
+        request or not, and on a conditional request the rows are fetched and
+        serialized only when it has changed. Otherwise it is derived from the
+        body. Defaults to the entity's setting.
+
+    """
 
     method = 'index'
 
@@ -156,7 +265,12 @@ class Index(EntityOperation):
             response_dict_struct=None, custom_response_creator=None,
             exception_handler=None, access_checker=None,
             default_limit=None, default_sort=None, default_orderby=None,
-            default_offset=None, default_page=None, default_per_page=None):
+            default_offset=None, default_page=None, default_per_page=None,
+            eager_load=True, use_column_projection=True,
+            stream=False, stream_chunk_size=None, keyset_pagination=True,
+            pagination_total=True, pagination_total_cap=None,
+            pagination_total_cache_timeout=None, invalidate_cache_on_write=None,
+            etag=None):
         super(Index, self).__init__(entity=entity)
         self.url = url
         self.view_function = view_function
@@ -174,6 +288,16 @@ class Index(EntityOperation):
         self.default_offset = default_offset
         self.default_page = default_page
         self.default_per_page = default_per_page
+        self.eager_load = eager_load
+        self.use_column_projection = use_column_projection
+        self.stream = stream
+        self.stream_chunk_size = stream_chunk_size
+        self.keyset_pagination = keyset_pagination
+        self.pagination_total = pagination_total
+        self.pagination_total_cap = pagination_total_cap
+        self.pagination_total_cache_timeout = pagination_total_cache_timeout
+        self.invalidate_cache_on_write = invalidate_cache_on_write
+        self.etag = etag
 
     def to_dict(self):
         return transform_dict({
@@ -192,7 +316,17 @@ class Index(EntityOperation):
             edk.DEFAULT_ORDERBY: self.default_orderby,
             edk.DEFAULT_OFFSET: self.default_offset,
             edk.DEFAULT_PAGE: self.default_page,
-            edk.DEFAULT_PER_PAGE: self.default_per_page
+            edk.DEFAULT_PER_PAGE: self.default_per_page,
+            edk.EAGER_LOAD: self.eager_load,
+            edk.USE_COLUMN_PROJECTION: self.use_column_projection,
+            edk.STREAM: self.stream,
+            edk.STREAM_CHUNK_SIZE: self.stream_chunk_size,
+            edk.KEYSET_PAGINATION: self.keyset_pagination,
+            edk.PAGINATION_TOTAL: self.pagination_total,
+            edk.PAGINATION_TOTAL_CAP: self.pagination_total_cap,
+            edk.PAGINATION_TOTAL_CACHE_TIMEOUT: self.pagination_total_cache_timeout,
+            edk.INVALIDATE_CACHE_ON_WRITE: self.invalidate_cache_on_write,
+            edk.ETAG: self.etag
         }, skip_none_vals=True)
 
 
@@ -389,6 +523,51 @@ class Delete(EntityOperation):
         }, skip_none_vals=True)
 
 class BatchSave(EntityOperation):
+    """This class represents a batch save operation on an entity.
+    Registers a POST endpoint at /batch-save/<entity.url_slug> which accepts
+    a list of dicts (or a CSV file) to be created or updated.
+
+    Parameters
+    ------------
+    set_based: bool, optional
+        By default every row is saved with its own `update` or `create`, each
+        committing a transaction. When set_based is True, the rows of each chunk
+        of `chunk_size` rows are validated and staged in the session, then flushed
+        and committed in one transaction per chunk. The response still has one
+        result per row. If the flush or commit of a chunk fails, the chunk is
+        rolled back and its rows are saved again one at a time, each with a
+        commit of its own, so that only the rows which cannot be saved are
+        reported as failed. A failing chunk thus costs one commit per row.
+
+    chunk_size: int, optional
+        The number of rows saved per transaction in set based mode, and the
+        number of CSV rows read at a time when stream_csv_input is True. Defaults
+        to 500.
+
+    stream_csv_input: bool, optional
+        If True, an uploaded CSV file is read and saved one chunk of rows at a
+        time instead of being loaded whole into memory. With run_as_async_task,
+        only the path of the saved file is passed to the worker, so tmp_folder_path
+        should be reachable from the workers.
+
+    parallel_workers: int, optional
+        The number of workers saving the input in parallel. The input is split
+        into that many partitions by hashing the primary key of every row (or
+        its unique_identifier_fields values, or a unique column, whichever is
+        set first), so rows sharing those values land in the same partition.
+        Every worker streams the input, keeps the rows of its partition and
+        saves them chunk_size rows at a time, each chunk committing on its own.
+        The responses are merged back in input order. With run_as_async_task,
+        the partitions are sent to celery as a chord, with only the path of the
+        input file (JSON input is first written to a file in tmp_folder_path),
+        and the merged response is saved in the result saving instance; a
+        celery_worker is then required. Otherwise they are saved by a pool of
+        as many threads, started with the route, each running in a copy of the
+        request context with its own app context and session, while the
+        request waits for the merged response. Values set on flask.g during
+        the request are not seen by the pool threads.
+
+    """
 
     method = 'batch_save'
 
@@ -405,7 +584,9 @@ class BatchSave(EntityOperation):
             remove_property_keys_before_validation=False, remove_relationship_keys_before_validation=False,
             remove_assoc_proxy_keys_before_validation=False, input_schema_modifier=None,
             update_only=False, create_only=False,
-            skip_pre_processors=False, skip_post_processors=False):
+            skip_pre_processors=False, skip_post_processors=False,
+            set_based=False, chunk_size=None, stream_csv_input=False,
+            parallel_workers=None):
         super(BatchSave, self).__init__(entity=entity)
         self.url = url
         self.view_function = view_function
@@ -433,6 +614,10 @@ class BatchSave(EntityOperation):
         self.remove_relationship_keys_before_validation = remove_relationship_keys_before_validation
         self.remove_assoc_proxy_keys_before_validation = remove_assoc_proxy_keys_before_validation
         self.input_schema_modifier = input_schema_modifier
+        self.set_based = set_based
+        self.chunk_size = chunk_size
+        self.stream_csv_input = stream_csv_input
+        self.parallel_workers = parallel_workers
 
 
 class Entity(object):
@@ -460,6 +645,14 @@ class Entity(object):
         The router to which the entity is to be linked. To be specified if the entity is
         defined separately
 
+    invalidate_cache_on_write: bool, optional
+        Makes commits which write to the data of the cached Get and Index responses
+        of the entity invalidate them. See `Get` and `Index`.
+
+    etag: bool, optional
+        Makes the Get and Index responses of the entity conditional on the
+        If-None-Match header. See `Get` and `Index`.
+
     
     """
 
@@ -471,6 +664,7 @@ class Entity(object):
             id_attr=None, response_dict_struct=None, non_settable_fields=None, settable_fields=None,
             remove_relationship_keys_before_validation=False, remove_assoc_proxy_keys_before_validation=False,
             remove_property_keys_before_validation=False, enable_caching=False, cache_timeout=None,
+            invalidate_cache_on_write=False, etag=False,
             get=None, index=None, put=None, post=None, patch=None, delete=None, batch_save=None):
         self.model_class = model_class
         self.name = name or self.model_class.__name__
@@ -494,6 +688,8 @@ class Entity(object):
         self.settable_fields = settable_fields if settable_fields else []
         self.enable_caching = enable_caching
         self.cache_timeout = cache_timeout
+        self.invalidate_cache_on_write = invalidate_cache_on_write
+        self.etag = etag
         self.remove_relationship_keys_before_validation = remove_relationship_keys_before_validation
         self.remove_assoc_proxy_keys_before_validation = remove_assoc_proxy_keys_before_validation
         self.remove_property_keys_before_validation = remove_property_keys_before_validation
@@ -543,6 +739,8 @@ class Entity(object):
             edk.SETTABLE_FIELDS: self.settable_fields,
             edk.ENABLE_CACHING: self.enable_caching,
             edk.CACHE_TIMEOUT: self.cache_timeout,
+            edk.INVALIDATE_CACHE_ON_WRITE: self.invalidate_cache_on_write,
+            edk.ETAG: self.etag,
             edk.REMOVE_RELATIONSHIP_KEYS_BEFORE_VALIDATION: self.remove_relationship_keys_before_validation,
             edk.REMOVE_ASSOC_PROXY_KEYS_BEFORE_VALIDATION: self.remove_assoc_proxy_keys_before_validation,
             edk.REMOVE_PROPERTY_KEYS_BEFORE_VALIDATION: self.remove_property_keys_before_validation
@@ -550,6 +748,36 @@ class Entity(object):
 
 
 
+# The url (formatted with the url slug of the entity), the method and the
+# endpoint prefix of the route of each operation
+OPERATION_ROUTES = (
+    (edk.INDEX, "/%s", 'GET', 'index'),
+    (edk.GET, "/%s/<_id>", 'GET', 'get'),
+    (edk.POST, "/%s", 'POST', 'post'),
+    (edk.PUT, "/%s/<_id>", 'PUT', 'put'),
+    (edk.PATCH, "/%s/<_id>", 'PATCH', 'patch'),
+    (edk.DELETE, "/%s/<_id>", 'DELETE', 'delete'),
+    (edk.BATCH_SAVE, "/batch-save/%s", 'POST', 'batch_save'),
+)
+
+
+class LazyView(object):
+    """Stands in for a view function of an entity mounted lazily. The first
+    request builds the views of the entity.
+    """
+
+    def __init__(self, build_views, operation, endpoint):
+        self.build_views = build_views
+        self.operation = operation
+        self.__name__ = endpoint
+        self.view = None
+
+    def __call__(self, *args, **kwargs):
+        if self.view is None:
+            self.view = self.build_views()[self.operation]
+        return self.view(*args, **kwargs)
+
+
 class EntitiesRouter(object):
 
     """
@@ -597,6 +825,23 @@ class EntitiesRouter(object):
     views_map_url: str, Optional
         The url slug to be used to register the views map
 
+    json_backend: str, optional
+        The library used to dump the JSON responses: 'orjson', 'rapidjson',
+        'ujson', 'stdlib', or 'auto' for the first one installed. A library
+        which is not installed falls back to 'stdlib'. The choice applies to the
+        app the router is mounted on, or which its blueprint is registered on,
+        while it is the current app (see `json_encoder.set_app_json_backend`).
+        Leaving it unspecified keeps the app's backend, or the default one.
+
+    lazy: bool, optional
+        If True, mounting the router registers the url rules and the model
+        schemas only, and the validators and view functions of an entity are
+        built on the first request to any of its routes. `router.warmup()` builds them all
+        ahead, for instance before forking the workers. The batch save views
+        of routers with a celery worker are always built on mounting, as
+        they register the celery tasks. The time spent on mounting every
+        entity is given by `router.boot_timing_report()`.
+
     """
 
     def __init__(self,
@@ -606,7 +851,7 @@ class EntitiesRouter(object):
         forbidden_operations=None, celery_worker=None,
         register_schema_definition=True, register_views_map=True,
         schema_def_url='/schema-def', views_map_url='/views-map',
-        base_url=None
+        base_url=None, json_backend=None, lazy=False
     ):
 
         self.schema_definition = {
@@ -635,6 +880,11 @@ class EntitiesRouter(object):
         self.register_views_map = register_views_map
         self.schema_def_url = schema_def_url
         self.views_map_url = views_map_url
+        self.json_backend = json_backend
+        self.lazy = lazy
+        self.boot_timings = OrderedDict()
+        self._view_builders = []
+        self._build_lock = threading.Lock()
         # self.registry = {}
         self.initialize_registry_entry()
         if mount_point:
@@ -667,8 +917,17 @@ class EntitiesRouter(object):
             exception_handler=None,
             tmp_folder_path=None, celery_worker=None,
             register_schema_definition=None, register_views_map=None,
-            schema_def_url=None, views_map_url=None):
+            schema_def_url=None, views_map_url=None, lazy=None):
         self.mount_point = app_or_bp
+        if self.json_backend is not None:
+            if isinstance(app_or_bp, Blueprint):
+                json_backend = self.json_backend
+                app_or_bp.record_once(
+                    lambda state: set_app_json_backend(state.app, json_backend))
+            else:
+                set_app_json_backend(app_or_bp, self.json_backend)
+        if lazy is None:
+            lazy = self.lazy
         if allow_unknown_fields is None:
             allow_unknown_fields = self.allow_unknown_fields
         if register_schema_definition is None:
@@ -684,9 +943,81 @@ class EntitiesRouter(object):
             register_schema_definition=register_schema_definition,
             register_views_map=register_views_map,
             schema_def_url=schema_def_url or self.schema_def_url,
-            views_map_url=views_map_url or self.views_map_url
+            views_map_url=views_map_url or self.views_map_url,
+            lazy=lazy
         )
 
+    def _register_entity_routes(self, url_slug, entity, build_entity_views,
+                                lazy=False):
+        started_at = default_timer()
+        registry = self.get_registry_entry()
+        views = registry[edk.OPERATION_MODIFIERS]
+        timings = self.boot_timings[url_slug] = {
+            "entity": entity.name, "registration": None, "build": None}
+        if entity.name not in registry["models_registered_for_views"]:
+            registry["models_registered_for_views"].append(entity.name)
+        if entity.name not in views:
+            views[entity.name] = {}
+        endpoint_slug = entity.endpoint_slug or entity.model_class.__tablename__
+        routes = []
+        for operation, url_format, method, endpoint_prefix in OPERATION_ROUTES:
+            op = getattr(entity, operation)
+            if op:
+                url = op.url or url_format % url_slug
+                views[entity.name][operation] = {edk.URL: url}
+                routes.append((operation, url, method, '%s_%s' % (
+                    endpoint_prefix, endpoint_slug)))
+
+        view_functions = []
+
+        def build_views():
+            with self._build_lock:
+                if not view_functions:
+                    build_started_at = default_timer()
+                    view_functions.append(build_entity_views(url_slug, entity))
+                    timings["build"] = default_timer() - build_started_at
+            return view_functions[0]
+        self._view_builders.append(build_views)
+        if not lazy:
+            build_views()
+
+        for operation, url, method, endpoint in routes:
+            view = LazyView(build_views, operation, endpoint) if lazy else (
+                build_views()[operation])
+            self.mount_point.route(url, methods=[method], endpoint=endpoint)(
+                view)
+        timings["registration"] = default_timer() - started_at - (
+            timings["build"] or 0)
+
+    def warmup(self):
+        """Builds the views of the entities which were mounted lazily and
+        have not been requested yet. Call it before forking the workers,
+        so that they share the built views.
+
+        Returns
+        -------
+        list
+            The boot timing report (see `boot_timing_report`)
+        """
+        for build_views in self._view_builders:
+            build_views()
+        return self.boot_timing_report()
+
+    def boot_timing_report(self):
+        """Returns the seconds spent on mounting every entity, slowest
+        first, as a list of dicts with the keys
+
+        url_slug: the url slug of the entity
+        entity: the name of the entity
+        registration: the time spent on registering the routes
+        build: the time spent on building the validators and view
+            functions, None if they are still to be built
+        """
+        return sorted(
+            [merge(timings, {"url_slug": url_slug})
+             for url_slug, timings in self.boot_timings.items()],
+            key=lambda t: -(t["registration"] + (t["build"] or 0)))
+
 
     def to_dict(self):
         entities_map = {}
@@ -700,27 +1031,31 @@ class EntitiesRouter(object):
             exception_handler=None,
             tmp_folder_path="/tmp", celery_worker=None,
             register_schema_definition=True, register_views_map=True,
-            schema_def_url='/schema-def', views_map_url='/views-map'):
+            schema_def_url='/schema-def', views_map_url='/views-map',
+            lazy=False):
 
         app_or_bp = self.mount_point
         registry = self.get_registry_entry()
         model_schemas = registry["model_schemas"]
 
+        def default_input_schema(model_class):
+            # Shared by the views and the schemas registry, which do not
+            # modify it. It is copied before a modifier is applied to it.
+            return (model_class._input_data_schema_ or
+                    model_class.shared_input_data_schema())
+
         def populate_model_schema(model_class, entity=None):
             model_key = fetch_nested_key(entity, 'name') or model_class.__name__
-            if model_class._input_data_schema_:
-                input_schema = deepcopy(model_class._input_data_schema_)
-            else:
-                input_schema = model_class.generate_input_data_schema()
+            input_schema = default_input_schema(model_class)
             if entity and callable(entity.input_schema_modifier):
                 input_schema = entity.input_schema_modifier(
-                    input_schema)
+                    copy_schema(input_schema))
             model_schemas[model_key] = {
                 "input_schema": input_schema,
                 "output_schema": model_class.output_data_schema(),
                 "accepted_data_structure": model_class.max_permissible_dict_structure()
             }
-            for subcls in all_subclasses(model_class):
+            for subcls in model_class.metadata_registry_entry().subclasses:
                 if subcls.__name__ not in model_schemas:
                     model_schemas[subcls.__name__] = {
                         'is_a_polymorphically_derived_from': model_class.__name__,
@@ -730,7 +1065,12 @@ class EntitiesRouter(object):
                 if rel.mapper.class_.__name__ not in model_schemas:
                     populate_model_schema(rel.mapper.class_)
 
-        for url_slug, entity in self.routes.items():
+        views = registry[edk.OPERATION_MODIFIERS]
+
+        def build_entity_views(url_slug, entity):
+            # Builds the schemas, validators and view functions of the
+            # entity, returning the view functions by operation
+            view_functions = {}
             _model = entity.model_class
             _model_name = entity.name
             base_url = url_slug
@@ -749,27 +1089,23 @@ class EntitiesRouter(object):
             remove_property_keys_before_validation = entity.remove_property_keys_before_validation
             enable_caching = entity.enable_caching and cache_handler is not None
             cache_timeout = entity.cache_timeout
-            endpoint_slug = entity.endpoint_slug or _model.__tablename__
 
-            if _model_name not in registry["models_registered_for_views"]:
-                registry["models_registered_for_views"].append(
-                    _model_name)
-            if _model_name not in model_schemas:
-                populate_model_schema(entity.model_class, entity)
-
-            if _model._input_data_schema_:
-                model_default_input_schema = deepcopy(_model._input_data_schema_)
-            else:
-                model_default_input_schema = _model.generate_input_data_schema()
+            model_default_input_schema = default_input_schema(_model)
             if callable(entity.input_schema_modifier):
                 model_default_input_schema = entity.input_schema_modifier(
-                    model_default_input_schema)
+                    copy_schema(model_default_input_schema))
 
-            views = registry[edk.OPERATION_MODIFIERS]
             schemas_registry = {k: v.get('input_schema')
                                 for k, v in list(model_schemas.items())}
-            if _model_name not in views:
-                views[_model_name] = {}
+            # The input schemas of the entity are compiled once, and the
+            # views sharing a schema share its compiled validator
+            validation_plans = {}
+
+            def validation_plan_for(schema):
+                if id(schema) not in validation_plans:
+                    validation_plans[id(schema)] = (
+                        schema, compile_schema(schema, schemas_registry))
+                return validation_plans[id(schema)][1]
 
             if entity.index:
                 index_op = entity.index
@@ -793,13 +1129,22 @@ class EntitiesRouter(object):
                     default_orderby=index_op.default_orderby,
                     default_offset=index_op.default_offset,
                     default_page=index_op.default_page,
-                    default_per_page=index_op.default_per_page
+                    default_per_page=index_op.default_per_page,
+                    eager_load=index_op.eager_load,
+                    use_column_projection=index_op.use_column_projection,
+                    stream=index_op.stream,
+                    stream_chunk_size=index_op.stream_chunk_size,
+                    keyset_pagination=index_op.keyset_pagination,
+                    pagination_total=index_op.pagination_total,
+                    pagination_total_cap=index_op.pagination_total_cap,
+                    pagination_total_cache_timeout=index_op.pagination_total_cache_timeout,
+                    invalidate_cache_on_write=(
+                        entity.invalidate_cache_on_write
+                        if index_op.invalidate_cache_on_write is None
+                        else index_op.invalidate_cache_on_write),
+                    etag=entity.etag if index_op.etag is None else index_op.etag
                 )
-                index_url = index_op.url or "/%s" % base_url
-                app_or_bp.route(
-                    index_url, methods=['GET'], endpoint='index_%s' % endpoint_slug)(
-                    index_func)
-                views[_model_name][edk.INDEX] = {edk.URL: index_url}
+                view_functions[edk.INDEX] = index_func
 
             if entity.get:
                 get_op = entity.get
@@ -818,22 +1163,25 @@ class EntitiesRouter(object):
                     exception_handler=get_op.exception_handler or default_exception_handler,
                     access_checker=get_op.access_checker or default_access_checker,
                     id_attr_name=get_op.id_attr or default_id_attr,
-                    dict_post_processors=get_op.response_dict_modifiers or default_dict_post_processors)
-                get_url = get_op.url or '/%s/<_id>' % base_url
-                app_or_bp.route(
-                    get_url, methods=['GET'], endpoint='get_%s' % endpoint_slug)(
-                    get_func)
-                views[_model_name]['get'] = {edk.URL: get_url}
+                    dict_post_processors=get_op.response_dict_modifiers or default_dict_post_processors,
+                    eager_load=get_op.eager_load,
+                    invalidate_cache_on_write=(
+                        entity.invalidate_cache_on_write
+                        if get_op.invalidate_cache_on_write is None
+                        else get_op.invalidate_cache_on_write),
+                    etag=entity.etag if get_op.etag is None else get_op.etag)
+                view_functions[edk.GET] = get_func
 
             if entity.post:
                 post_op = entity.post
                 if callable(post_op.input_schema_modifier):
                     post_input_schema = post_op.input_schema_modifier(
-                        deepcopy(model_default_input_schema))
+                        copy_schema(model_default_input_schema))
                 else:
                     post_input_schema = model_default_input_schema
                 post_func = post_op.view_function or construct_post_view_function(
                     _model, post_input_schema,
+                    validation_plan=validation_plan_for(post_input_schema),
                     entities_group=self,
                     pre_processors=post_op.before_save,
                     post_processors=post_op.after_save,
@@ -856,24 +1204,21 @@ class EntitiesRouter(object):
                         fields_forbidden_from_being_set_for_all_views,
                         post_op.non_settable_fields or []
                     ]))
-                post_url = post_op.url or "/%s" % base_url
-                app_or_bp.route(
-                    post_url, methods=['POST'], endpoint='post_%s' % endpoint_slug)(
-                    post_func)
-                views[_model_name]['post'] = {edk.URL: post_url}
+                view_functions[edk.POST] = post_func
                 if callable(post_op.input_schema_modifier):
                     views[_model_name]['post']['input_schema'] = post_op.input_schema_modifier(
-                        deepcopy(model_schemas[_model.__name__]['input_schema']))
+                        copy_schema(model_schemas[_model.__name__]['input_schema']))
 
             if entity.put:
                 put_op = entity.put
                 if callable(put_op.input_schema_modifier):
                     put_input_schema = put_op.input_schema_modifier(
-                        deepcopy(model_default_input_schema))
+                        copy_schema(model_default_input_schema))
                 else:
                     put_input_schema = model_default_input_schema
                 put_func = put_op.view_function or construct_put_view_function(
                     _model, put_input_schema,
+                    validation_plan=validation_plan_for(put_input_schema),
                     entities_group=self,
                     permitted_object_getter=put_op.permitted_object_getter or entity.permitted_object_getter,
                     pre_processors=put_op.before_save,
@@ -898,20 +1243,16 @@ class EntitiesRouter(object):
                         fields_forbidden_from_being_set_for_all_views,
                         put_op.non_settable_fields or []
                     ]))
-                put_url = put_op.url or "/%s/<_id>" % base_url
-                app_or_bp.route(
-                    put_url, methods=['PUT'], endpoint='put_%s' % endpoint_slug)(
-                    put_func)
-                views[_model_name]['put'] = {edk.URL: put_url}
+                view_functions[edk.PUT] = put_func
                 if callable(put_op.input_schema_modifier):
                     views[_model_name]['put']['input_schema'] = put_op.input_schema_modifier(
-                        deepcopy(model_schemas[_model.__name__]['input_schema']))
+                        copy_schema(model_schemas[_model.__name__]['input_schema']))
 
             if entity.patch:
                 patch_op = entity.patch
                 if callable(patch_op.input_schema_modifier):
                     patch_input_schema = patch_op.input_schema_modifier(
-                        deepcopy(model_default_input_schema))
+                        copy_schema(model_default_input_schema))
                 else:
                     patch_input_schema = model_default_input_schema
                 patch_func = patch_op.view_function or construct_patch_view_function(
@@ -925,14 +1266,10 @@ class EntitiesRouter(object):
                     exception_handler=patch_op.exception_handler or default_exception_handler,
                     access_checker=patch_op.access_checker or default_access_checker,
                     dict_struct=patch_op.response_dict_struct or dict_struct_for_model)
-                patch_url = patch_op.url or "/%s/<_id>" % base_url
-                app_or_bp.route(
-                    patch_url, methods=['PATCH'], endpoint='patch_%s' % endpoint_slug)(
-                    patch_func)
-                views[_model_name]['patch'] = {edk.URL: patch_url}
+                view_functions[edk.PATCH] = patch_func
                 if callable(patch_op.input_schema_modifier):
                     views[_model_name]['patch']['input_schema'] = patch_op.input_schema_modifier(
-                        deepcopy(model_schemas[_model.__name__]['input_schema']))
+                        copy_schema(model_schemas[_model.__name__]['input_schema']))
 
             if entity.delete:
                 delete_op = entity.delete
@@ -944,21 +1281,18 @@ class EntitiesRouter(object):
                     post_processors=delete_op.after_save,
                     exception_handler=delete_op.exception_handler or default_exception_handler,
                     access_checker=delete_op.access_checker or default_access_checker)
-                delete_url = delete_op.url or "/%s/<_id>" % base_url
-                app_or_bp.route(
-                    delete_url, methods=['DELETE'], endpoint='delete_%s' % endpoint_slug)(
-                    delete_func)
-                views[_model_name]['delete'] = {edk.URL: delete_url}
+                view_functions[edk.DELETE] = delete_func
 
             if entity.batch_save:
                 batch_save_op = entity.batch_save
                 if callable(batch_save_op.input_schema_modifier):
                     batch_save_input_schema = batch_save_op.input_schema_modifier(
-                        deepcopy(model_default_input_schema))
+                        copy_schema(model_default_input_schema))
                 else:
                     batch_save_input_schema = model_default_input_schema
                 batch_save_func = batch_save_op.view_function or construct_batch_save_view_function(
                     _model, batch_save_input_schema,
+                    validation_plan=validation_plan_for(batch_save_input_schema),
                     app_or_bp=app_or_bp,
                     pre_processors_for_post=fetch_nested_key(entity, 'post.before_save'),
                     pre_processors_for_put=fetch_nested_key(entity, 'put.before_save'),
@@ -983,19 +1317,34 @@ class EntitiesRouter(object):
                     run_as_async_task=batch_save_op.run_as_async_task,
                     update_only=batch_save_op.update_only, create_only=batch_save_op.create_only,
                     skip_pre_processors=batch_save_op.skip_pre_processors,
-                    skip_post_processors=batch_save_op.skip_post_processors
+                    skip_post_processors=batch_save_op.skip_post_processors,
+                    set_based=batch_save_op.set_based,
+                    chunk_size=batch_save_op.chunk_size,
+                    stream_csv_input=batch_save_op.stream_csv_input,
+                    parallel_workers=batch_save_op.parallel_workers
                 )
-                batch_save_url = batch_save_op.url or "/batch-save/%s" % base_url
-                app_or_bp.route(
-                    batch_save_url, methods=['POST'], endpoint='batch_save_%s' % endpoint_slug)(
-                    batch_save_func)
-                views[_model_name]['batch_save'] = {edk.URL: batch_save_url}
+                view_functions[edk.BATCH_SAVE] = batch_save_func
                 if callable(batch_save_op.input_schema_modifier):
                     views[_model_name]['batch_save']['input_schema'] = batch_save_op.input_schema_modifier(
-                        deepcopy(model_schemas[_model.__name__]['input_schema']))
+                        copy_schema(model_schemas[_model.__name__]['input_schema']))
+            return view_functions
+
+        # The schemas of all the entities are populated at mount time, even
+        # when their views are built lazily, so that the schemas registry
+        # the views are built with does not depend on which entities were
+        # requested first. An entity's own schema, with its modifier, takes
+        # the place of one populated earlier as a related model.
+        for entity in self.routes.values():
+            populate_model_schema(entity.model_class, entity)
+
+        for url_slug, entity in self.routes.items():
+            self._register_entity_routes(
+                url_slug, entity, build_entity_views, lazy=lazy and not (
+                    entity.batch_save and celery_worker))
 
         if register_schema_definition:
             def schema_def():
+                self.warmup()
                 return Response(
                     json.dumps(
                         registry,
@@ -1007,6 +1356,7 @@ class EntitiesRouter(object):
 
         if register_views_map:
             def views_map():
+                self.warmup()
                 return Response(
                     json.dumps(
                         registry[edk.OPERATION_MODIFIERS],
@@ -1,6 +1,7 @@
 from __future__ import absolute_import
-from flask import g, request, Response, url_for
-from schemalite.core import validate_dict, validate_list_of_dicts, json_encoder
+from flask import g, request, Response, url_for, copy_current_request_context
+from flask_sqlalchemy import Pagination
+from schemalite.core import json_encoder
 from sqlalchemy.sql import sqltypes
 import json
 from toolspy import (
@@ -12,21 +13,50 @@ import six.moves.urllib.request, six.moves.urllib.parse, six.moves.urllib.error
 import functools
 import csv
 import traceback
+from itertools import islice
 from . import entity_definition_keys as edk
 
 from ..responses import (
-    as_dict, get_request_json, get_request_args,
+    as_dict, get_request_json, get_raw_request_json, get_request_args,
     process_args_and_render_json_list, success_json, error_json,
     render_json_obj_with_requested_structure,
     render_json_list_with_requested_structure,
     render_dict_with_requested_structure,
     _serializable_params, serializable_obj, as_json,
-    process_args_and_fetch_rows, convert_result_to_response)
+    process_args_and_fetch_rows, convert_result_to_response,
+    requested_dict_struct, requested_stream_format, streamed_list_response,
+    STREAM_CHUNK_SIZE, RESTRICTED, KEYSET_PAGINATION_ARGS, conditional_response,
+    supports_version_etag, rows_version_etag, request_has_etag,
+    not_modified_response)
 
-from ..utils import remove_empty_values_in_dict, save_file_from_request, convert_to_proper_types
+from ..filter_plans import parse_filters
+from ..validation_plans import compile_schema
+from ..query_booster import KeysetPagination
+from ..response_cache import (
+    register_tagged_cache, tags_version, model_tags, instance_tags,
+    dict_struct_tags, filter_keys_tags, filter_shape_keys)
+
+from ..utils import (
+    save_file_from_request, column_type_converters,
+    convert_rows_using_converters, read_csv_in_chunks, unique_keys_of_model,
+    row_partition, save_rows_as_json_lines, read_json_lines)
 
 from werkzeug.exceptions import Unauthorized
-from six.moves import zip
+from six.moves import zip, range
+
+
+BATCH_SAVE_CHUNK_SIZE = 500
+
+
+def conditional_view(view_func):
+    """Wraps a view so that its successful responses carry an ETag and
+    requests whose If-None-Match matches it get a 304 response.
+    """
+    @functools.wraps(view_func)
+    def conditional_view_func(*args, **kwargs):
+        return conditional_response(view_func(*args, **kwargs))
+    return conditional_view_func
+
 
 def permit_only_allowed_fields(data, fields_allowed_to_be_set=None, fields_forbidden_from_being_set=None):
     if fields_allowed_to_be_set and len(fields_allowed_to_be_set) > 0:
@@ -43,7 +73,10 @@ def construct_get_view_function(
         dict_struct=None, schemas_registry=None, get_query_creator=None,
         enable_caching=False, cache_handler=None, cache_key_determiner=None,
         cache_timeout=None, exception_handler=None, access_checker=None,
-        dict_post_processors=None, id_attr_name=None):
+        dict_post_processors=None, id_attr_name=None, eager_load=True,
+        invalidate_cache_on_write=False, etag=False):
+
+    caching = enable_caching and cache_handler is not None
 
     def get(_id):
         try:
@@ -52,6 +85,15 @@ def construct_get_view_function(
                 id_col_name = id_attr_name
             else:
                 id_col_name = g.args.get('_id_attr')
+            query = None
+            if get_query_creator:
+                query = get_query_creator(model_class.query)
+            if eager_load:
+                # Loading the relationships requested in the dict_struct
+                # along with the instance avoids lazy loading them one by one
+                # while serializing
+                query = (query or model_class.query).eager_load_for_dict_struct(
+                    requested_dict_struct(dict_struct))
             if _id.startswith('[') and _id.endswith(']'):
                 # Handles multiple ids being passed
                 # Eg: /tasks/[1,2,3]
@@ -66,9 +108,8 @@ def construct_get_view_function(
                     ids = [_id[1:-1]]
                 else:
                     ids = json.loads(_id)
-                    if get_query_creator:
-                        resources = get_query_creator(
-                            model_class.query).get_all(ids, key=id_col_name)
+                    if query is not None:
+                        resources = query.get_all(ids, key=id_col_name)
                     else:
                         resources = model_class.get_all(ids, key=id_col_name)
                 if callable(access_checker):
@@ -97,9 +138,9 @@ def construct_get_view_function(
             if permitted_object_getter is not None:
                 obj = permitted_object_getter()
             else:
-                if get_query_creator:
+                if query is not None:
                     id_attr = getattr(model_class, id_col_name) if id_col_name else model_class.primary_key()
-                    obj = get_query_creator(model_class.query).filter(id_attr == _id).first()
+                    obj = query.filter(id_attr == _id).first()
                 else:
                     if id_col_name:
                         obj = model_class.get(_id, key=id_col_name)
@@ -114,7 +155,10 @@ def construct_get_view_function(
                     return error_json(401, message)
             return render_json_obj_with_requested_structure(
                 obj, dict_struct=dict_struct,
-                dict_post_processors=dict_post_processors)
+                dict_post_processors=dict_post_processors,
+                # A 304 must not be stored in the cache in place of the
+                # response. Cached responses are made conditional below.
+                etag=etag and not caching)
 
         except Exception as e:
             if exception_handler:
@@ -122,7 +166,7 @@ def construct_get_view_function(
             traceback.print_exc()
             return error_json(400, e.message)
 
-    if enable_caching and cache_handler is not None:
+    if caching:
         if cache_key_determiner is None:
             def make_key_prefix(func_name):
                 """Make a key that includes GET parameters."""
@@ -133,10 +177,42 @@ def construct_get_view_function(
                 # key = url_for(request.endpoint, **request.args)
                 return key
             cache_key_determiner = make_key_prefix
+        if invalidate_cache_on_write:
+            register_tagged_cache(cache_handler)
+            pk_columns = model_class.__mapper__.primary_key
+            key_determiner = cache_key_determiner
+
+            def cache_tags():
+                tags = dict_struct_tags(
+                    model_class, requested_dict_struct(dict_struct))
+                _id = (request.view_args or {}).get('_id')
+                if (_id is None or permitted_object_getter is not None or
+                        id_attr_name or request.args.get('_id_attr') or
+                        len(pk_columns) != 1):
+                    return tags | model_tags(model_class)
+                _id = _id.strip()
+                if _id.startswith('[') and _id.endswith(']'):
+                    try:
+                        ids = json.loads(_id)
+                    except ValueError:
+                        return tags | model_tags(model_class)
+                else:
+                    ids = [_id]
+                return tags | instance_tags(
+                    model_class, [six.text_type(i) for i in ids])
+
+            def cache_key_determiner(func_name):
+                return "%s#%s" % (
+                    key_determiner(func_name),
+                    tags_version(cache_handler, cache_tags()))
         cached_get = cache_handler.memoize(
             timeout=cache_timeout,
             make_name=cache_key_determiner)(get)
+        if etag:
+            return conditional_view(cached_get)
         return cached_get
+    if etag:
+        return conditional_view(get)
     return get
 
 
@@ -146,7 +222,60 @@ def construct_index_view_function(
         custom_response_creator=None,
         cache_timeout=None, exception_handler=None, access_checker=None,
         default_limit=None, default_sort=None, default_orderby=None,
-        default_offset=None, default_page=None, default_per_page=None):
+        default_offset=None, default_page=None, default_per_page=None,
+        eager_load=True, use_column_projection=True,
+        stream=False, stream_chunk_size=None, keyset_pagination=True,
+        pagination_total=True, pagination_total_cap=None,
+        pagination_total_cache_timeout=None, invalidate_cache_on_write=False,
+        etag=False):
+
+    caching = enable_caching and cache_handler is not None
+
+    def fetch_rows(query_obj, stream_format=None, versions_only=False):
+        return process_args_and_fetch_rows(
+            query_obj,
+            default_limit=default_limit,
+            default_sort=default_sort,
+            default_orderby=default_orderby,
+            default_offset=default_offset,
+            default_page=default_page,
+            default_per_page=default_per_page,
+            dict_struct=dict_struct,
+            eager_load=eager_load,
+            # A custom response creator expects model instances
+            projection=use_column_projection and custom_response_creator is None,
+            yield_per=(stream_chunk_size or STREAM_CHUNK_SIZE) if stream_format else None,
+            keyset_pagination=keyset_pagination,
+            pagination_total=pagination_total,
+            pagination_total_cap=pagination_total_cap,
+            pagination_total_cache_timeout=pagination_total_cache_timeout,
+            pagination_total_cache=cache_handler,
+            versions_only=versions_only)
+
+    def versions_etag(query_obj):
+        # The ETag of the response derived from a query fetching only the
+        # primary keys and versions of the rows. None if the response holds
+        # more than the rows' own attributes.
+        effective_dict_struct = requested_dict_struct(dict_struct)
+        params = _serializable_params(request.args)
+        params.pop('dict_struct', None)
+        if (custom_response_creator is not None or
+                not supports_version_etag(
+                    model_class, dict_struct=effective_dict_struct,
+                    groupby=request.args.get('groupby'), **params)):
+            return None
+        rows = fetch_rows(query_obj, versions_only=True)
+        if isinstance(rows, Response):
+            return None
+        meta = None
+        if isinstance(rows, KeysetPagination):
+            meta = [rows.next_cursor, rows.prev_cursor]
+            rows = rows.items
+        elif isinstance(rows, Pagination):
+            meta = [rows.total, rows.pages]
+            rows = rows.items
+        return rows_version_etag(
+            model_class, rows, dict_struct=effective_dict_struct, meta=meta)
 
     def index():
         try:
@@ -157,19 +286,29 @@ def construct_index_view_function(
             query_obj = model_class
             if callable(index_query_creator):
                 query_obj = index_query_creator(model_class.query)
-            result_rows = process_args_and_fetch_rows(
-                query_obj,
-                default_limit=default_limit,
-                default_sort=default_sort,
-                default_orderby=default_orderby,
-                default_offset=default_offset,
-                default_page=default_page,
-                default_per_page=default_per_page)
+            stream_format = requested_stream_format(
+                stream, default_page=default_page)
+            response_etag = etag
+            if etag and not caching and not stream_format:
+                # A 304 must not be stored in the cache in place of the
+                # response. Cached responses are made conditional below.
+                # Conditional or not, the response gets the same ETag.
+                response_etag = versions_etag(query_obj) or etag
+                if response_etag is not etag and request_has_etag(response_etag):
+                    return not_modified_response(response_etag)
+            result_rows = fetch_rows(query_obj, stream_format=stream_format)
+            if isinstance(result_rows, Response):
+                return result_rows
             if custom_response_creator:
                 response = custom_response_creator(result_rows)
                 if isinstance(response, Response):
                     return response
-            return convert_result_to_response(result_rows, dict_struct=dict_struct)
+            if stream_format:
+                return streamed_list_response(
+                    result_rows, stream_format=stream_format,
+                    chunk_size=stream_chunk_size, dict_struct=dict_struct)
+            return convert_result_to_response(
+                result_rows, dict_struct=dict_struct, etag=response_etag)
 
         except Exception as e:
             if exception_handler:
@@ -177,7 +316,7 @@ def construct_index_view_function(
             traceback.print_exc()
             return error_json(400, e.message)
 
-    if enable_caching and cache_handler is not None:
+    if caching:
         if cache_key_determiner is None:
             def make_key_prefix():
                 """Make a key that includes GET parameters."""
@@ -188,8 +327,42 @@ def construct_index_view_function(
                 # key = url_for(request.endpoint, **request.args)
                 return key
             cache_key_determiner = make_key_prefix
-        return cache_handler.cached(
-            timeout=cache_timeout, key_prefix=cache_key_determiner)(index)
+        if invalidate_cache_on_write:
+            register_tagged_cache(cache_handler)
+            key_determiner = cache_key_determiner
+
+            def cache_tags():
+                tags = model_tags(model_class) | dict_struct_tags(
+                    model_class, requested_dict_struct(dict_struct))
+                filter_keys = [
+                    k.rstrip('<>=!~') for k in request.args
+                    if k not in RESTRICTED and not (
+                        keyset_pagination and k in KEYSET_PAGINATION_ARGS)]
+                if request.args.get('_f'):
+                    try:
+                        _, shape, _ = parse_filters(request.args['_f'])
+                        filter_keys.extend(filter_shape_keys(shape))
+                    except (ValueError, KeyError, TypeError):
+                        # The view responds with an error for these
+                        pass
+                return tags | filter_keys_tags(model_class, filter_keys)
+
+            def cache_key_determiner():
+                return "%s#%s" % (
+                    key_determiner(),
+                    tags_version(cache_handler, cache_tags()))
+        if stream:
+            # Streamed responses cannot be stored in the cache
+            cached_index = cache_handler.cached(
+                timeout=cache_timeout, key_prefix=cache_key_determiner,
+                unless=lambda: requested_stream_format(
+                    stream, default_page=default_page) is not None)(index)
+        else:
+            cached_index = cache_handler.cached(
+                timeout=cache_timeout, key_prefix=cache_key_determiner)(index)
+        if etag:
+            return conditional_view(cached_index)
+        return cached_index
 
     return index
 
@@ -204,12 +377,14 @@ def construct_post_view_function(
         remove_relationship_keys_before_validation=False,
         remove_assoc_proxy_keys_before_validation=False,
         remove_property_keys_before_validation=False,
-        access_checker=None):
+        access_checker=None, validation_plan=None):
+
+    validation_plan = validation_plan or compile_schema(
+        schema, schemas_registry)
 
     def post():
         try:
             request_json = get_request_json()
-            raw_input_data = deepcopy(request_json)
             if callable(access_checker):
                 allowed, message = access_checker()
                 if not allowed:
@@ -257,10 +432,9 @@ def construct_post_view_function(
                     input_data)
                 if isinstance(input_data, Response):
                     return input_data
-                is_valid, errors = validate_list_of_dicts(
-                    input_data, schema, context={"model_class": model_class},
-                    allow_unknown_fields=allow_unknown_fields,
-                    schemas_registry=schemas_registry)
+                is_valid, errors = validation_plan.validate_list_of_dicts(
+                    input_data, context={"model_class": model_class},
+                    allow_unknown_fields=allow_unknown_fields)
                 input_objs = input_data
                 if not is_valid:
                     input_objs = [
@@ -310,14 +484,15 @@ def construct_post_view_function(
                 input_data = model_class.pre_validation_adapter(input_data)
                 if isinstance(input_data, Response):
                     return input_data
-                is_valid, errors = validate_dict(
-                    input_data, schema, context={"model_class": model_class},
-                    schemas_registry=schemas_registry,
+                is_valid, errors = validation_plan.validate_dict(
+                    input_data, context={"model_class": model_class},
                     allow_unknown_fields=allow_unknown_fields)
                 if not is_valid:
                     return error_json(400, errors)
                 obj = model_class.create(**input_data)
                 if post_processors is not None:
+                    # The input as it was sent, parsed again from the body
+                    raw_input_data = get_raw_request_json()
                     for processor in post_processors:
                         if callable(processor):
                             processed_obj = processor(
@@ -360,7 +535,11 @@ def construct_put_view_function(
         fields_forbidden_from_being_set=None, remove_relationship_keys_before_validation=False,
         remove_assoc_proxy_keys_before_validation=False,
         remove_property_keys_before_validation=False,
-        exception_handler=None):
+        exception_handler=None, validation_plan=None):
+
+    validation_plan = validation_plan or compile_schema(
+        schema, schemas_registry)
+
     def put(_id):
         try:
             if permitted_object_getter is not None:
@@ -378,9 +557,7 @@ def construct_put_view_function(
                 allowed, message = access_checker(obj)
                 if not allowed:
                     return error_json(401, message)
-            request_json = get_request_json()
-            raw_input_data = deepcopy(request_json)
-            input_data = request_json
+            input_data = get_request_json()
             if pre_processors is not None:
                 for processor in pre_processors:
                     if callable(processor):
@@ -414,18 +591,18 @@ def construct_put_view_function(
             if polymorphic_field:
                 if polymorphic_field not in input_data:
                     input_data[polymorphic_field] = getattr(obj, polymorphic_field)
-            is_valid, errors = validate_dict(
-                input_data, schema, allow_required_fields_to_be_skipped=True,
+            is_valid, errors = validation_plan.validate_dict(
+                input_data, allow_required_fields_to_be_skipped=True,
                 allow_unknown_fields=allow_unknown_fields,
                 context={"existing_instance": obj,
-                         "model_class": model_class},
-                schemas_registry=schemas_registry)
+                         "model_class": model_class})
             if not is_valid:
                 return error_json(400, errors)
             pre_modification_data = obj.todict(dict_struct={"rels": {}})
             updated_obj = obj.update(**input_data)
             print("got post processors as ", post_processors)
             if post_processors is not None:
+                raw_input_data = get_raw_request_json()
                 for processor in post_processors:
                     if callable(processor):
                         processed_updated_obj = processor(
@@ -601,6 +778,14 @@ def construct_delete_view_function(
     return delete
 
 
+def copy_input_row(row):
+    """Copies a row of batch input, deeply only if it has nested values."""
+    if isinstance(row, dict) and not any(
+            isinstance(v, (dict, list)) for v in six.itervalues(row)):
+        return dict(row)
+    return deepcopy(row)
+
+
 def get_result_dict_from_response(rsp):
     response = rsp.response
     if isinstance(response, list) and len(response) > 0:
@@ -625,21 +810,37 @@ def construct_batch_save_view_function(
         result_saving_instance_getter=None,
         run_as_async_task=False,
         update_only=False, create_only=False,
-        skip_pre_processors=False, skip_post_processors=False):
+        skip_pre_processors=False, skip_post_processors=False,
+        set_based=False, chunk_size=None, stream_csv_input=False,
+        parallel_workers=None, validation_plan=None):
 
-    def determine_response_for_input_row(
+    if parallel_workers and run_as_async_task and not celery_worker:
+        raise ValueError(
+            "parallel_workers with run_as_async_task needs a celery_worker for "
+            "the batch save of {0}".format(model_class.__name__))
+    batch_executor = None
+    if parallel_workers and not run_as_async_task:
+        # The pool is started once with the route, not per request
+        from concurrent.futures import ThreadPoolExecutor
+        batch_executor = ThreadPoolExecutor(max_workers=parallel_workers)
+    chunk_size = chunk_size or BATCH_SAVE_CHUNK_SIZE
+    validation_plan = validation_plan or compile_schema(
+        schema, schemas_registry)
+
+    def prepare_input_row(
             input_row, existing_instance, raw_input_row,
             result_saving_instance=None, update_only=False, create_only=False,
-            skip_pre_processors=False, skip_post_processors=False):
+            skip_pre_processors=False):
+        # Returns the validated input row, or a failure response for it
         if existing_instance and create_only:
-            return {
+            return None, {
                 "status": "failure",
                 "code": 401,
                 "error": "Cannot create a new instance as a matching instance is existing",
                 "input": raw_input_row
             }
         if not existing_instance and update_only:
-            return {
+            return None, {
                 "status": "failure",
                 "code": 404,
                 "error": "No matching instance found",
@@ -648,7 +849,7 @@ def construct_batch_save_view_function(
         if existing_instance and callable(access_checker):
             allowed, message = access_checker(existing_instance)
             if not allowed:
-                return {
+                return None, {
                     "status": "failure",
                     "code": 401,
                     "error": message,
@@ -666,14 +867,14 @@ def construct_batch_save_view_function(
                             response = get_result_dict_from_response(
                                 process_result)
                             if response:
-                                return merge(response, {"input": raw_input_row})
+                                return None, merge(response, {"input": raw_input_row})
 
         modified_input_row = model_class.pre_validation_adapter(
             input_row, existing_instance)
         if isinstance(modified_input_row, Response):
             response = get_result_dict_from_response(modified_input_row)
             if response:
-                return merge(response, {"input": raw_input_row})
+                return None, merge(response, {"input": raw_input_row})
         input_row = modified_input_row
 
         polymorphic_field = schema.get('polymorphic_on')
@@ -681,24 +882,23 @@ def construct_batch_save_view_function(
             if polymorphic_field not in input_row:
                 input_row[polymorphic_field] = getattr(
                     existing_instance, polymorphic_field)
-        is_valid, errors = validate_dict(
-            input_row, schema, allow_required_fields_to_be_skipped=True,
+        is_valid, errors = validation_plan.validate_dict(
+            input_row, allow_required_fields_to_be_skipped=True,
             allow_unknown_fields=allow_unknown_fields,
             context={"existing_instance": existing_instance,
-                     "model_class": model_class},
-            schemas_registry=schemas_registry)
+                     "model_class": model_class})
         if not is_valid:
-            return {
+            return None, {
                 "status": "failure",
                 "code": 401,
                 "error": errors,
                 "input": raw_input_row
             }
+        return input_row, None
 
-        pre_modification_data = existing_instance.todict(
-            dict_struct={"rels": {}}) if existing_instance else None
-        obj = existing_instance.update(
-            **input_row) if existing_instance else model_class.create(**input_row)
+    def respond_for_saved_row(
+            obj, existing_instance, input_row, raw_input_row,
+            pre_modification_data=None, skip_post_processors=False):
         if not skip_post_processors:
             post_processors = post_processors_for_put if existing_instance else post_processors_for_post
             if post_processors is not None:
@@ -719,11 +919,127 @@ def construct_batch_save_view_function(
             {"input": raw_input_row}
         )
 
-    def process_batch_input_data(
-            input_data, result_saving_instance=None, update_only=False, create_only=False,
+    def determine_response_for_input_row(
+            input_row, existing_instance, raw_input_row,
+            result_saving_instance=None, update_only=False, create_only=False,
             skip_pre_processors=False, skip_post_processors=False):
+        input_row, failure_response = prepare_input_row(
+            input_row, existing_instance, raw_input_row,
+            result_saving_instance=result_saving_instance,
+            update_only=update_only, create_only=create_only,
+            skip_pre_processors=skip_pre_processors)
+        if failure_response is not None:
+            return failure_response
+
+        pre_modification_data = existing_instance.todict(
+            dict_struct={"rels": {}}) if existing_instance else None
+        obj = existing_instance.update(
+            **input_row) if existing_instance else model_class.create(**input_row)
+        return respond_for_saved_row(
+            obj, existing_instance, input_row, raw_input_row,
+            pre_modification_data=pre_modification_data,
+            skip_post_processors=skip_post_processors)
+
+    def failure_response_for_error(error, raw_input_row):
+        return {
+            "status": "failure",
+            "code": 400,
+            "error": six.text_type(error),
+            "input": raw_input_row
+        }
+
+    def stage_row(input_row, existing_instance):
+        if existing_instance:
+            return existing_instance.update_without_commit(**input_row)
+        obj = model_class.new(**input_row)
+        model_class.session.add(obj)
+        return obj
 
-        raw_input_data = deepcopy(input_data)
+    def commit_staged_rows():
+        # Returns the error if the flush or the commit fails, after rolling
+        # back the session
+        session = model_class.session
+        try:
+            session.flush()
+            session.commit()
+        except Exception as e:
+            session.rollback()
+            return e
+        return None
+
+    def determine_responses_for_chunk(
+            chunk, result_saving_instance=None, update_only=False, create_only=False,
+            skip_pre_processors=False, skip_post_processors=False):
+        # Set based saving. All the rows of the chunk are validated and staged
+        # in the session, then flushed and committed together. If the flush or
+        # the commit fails, the chunk is rolled back and its rows are saved
+        # again one by one, so that only the rows which cannot be saved fail.
+        # The post processors run once the rows are committed.
+        session = model_class.session
+        responses = [None] * len(chunk)
+        staged = []
+        with session.no_autoflush:
+            for idx, (input_row, existing_instance, raw_input_row) in enumerate(chunk):
+                try:
+                    input_row, failure_response = prepare_input_row(
+                        input_row, existing_instance, raw_input_row,
+                        result_saving_instance=result_saving_instance,
+                        update_only=update_only, create_only=create_only,
+                        skip_pre_processors=skip_pre_processors)
+                    if failure_response is not None:
+                        responses[idx] = failure_response
+                        continue
+                    pre_modification_data = existing_instance.todict(
+                        dict_struct={"rels": {}}) if existing_instance else None
+                    obj = stage_row(input_row, existing_instance)
+                    staged.append((
+                        idx, obj, existing_instance, input_row, raw_input_row,
+                        pre_modification_data))
+                except Exception as e:
+                    if existing_instance:
+                        # Discards the changes made to it before the failure
+                        session.expire(existing_instance)
+                    responses[idx] = failure_response_for_error(e, raw_input_row)
+        error = commit_staged_rows()
+        if error is not None:
+            saved = []
+            for (idx, obj, existing_instance, input_row, raw_input_row,
+                    pre_modification_data) in staged:
+                if len(staged) > 1:
+                    try:
+                        with session.no_autoflush:
+                            obj = stage_row(input_row, existing_instance)
+                        error = commit_staged_rows()
+                    except Exception as e:
+                        session.rollback()
+                        error = e
+                if error is not None:
+                    responses[idx] = failure_response_for_error(
+                        error, raw_input_row)
+                else:
+                    saved.append((
+                        idx, obj, existing_instance, input_row, raw_input_row,
+                        pre_modification_data))
+            staged = saved
+        for (idx, obj, existing_instance, input_row, raw_input_row,
+                pre_modification_data) in staged:
+            try:
+                responses[idx] = respond_for_saved_row(
+                    obj, existing_instance, input_row, raw_input_row,
+                    pre_modification_data=pre_modification_data,
+                    skip_post_processors=skip_post_processors)
+            except Exception as e:
+                responses[idx] = failure_response_for_error(e, raw_input_row)
+        return responses
+
+    def process_batch_input_data(
+            input_data, result_saving_instance=None, update_only=False, create_only=False,
+            skip_pre_processors=False, skip_post_processors=False,
+            raw_input_data=None):
+        # raw_input_data holds the rows as they were sent, to be echoed in
+        # the responses. It is copied from input_data if not given.
+        if raw_input_data is None:
+            raw_input_data = [copy_input_row(row) for row in input_data]
 
         fields_to_be_removed = union([
             fields_forbidden_from_being_set or [],
@@ -744,19 +1060,19 @@ def construct_batch_save_view_function(
 
         # Identifying which instance to update using some other key apart from the primary key
         if unique_identifier_fields:
+            matches = model_class.find_all_by_keys([
+                input_row if existing_instance is None and all(
+                    input_row.get(f) is not None for f in unique_identifier_fields)
+                else None
+                for input_row, existing_instance in zip(input_data, existing_instances)
+            ], unique_identifier_fields)
             for idx, input_row in enumerate(input_data):
-                existing_instance = existing_instances[idx]
-                if existing_instance is None:
-                    if all(input_row.get(f) is not None for f in unique_identifier_fields):
-                        filter_kwargs = {f: input_row.get(
-                            f) for f in unique_identifier_fields}
-                        existing_instances[idx] = model_class.query.filter_by(
-                            **filter_kwargs).first()
-                        if existing_instances[idx]:
-                            # Setting the primary key value in the dict so that the
-                            # corresponding instance would be updated
-                            input_row[primary_key_name] = getattr(
-                                existing_instances[idx], primary_key_name)
+                if matches[idx] is not None:
+                    existing_instances[idx] = matches[idx]
+                    # Setting the primary key value in the dict so that the
+                    # corresponding instance would be updated
+                    input_row[primary_key_name] = getattr(
+                        matches[idx], primary_key_name)
 
         if callable(access_checker):
             allowed, message = access_checker()
@@ -769,6 +1085,20 @@ def construct_batch_save_view_function(
 
         responses = []
 
+        if set_based:
+            rows = list(zip(input_data, existing_instances, raw_input_data))
+            for start in range(0, len(rows), chunk_size):
+                responses.extend(determine_responses_for_chunk(
+                    rows[start:start + chunk_size],
+                    result_saving_instance=result_saving_instance,
+                    update_only=update_only, create_only=create_only,
+                    skip_pre_processors=skip_pre_processors,
+                    skip_post_processors=skip_post_processors))
+            return {
+                "status": "success",
+                "result": responses
+            }
+
         for input_row, existing_instance, raw_input_row in zip(input_data, existing_instances, raw_input_data):
             try:
                 responses.append(
@@ -793,10 +1123,32 @@ def construct_batch_save_view_function(
         }
         return consolidated_result
 
+    def process_batch_input_file(
+            input_file_path, result_saving_instance=None,
+            update_only=False, create_only=False,
+            skip_pre_processors=False, skip_post_processors=False):
+        # Reads and saves the CSV file one chunk at a time so that only a
+        # chunk of the input rows is held in memory at once
+        converters = column_type_converters(model_class)
+        responses = []
+        for _, rows in read_csv_in_chunks(input_file_path, chunk_size):
+            chunk_result = process_batch_input_data(
+                convert_rows_using_converters(rows, converters),
+                result_saving_instance,
+                update_only=update_only, create_only=create_only,
+                skip_pre_processors=skip_pre_processors,
+                skip_post_processors=skip_post_processors)
+            responses.extend(chunk_result["result"])
+        return {
+            "status": "success",
+            "result": responses
+        }
+
     def async_process_batch_input_data(
             input_data, result_saving_instance_id=None,
             update_only=False, create_only=False,
-            skip_pre_processors=False, skip_post_processors=False):
+            skip_pre_processors=False, skip_post_processors=False,
+            input_file_path=None):
         try:
             result_saving_instance = None
             if result_saving_instance_id and result_saving_instance_model:
@@ -805,11 +1157,18 @@ def construct_batch_save_view_function(
             if result_saving_instance:
                 result_saving_instance.mark_as_started()
                 # result_saving_instance.pre_process_input_data(input_data)
-            response = process_batch_input_data(
-                input_data, result_saving_instance,
-                update_only=update_only, create_only=create_only,
-                skip_pre_processors=skip_pre_processors,
-                skip_post_processors=skip_post_processors)
+            if input_file_path:
+                response = process_batch_input_file(
+                    input_file_path, result_saving_instance,
+                    update_only=update_only, create_only=create_only,
+                    skip_pre_processors=skip_pre_processors,
+                    skip_post_processors=skip_post_processors)
+            else:
+                response = process_batch_input_data(
+                    input_data, result_saving_instance,
+                    update_only=update_only, create_only=create_only,
+                    skip_pre_processors=skip_pre_processors,
+                    skip_post_processors=skip_post_processors)
             if result_saving_instance:
                 result_saving_instance.save_response_data(response)
         except Exception as e:
@@ -817,9 +1176,98 @@ def construct_batch_save_view_function(
             if exception_handler:
                 return exception_handler(e)
 
+    def read_batch_input_rows(
+            input_data=None, input_file_path=None, json_lines=False):
+        # Yields the rows of a batch with their positions in the input. The
+        # rows are taken from input_data, or streamed from the CSV file or
+        # the JSON lines file holding the rows of a JSON request
+        if input_data is not None:
+            for idx, row in enumerate(input_data):
+                yield idx, row
+        elif json_lines:
+            for idx, row in enumerate(read_json_lines(input_file_path)):
+                yield idx, row
+        else:
+            converters = column_type_converters(model_class)
+            idx = 0
+            for _, rows in read_csv_in_chunks(input_file_path, chunk_size):
+                for row in convert_rows_using_converters(rows, converters):
+                    yield idx, row
+                    idx += 1
+
+    def process_batch_partition(
+            partition, partitions, input_data=None, input_file_path=None,
+            json_lines=False, raw_input_data=None,
+            result_saving_instance_id=None,
+            update_only=False, create_only=False,
+            skip_pre_processors=False, skip_post_processors=False):
+        # Saves one of the partitions of a batch which is fanned out to
+        # several workers. Every worker streams the whole input and keeps the
+        # rows hashing to its partition, saving them chunk_size rows at a
+        # time. Returns the positions of the rows in the input along with
+        # their responses.
+        result_saving_instance = None
+        try:
+            if result_saving_instance_id and result_saving_instance_model:
+                result_saving_instance = result_saving_instance_model.get(
+                    result_saving_instance_id)
+            if result_saving_instance:
+                result_saving_instance.mark_as_started()
+            keys = unique_keys_of_model(model_class, unique_identifier_fields)
+            rows_of_partition = (
+                (idx, row) for idx, row in read_batch_input_rows(
+                    input_data, input_file_path, json_lines=json_lines)
+                if row_partition(row, idx, keys, partitions) == partition)
+            responses = []
+            while True:
+                chunk = list(islice(rows_of_partition, chunk_size))
+                if not chunk:
+                    break
+                indices = [idx for idx, _ in chunk]
+                chunk_result = process_batch_input_data(
+                    [row for _, row in chunk], result_saving_instance,
+                    update_only=update_only, create_only=create_only,
+                    skip_pre_processors=skip_pre_processors,
+                    skip_post_processors=skip_post_processors,
+                    raw_input_data=[raw_input_data[idx] for idx in indices]
+                    if raw_input_data is not None else None)
+                responses.extend(
+                    [idx, response] for idx, response in zip(
+                        indices, chunk_result["result"]))
+            return responses
+        except Exception as e:
+            if result_saving_instance:
+                result_saving_instance.record_exception(e)
+            if exception_handler:
+                exception_handler(e)
+            raise
+
+    def merge_batch_partition_results(
+            partition_results, result_saving_instance_id=None):
+        # Puts the responses of all the partitions back in input order
+        consolidated_result = {
+            "status": "success",
+            "result": [
+                response for _, response in sorted(
+                    (pair for partition_result in partition_results
+                     for pair in partition_result),
+                    key=lambda pair: pair[0])]
+        }
+        if result_saving_instance_id and result_saving_instance_model:
+            result_saving_instance = result_saving_instance_model.get(
+                result_saving_instance_id)
+            if result_saving_instance:
+                result_saving_instance.save_response_data(consolidated_result)
+        return consolidated_result
+
     if celery_worker and run_as_async_task:
         async_process_batch_input_data = celery_worker.task(name="crud_{0}_bs_{1}".format(
             app_or_bp.name, model_class.__tablename__))(async_process_batch_input_data)
+        if parallel_workers:
+            process_batch_partition = celery_worker.task(name="crud_{0}_bs_{1}_partition".format(
+                app_or_bp.name, model_class.__tablename__))(process_batch_partition)
+            merge_batch_partition_results = celery_worker.task(name="crud_{0}_bs_{1}_merge".format(
+                app_or_bp.name, model_class.__tablename__))(merge_batch_partition_results)
 
     def batch_save():
 
@@ -829,16 +1277,15 @@ def construct_batch_save_view_function(
         _create_only = create_only
         _skip_pre_processors = skip_pre_processors
         _skip_post_processors = skip_post_processors
+        input_data = None
         if request.headers['Content-Type'].startswith("multipart/form-data"):
             data_file_path = save_file_from_request(
                 request.files['file'], location=tmp_folder_path)
-            with open(data_file_path) as csv_file:
-                csv_reader = csv.DictReader(csv_file)
-                rows = [r for r in csv_reader]
-                rows = [convert_to_proper_types(
-                    remove_empty_values_in_dict(row),
-                    model_class) for row in rows]
-                input_data = rows
+            if not (stream_csv_input or parallel_workers):
+                converters = column_type_converters(model_class)
+                with open(data_file_path) as csv_file:
+                    input_data = convert_rows_using_converters(
+                        csv.DictReader(csv_file), converters)
             if request.form:
                 _update_only = request.form.get('update_only') or update_only
                 _create_only = request.form.get('create_only') or update_only
@@ -847,14 +1294,63 @@ def construct_batch_save_view_function(
         else:
             input_data = get_request_json()
 
+        partition_kwargs = dict(
+            update_only=_update_only, create_only=_create_only,
+            skip_pre_processors=_skip_pre_processors,
+            skip_post_processors=_skip_post_processors)
+
+        if parallel_workers and run_as_async_task:
+            result_saving_instance = result_saving_instance_getter(
+                input_data=input_data, input_file_path=data_file_path) if callable(result_saving_instance_getter) else None
+            result_saving_instance_id = result_saving_instance.id if result_saving_instance else None
+            if data_file_path is None:
+                # Only file paths go to the workers, never the rows
+                data_file_path = save_rows_as_json_lines(
+                    input_data, location=tmp_folder_path)
+                partition_kwargs.update(json_lines=True)
+            from celery import chord
+            chord(
+                process_batch_partition.s(
+                    partition, parallel_workers, input_file_path=data_file_path,
+                    result_saving_instance_id=result_saving_instance_id,
+                    **partition_kwargs)
+                for partition in range(parallel_workers)
+            )(merge_batch_partition_results.s(
+                result_saving_instance_id=result_saving_instance_id))
+            if result_saving_instance:
+                return render_json_obj_with_requested_structure(result_saving_instance)
+            return success_json()
+
+        if parallel_workers:
+            # Each partition is saved by a thread of the pool, in a copy of the
+            # request context, so with an app context and a session of its own
+            if data_file_path is None:
+                partition_kwargs.update(
+                    input_data=input_data, raw_input_data=get_raw_request_json())
+            else:
+                partition_kwargs.update(input_file_path=data_file_path)
+            futures = [
+                batch_executor.submit(
+                    copy_current_request_context(process_batch_partition),
+                    partition, parallel_workers, **partition_kwargs)
+                for partition in range(parallel_workers)]
+            try:
+                consolidated_result = merge_batch_partition_results(
+                    [future.result() for future in futures])
+            except Unauthorized as e:
+                return error_json(401, e.description)
+            return as_json(consolidated_result, wrap=False)
+
         if run_as_async_task:
             result_saving_instance = result_saving_instance_getter(
                 input_data=input_data, input_file_path=data_file_path) if callable(result_saving_instance_getter) else None
+            # When streaming, only the path of the file goes to the worker
             async_process_batch_input_data.delay(
                 input_data, result_saving_instance_id=result_saving_instance.id,
                 update_only=_update_only, create_only=_create_only,
                 skip_pre_processors=_skip_pre_processors,
-                skip_post_processors=_skip_post_processors)
+                skip_post_processors=_skip_post_processors,
+                input_file_path=data_file_path if input_data is None else None)
             if result_saving_instance:
                 return render_json_obj_with_requested_structure(result_saving_instance)
             else:
@@ -870,10 +1366,19 @@ def construct_batch_save_view_function(
         #     return success_json()
         else:
             try:
-                consolidated_result = process_batch_input_data(
-                    input_data, update_only=_update_only, create_only=_create_only,
-                    skip_pre_processors=_skip_pre_processors,
-                    skip_post_processors=_skip_post_processors)
+                if input_data is None:
+                    consolidated_result = process_batch_input_file(
+                        data_file_path, update_only=_update_only,
+                        create_only=_create_only,
+                        skip_pre_processors=_skip_pre_processors,
+                        skip_post_processors=_skip_post_processors)
+                else:
+                    consolidated_result = process_batch_input_data(
+                        input_data, update_only=_update_only, create_only=_create_only,
+                        skip_pre_processors=_skip_pre_processors,
+                        skip_post_processors=_skip_post_processors,
+                        raw_input_data=get_raw_request_json()
+                        if data_file_path is None else None)
             except Unauthorized as e:
                 return error_json(401, e.description)
 
@@ -40,4 +40,14 @@ DEFAULT_SORT = 'default_sort'
 DEFAULT_ORDERBY = 'default_orderby'
 DEFAULT_OFFSET = 'default_offset'
 DEFAULT_PAGE = 'default_page'
-DEFAULT_PER_PAGE = 'default_per_page'
\ No newline at end of file
+DEFAULT_PER_PAGE = 'default_per_page'
+EAGER_LOAD = 'eager_load'
+USE_COLUMN_PROJECTION = 'use_column_projection'
+STREAM = 'stream'
+STREAM_CHUNK_SIZE = 'stream_chunk_size'
+KEYSET_PAGINATION = 'keyset_pagination'
+PAGINATION_TOTAL = 'pagination_total'
+PAGINATION_TOTAL_CAP = 'pagination_total_cap'
+PAGINATION_TOTAL_CACHE_TIMEOUT = 'pagination_total_cache_timeout'
+INVALIDATE_CACHE_ON_WRITE = 'invalidate_cache_on_write'
+ETAG = 'etag'
\ No newline at end of file
@@ -0,0 +1,217 @@
+"""filter_plans
+Compiled plans for the `_f` filter language.
+
+A filter tree is split into its shape (the connectors, keys, operators and
+negations) and its values. A plan is compiled once per shape, for a given
+model class and set of already joined entities: it holds the joins to be
+added to the query and, for every key, the attributes to compare and the
+type to coerce the value to. Applying a filter whose shape has been seen
+before only coerces and binds the values.
+
+"""
+
+from __future__ import absolute_import
+from flask.json import _json
+from sqlalchemy import or_, and_, not_
+import six
+
+from .utils import value_coercer, coerce_values
+
+
+MAX_CACHED_FILTER_PLANS = 1024
+
+OPERATOR_FUNC = {
+    '~': 'ilike', '=': '__eq__', '>': '__gt__', '<': '__lt__',
+    '>=': '__ge__', '<=': '__le__', '!': '__ne__', '!=': '__ne__',
+    'in': 'in_'
+}
+
+COERCED_OPERATORS = ('=', '>', '<', '>=', '<=', '!', '!=')
+
+_plans_cache = {}
+_parsed_filters_cache = {}
+
+
+def _add_to_cache(cache, key, value):
+    if len(cache) >= MAX_CACHED_FILTER_PLANS:
+        cache.clear()
+    cache[key] = value
+
+
+def filters_shape_and_values(filters, connector):
+    """Splits a list of filters joined by the connector into a hashable
+    shape and the list of values, in the order of the keys in the shape.
+    """
+    values = []
+
+    def shape_of(filters, connector):
+        children = []
+        for f in filters:
+            if "c" in f:
+                children.append(shape_of(f['f'], f['c']))
+            else:
+                children.append((f["k"], f["op"], bool(f.get("neg"))))
+                values.append(f["v"])
+        return (connector, tuple(children))
+
+    return shape_of(filters, connector), values
+
+
+def parse_filters(filters_json):
+    """Parses the value of the `_f` argument, which may be JSON encoded
+    twice. Returns a tuple of the filters dict, its shape and its values.
+    Parsed arguments are cached, so repeated requests skip the parsing.
+    """
+    parsed = _parsed_filters_cache.get(filters_json)
+    if parsed is None:
+        filters = _json.loads(filters_json)
+        if isinstance(filters, six.string_types):
+            filters = _json.loads(filters)
+        shape, values = filters_shape_and_values(
+            filters['f'], filters.get('c') or 'AND')
+        parsed = (filters, shape, values)
+        _add_to_cache(_parsed_filters_cache, filters_json, parsed)
+    return parsed
+
+
+class _Joins(object):
+    # The joins added by a plan, along with the entities they make
+    # available, so that a key joins an entity only if no earlier key or the
+    # query itself has joined it.
+
+    def __init__(self, joined_classes):
+        self.targets = []
+        self.joined_classes = list(joined_classes)
+
+    def join(self, target, joined_class):
+        self.targets.append(target)
+        self.joined_classes.append(joined_class)
+
+    def join_if_needed(self, target, joined_class):
+        if joined_class not in self.joined_classes:
+            self.join(target, joined_class)
+
+    def checkpoint(self):
+        return (len(self.targets), len(self.joined_classes))
+
+    def rollback(self, checkpoint):
+        del self.targets[checkpoint[0]:]
+        del self.joined_classes[checkpoint[1]:]
+
+
+class _LeafPlan(object):
+
+    def __init__(self, root_class, keyword, op, negate, joins):
+        self.op = op
+        self.negate = negate
+        self.operator_func = OPERATOR_FUNC[op]
+        path = root_class.filter_key_path(keyword)
+        if path is None:
+            raise ValueError("Cannot resolve the filter key %s" % keyword)
+        checkpoint = joins.checkpoint()
+        for target, joined_class, only_if_not_joined in path.joins:
+            if only_if_not_joined:
+                joins.join_if_needed(target, joined_class)
+            else:
+                joins.join(target, joined_class)
+        self.coerce = path.column_type is not None
+        self.coercer = value_coercer(path.column_type)
+        if path.attr is not None:
+            self.attrs = [path.attr]
+            self.disjunction = False
+        else:
+            self.attrs = []
+            self.disjunction = True
+            for subcls, subcls_attr in path.subclass_attrs:
+                if '.' in keyword:
+                    joins.join_if_needed(subcls, subcls)
+                self.attrs.append(subcls_attr)
+            if len(self.attrs) == 0:
+                # Unresolvable keys neither filter nor join
+                joins.rollback(checkpoint)
+
+    def bind(self, value):
+        if len(self.attrs) == 0:
+            return None
+        if self.op == '~':
+            value = "%{0}%".format(value)
+        if self.op in COERCED_OPERATORS:
+            if self.coerce and value is not None and not isinstance(value, bool):
+                value = self.coercer(value)
+        elif self.op == 'in':
+            value = coerce_values(self.coercer, value)
+        fltrs = []
+        for attr in self.attrs:
+            fltr = getattr(attr, self.operator_func)(value)
+            if self.negate:
+                fltr = not_(fltr)
+            fltrs.append(fltr)
+        if self.disjunction:
+            return or_(*fltrs)
+        return fltrs[0]
+
+
+class _GroupPlan(object):
+
+    def __init__(self, root_class, shape, joins):
+        self.connector, children = shape
+        self.children = [
+            _GroupPlan(root_class, child, joins) if len(child) == 2
+            else _LeafPlan(root_class, child[0], child[1], child[2], joins)
+            for child in children]
+
+    def bind(self, values):
+        sqfilters = []
+        for child in self.children:
+            if isinstance(child, _GroupPlan):
+                sub_sq_filter = child.bind(values)
+                if sub_sq_filter is not None:
+                    sqfilters.append(sub_sq_filter)
+            else:
+                sqfilters.append(child.bind(next(values)))
+        if len(sqfilters) > 0:
+            if self.connector == 'AND':
+                return and_(*sqfilters)
+            if self.connector == 'OR':
+                return or_(*sqfilters)
+        return None
+
+
+class FilterPlan(object):
+    """The joins and the filter expression builders for one filter shape.
+    Use `get_filter_plan` to obtain a cached instance instead of constructing
+    one directly.
+    """
+
+    def __init__(self, model_class, shape, joined_classes=()):
+        joins = _Joins(joined_classes)
+        self.root = _GroupPlan(model_class, shape, joins)
+        self.joins = list(joins.targets)
+
+    def apply(self, query, values):
+        """Adds the joins of the plan to the query and filters it with the
+        values bound to the keys of the shape.
+        """
+        for target in self.joins:
+            query = query.join(target)
+        sqfilter = self.root.bind(iter(values))
+        if sqfilter is not None:
+            query = query.filter(sqfilter)
+        return query
+
+
+def get_filter_plan(model_class, shape, joined_classes=()):
+    """Returns the cached `FilterPlan` for the shape, compiling it on first
+    use.
+    """
+    key = (model_class, tuple(joined_classes), shape)
+    plan = _plans_cache.get(key)
+    if plan is None:
+        plan = FilterPlan(model_class, shape, joined_classes)
+        _add_to_cache(_plans_cache, key, plan)
+    return plan
+
+
+def clear_filter_plans():
+    _plans_cache.clear()
+    _parsed_filters_cache.clear()
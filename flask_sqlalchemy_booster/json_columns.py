@@ -2,17 +2,18 @@ from __future__ import absolute_import
 from sqlalchemy.types import TypeDecorator, TEXT
 from sqlalchemy.ext.mutable import Mutable
 from flask.json import _json as json
-from .json_encoder import json_encoder
+from .json_encoder import default_json_dumps
 
 
 class JSONEncodedStruct(TypeDecorator):
-    "Represents an immutable structure as a json-encoded string."
+    """Represents an immutable structure as a json-encoded string, dumped
+    with the default JSON backend (see `json_encoder.set_json_backend`)."""
 
     impl = TEXT
 
     def process_bind_param(self, value, dialect):
         if value is not None:
-            value = json.dumps(value, default=json_encoder)
+            value = default_json_dumps(value)
         return value
 
     def process_result_value(self, value, dialect):
@@ -1,39 +1,136 @@
 from __future__ import absolute_import
-from datetime import datetime
+from datetime import datetime, date, time
 from decimal import Decimal
+from uuid import UUID
+from flask import current_app, has_app_context
 from flask.json import _json
 from toolspy import dict_map
-from .utils import is_list_like, is_dict_like
+from .utils import LIST_LIKE_TYPES, DICT_LIKE_TYPES
 from collections import OrderedDict
 from types import FunctionType
+import importlib
+import warnings
 import six
 from past.builtins import long
 
 
+def _encode_datetime(obj):
+    return obj.isoformat()
+
+
+def _encode_as_is(obj):
+    return obj
+
+
+def _encode_decimal(obj):
+    return float(obj)
+
+
+def _encode_ordered_dict(obj):
+    return [[k, json_encoder(v)]
+            for k, v in obj.items()
+            if not (k == 'key' and isinstance(v, FunctionType))]
+
+
+def _encode_with_todict(obj):
+    return obj.todict()
+
+
+def _encode_list_like(obj):
+    return [json_encoder(i) for i in obj]
+
+
+def _encode_dict_like(obj):
+    return dict_map(obj, lambda v: json_encoder(v))
+
+
+def _encode_as_text(obj):
+    try:
+        return _json.JSONEncoder().default(obj)
+    except:
+        return six.text_type(obj)
+
+
+# Encoders keyed by type. The encoder of a value is the one registered for
+# the first class in its MRO which has one.
+_json_encoders = {
+    datetime: _encode_datetime,
+    int: _encode_as_is,
+    long: _encode_as_is,
+    float: _encode_as_is,
+    Decimal: _encode_decimal,
+    six.text_type: _encode_as_is,
+    OrderedDict: _encode_ordered_dict,
+}
+
+# The encoders resolved for every type seen so far
+_json_encoders_by_type = {}
+
+# The builtin encoders, and the types whose encoders differ from them.
+# Backends encoding some types natively cannot apply those encoders.
+_default_json_encoders = dict(_json_encoders)
+_types_with_custom_encoders = ()
+
+
+def _reset_json_encoders_caches():
+    global _types_with_custom_encoders
+    _json_encoders_by_type.clear()
+    _types_with_custom_encoders = tuple(
+        type_ for type_, encoder in _json_encoders.items()
+        if encoder is not _default_json_encoders.get(type_))
+
+
+def _resolve_json_encoder(cls):
+    for klass in cls.__mro__:
+        if klass in _json_encoders:
+            return _json_encoders[klass]
+    if hasattr(cls, 'todict'):
+        return _encode_with_todict
+    if issubclass(cls, LIST_LIKE_TYPES):
+        return _encode_list_like
+    if issubclass(cls, DICT_LIKE_TYPES):
+        return _encode_dict_like
+    return _encode_as_text
+
+
+def register_json_encoder(type_, encoder=None):
+    """Registers the function which converts the instances of `type_` (and
+    of its subclasses, unless they have their own) to JSON serializable
+    values. Can be used as a decorator.
+
+    >>> @register_json_encoder(Money)
+    ... def encode_money(money):
+    ...     return {"amount": money.amount, "currency": money.currency}
+    """
+    if encoder is None:
+        def decorator(encoder):
+            register_json_encoder(type_, encoder)
+            return encoder
+        return decorator
+    _json_encoders[type_] = encoder
+    _reset_json_encoders_caches()
+    return encoder
+
+
+def unregister_json_encoder(type_):
+    _json_encoders.pop(type_, None)
+    _reset_json_encoders_caches()
+
+
+def custom_encoders_registered_for(types):
+    """Checks if an encoder other than the builtin one is registered for any
+    of the types or their subclasses."""
+    return any(issubclass(type_, types)
+               for type_ in _types_with_custom_encoders)
+
+
 def json_encoder(obj):
-    if isinstance(obj, datetime):
-        return obj.isoformat()
-    elif isinstance(obj, int) or isinstance(obj, long) or isinstance(obj, float):
-        return obj
-    elif isinstance(obj, Decimal):
-        return float(obj)
-    elif isinstance(obj, six.text_type):
-        return obj
-    elif isinstance(obj, OrderedDict):
-        return [[k, json_encoder(v)]
-                for k, v in obj.items()
-                if not (k == 'key' and isinstance(v, FunctionType))]
-    elif hasattr(obj, 'todict'):
-        return obj.todict()
-    elif is_list_like(obj):
-        return [json_encoder(i) for i in obj]
-    elif is_dict_like(obj):
-        return dict_map(obj, lambda v: json_encoder(v))
-    else:
-        try:
-            return _json.JSONEncoder().default(obj)
-        except:
-            return six.text_type(obj)
+    cls = type(obj)
+    try:
+        encoder = _json_encoders_by_type[cls]
+    except KeyError:
+        encoder = _json_encoders_by_type[cls] = _resolve_json_encoder(cls)
+    return encoder(obj)
 
 
 class BoosterJSONEncoder(_json.JSONEncoder):
@@ -56,3 +153,182 @@ def booster_json_dumps(obj):
 # Decoder function
 def booster_json_loads(obj):
     return _json.loads(obj, object_hook=booster_json_decoder)
+
+
+
+class StdlibJSONBackend(object):
+    """Dumps with the json module Flask uses, calling `json_encoder` for
+    everything else than the builtin containers, strings and numbers.
+    """
+
+    name = 'stdlib'
+
+    def dumps(self, obj):
+        return _json.dumps(obj, default=json_encoder)
+
+
+class OrjsonBackend(object):
+    """Dumps with orjson, which encodes datetimes, dates, times and UUIDs
+    natively, bypassing `json_encoder`. So it falls back to the stdlib while
+    `register_json_encoder` overrides the encoder of any of these types, as
+    well as for what orjson does not accept, like integers beyond 64 bits.
+    """
+
+    name = 'orjson'
+    native_types = (datetime, date, time, UUID)
+
+    def __init__(self):
+        self.orjson = importlib.import_module('orjson')
+        self.options = self.orjson.OPT_NON_STR_KEYS
+
+    def dumps(self, obj):
+        if custom_encoders_registered_for(self.native_types):
+            return _stdlib_backend.dumps(obj)
+        try:
+            return self.orjson.dumps(
+                obj, default=json_encoder, option=self.options).decode('utf-8')
+        except TypeError:
+            return _stdlib_backend.dumps(obj)
+
+
+class UjsonBackend(object):
+    """Dumps with ujson, which encodes Decimals natively. Falls back to the
+    stdlib while the encoder of Decimals is overridden.
+    """
+
+    name = 'ujson'
+    native_types = (Decimal,)
+
+    def __init__(self):
+        self.ujson = importlib.import_module('ujson')
+
+    def dumps(self, obj):
+        if custom_encoders_registered_for(self.native_types):
+            return _stdlib_backend.dumps(obj)
+        try:
+            return self.ujson.dumps(obj, default=json_encoder)
+        except (TypeError, OverflowError):
+            return _stdlib_backend.dumps(obj)
+
+
+class RapidjsonBackend(object):
+    """Dumps with rapidjson, encoding datetimes, dates, times and UUIDs
+    natively. Falls back to the stdlib while the encoder of any of these
+    types is overridden.
+    """
+
+    name = 'rapidjson'
+    native_types = (datetime, date, time, UUID)
+
+    def __init__(self):
+        self.rapidjson = importlib.import_module('rapidjson')
+
+    def dumps(self, obj):
+        if custom_encoders_registered_for(self.native_types):
+            return _stdlib_backend.dumps(obj)
+        try:
+            return self.rapidjson.dumps(
+                obj, default=json_encoder,
+                datetime_mode=self.rapidjson.DM_ISO8601,
+                uuid_mode=self.rapidjson.UM_CANONICAL)
+        except (TypeError, ValueError, OverflowError):
+            return _stdlib_backend.dumps(obj)
+
+
+JSON_BACKENDS = OrderedDict([
+    ('orjson', OrjsonBackend),
+    ('rapidjson', RapidjsonBackend),
+    ('ujson', UjsonBackend),
+    ('stdlib', StdlibJSONBackend)
+])
+
+_stdlib_backend = StdlibJSONBackend()
+_json_backend = _stdlib_backend
+
+
+# The key of the app's backend in `app.extensions`
+JSON_BACKEND_EXTENSION = 'flask_sqlalchemy_booster_json_backend'
+
+
+def load_json_backend(backend):
+    """Returns the backend for the name or object.
+
+    Parameters
+    ----------
+    backend: str or object
+        One of 'orjson', 'rapidjson', 'ujson' or 'stdlib', 'auto' to use the
+        first of them which is installed, or an object with a `dumps` method
+        returning a str. A backend which is not installed falls back to
+        'stdlib' with a warning.
+    """
+    if not isinstance(backend, six.string_types):
+        return backend
+    if backend == 'auto':
+        names = list(JSON_BACKENDS.keys())
+    elif backend in JSON_BACKENDS:
+        names = [backend]
+    else:
+        raise ValueError("Unknown JSON backend %s" % backend)
+    for name in names:
+        try:
+            return JSON_BACKENDS[name]()
+        except ImportError:
+            continue
+    warnings.warn(
+        "The JSON backend %s is not installed. Using the stdlib." % backend)
+    return _stdlib_backend
+
+
+def set_json_backend(backend):
+    """Sets the default backend, which dumps the JSON columns, and the
+    responses and `tojson` outputs outside of the apps having a backend of
+    their own (see `set_app_json_backend`).
+
+    Parameters
+    ----------
+    backend: str or object
+        See `load_json_backend`
+
+    Returns
+    -------
+    The default backend which is now in use.
+    """
+    global _json_backend
+    _json_backend = load_json_backend(backend)
+    return _json_backend
+
+
+def set_app_json_backend(app, backend):
+    """Sets the backend which dumps the responses and `tojson` outputs while
+    the app is the current app.
+
+    Returns
+    -------
+    The backend of the app.
+    """
+    app.extensions[JSON_BACKEND_EXTENSION] = load_json_backend(backend)
+    return app.extensions[JSON_BACKEND_EXTENSION]
+
+
+def get_json_backend():
+    """Returns the backend of the current app, or else the default one"""
+    if has_app_context():
+        backend = current_app.extensions.get(JSON_BACKEND_EXTENSION)
+        if backend is not None:
+            return backend
+    return _json_backend
+
+
+def get_default_json_backend():
+    return _json_backend
+
+
+def json_dumps(obj):
+    """Dumps the object to a JSON string with the backend of the current
+    app"""
+    return get_json_backend().dumps(obj)
+
+
+def default_json_dumps(obj):
+    """Dumps the object to a JSON string with the default backend"""
+    return _json_backend.dumps(obj)
@@ -6,6 +6,7 @@ from toolspy import all_subclasses, union
 from ..query_booster import QueryBooster
 from .queryable_mixin import QueryableMixin
 from .dictizable_mixin import DictizableMixin
+from .model_metadata import get_model_metadata
 from ..utils import get_rel_from_key, get_rel_class_from_key, attr_is_a_property
 from sqlalchemy.ext.hybrid import hybrid_property
 import six
@@ -24,32 +25,28 @@ class ModelBooster(Model, QueryableMixin, DictizableMixin):
     def is_property_attr(cls, attr):
         return attr_is_a_property(cls, attr)
 
+    @classmethod
+    def metadata_registry_entry(cls):
+        """Returns the `ModelMetadata` holding the precomputed keys of the class"""
+        return get_model_metadata(cls)
+
+    @classmethod
+    def filter_key_path(cls, keyword):
+        """Returns the precomputed joins, class and attribute which a filter
+        key like `user.email` resolves to"""
+        return cls.metadata_registry_entry().filter_key_path(keyword)
+
     @classmethod
     def parents(cls):
-        result = []
-        for c in cls.mro():
-            if(c != object and c != Model and c != QueryableMixin and
-                    c != DictizableMixin and c != ModelBooster and c != cls):
-                result.append(c)
-        return result
+        return list(cls.metadata_registry_entry().parents)
 
     @classmethod
     def all_keys(cls):
-        keys = []
-        for c in cls.parents():
-            keys += list(c.__dict__.keys())
-        keys += list(cls.__dict__.keys())
-        return keys
+        return list(cls.metadata_registry_entry().all_keys)
 
     @classmethod
     def dict_with_parent_class_fields(cls):
-        result = {}
-        for c in cls.parents():
-            for k, v in six.iteritems(c.__dict__):
-                result[k] = v
-        for k, v in six.iteritems(cls.__dict__):
-            result[k] = v
-        return result    
+        return dict(cls.metadata_registry_entry().dict_with_parent_class_fields)
 
     @classmethod
     def parent_with_column(cls, clmn):
@@ -64,8 +61,7 @@ class ModelBooster(Model, QueryableMixin, DictizableMixin):
 
     @classmethod
     def property_keys(cls):
-        return [k for k in cls.all_keys() if k not in cls.internal_keys() and isinstance(
-            getattr(cls, k), property)]
+        return list(cls.metadata_registry_entry().property_keys)
 
     @classmethod
     def props_rels_and_assoc_proxies(cls):
@@ -75,18 +71,17 @@ class ModelBooster(Model, QueryableMixin, DictizableMixin):
 
     @classmethod
     def association_proxy_keys(cls, include_parent_classes=True):
-        keys_dict = cls.dict_with_parent_class_fields() if include_parent_classes else cls.__dict__
-        assoc_keys = []
-        for k, v in six.iteritems(keys_dict):
-            if isinstance(v, AssociationProxy) and not k.startswith("_AssociationProxy_"):
-                assoc_keys.append(k)
-        return assoc_keys
+        metadata = cls.metadata_registry_entry()
+        if include_parent_classes:
+            return list(metadata.association_proxy_keys)
+        return list(metadata.own_association_proxy_keys)
 
     @classmethod
     def association_proxy_keys_dict(cls, include_parent_classes=True):
-        keys_dict = cls.dict_with_parent_class_fields() if include_parent_classes else cls.__dict__
+        if include_parent_classes:
+            return dict(cls.metadata_registry_entry().association_proxy_keys_dict)
         return { 
-            k: v for k, v in six.iteritems(keys_dict)
+            k: v for k, v in six.iteritems(cls.__dict__)
             if isinstance(v, AssociationProxy) and
             not k.startswith("_AssociationProxy_")
         }
@@ -105,51 +100,35 @@ class ModelBooster(Model, QueryableMixin, DictizableMixin):
 
     @classmethod
     def column_keys(cls):
-        return [c.key for c in class_mapper(cls).columns]
+        return list(cls.metadata_registry_entry().column_keys)
 
     @classmethod
     def relationship_keys(cls):
-        return [r.key for r in cls.__mapper__.relationships]
+        return list(cls.metadata_registry_entry().relationship_keys)
 
     @classmethod
     def hybrid_property_keys(cls):
-        return [k for k in cls.all_keys() if hasattr(getattr(cls, k), 'descriptor') and isinstance(
-            getattr(cls, k).descriptor, hybrid_property)]
+        return list(cls.metadata_registry_entry().hybrid_property_keys)
 
     @classmethod
     def settable_hybrid_property_keys(cls):
-        return [k for k in cls.hybrid_property_keys() if callable(getattr(cls, k).setter)]        
+        return list(cls.metadata_registry_entry().settable_hybrid_property_keys)
 
     @classmethod
     def all_settable_keys(cls):
-        return cls.column_keys() + cls.relationship_keys() + cls.association_proxy_keys() + cls.settable_hybrid_property_keys()
+        return list(cls.metadata_registry_entry().all_settable_keys)
 
     @classmethod
     def col_assoc_proxy_keys(cls):
-        result = []
-        for k, assoc_proxy in six.iteritems(cls.association_proxy_keys_dict()):
-            assoc_rel_class = get_rel_class_from_key(cls, assoc_proxy.target_collection)
-            if assoc_proxy.value_attr in list(class_mapper(assoc_rel_class).columns.keys()):
-                result.append(k)
-        return result
+        return list(cls.metadata_registry_entry().col_assoc_proxy_keys)
 
     @classmethod
     def rel_assoc_proxy_keys(cls):
-        result = []
-        for k, assoc_proxy in six.iteritems(cls.association_proxy_keys_dict()):
-            assoc_rel_class = get_rel_class_from_key(cls, assoc_proxy.target_collection)
-            if assoc_proxy.value_attr in list(class_mapper(assoc_rel_class).relationships.keys()):
-                result.append(k)
-        return result
+        return list(cls.metadata_registry_entry().rel_assoc_proxy_keys)
 
     @classmethod
     def prop_assoc_proxy_keys(cls):
-        result = []
-        for k, assoc_proxy in six.iteritems(cls.association_proxy_keys_dict()):
-            assoc_rel_class = get_rel_class_from_key(cls, assoc_proxy.target_collection)
-            if assoc_rel_class.is_property_attr(assoc_proxy.value_attr):
-                result.append(k)
-        return result
+        return list(cls.metadata_registry_entry().prop_assoc_proxy_keys)
 
     # @classmethod
     # def col_assoc_proxy_keys(cls):
@@ -6,19 +6,18 @@ A mixin class to add `todict` method to objects.
 from __future__ import absolute_import
 from sqlalchemy.ext.associationproxy import AssociationProxyInstance
 from toolspy import deep_group
-import json
 from sqlalchemy.sql import sqltypes
 from decimal import Decimal
 from datetime import datetime, date
-from toolspy import all_subclasses
 from schemalite.core import func_and_desc
 from sqlalchemy.orm import class_mapper
 from sqlalchemy.dialects.mysql import MEDIUMTEXT
 from past.builtins import long
 
 from ..json_columns import JSONEncodedStruct
-from ..json_encoder import json_encoder
-from ..utils import is_list_like, is_dict_like
+from ..json_encoder import json_dumps
+from ..utils import is_list_like, is_dict_like, copy_schema
+from .serializer_plans import get_serializer_plan, serialize_list_using_plans
 import six
 from six.moves import zip
 
@@ -107,6 +106,12 @@ class DictizableMixin(object):
             The relationship fields are the keys and the list of the attributes
             based on which they are to be grouped are the values.
 
+        _version_attr_ (str): The column which changes whenever a row
+            changes, used along with the primary key to derive the ETags of
+            responses without serializing them. Defaults to the mapper's
+            version_id_col. Timestamps like `updated_at` are not used unless
+            given here, as they need not change with every write.
+
 
     """
 
@@ -119,6 +124,7 @@ class DictizableMixin(object):
     _autogenerate_dict_struct_if_none_ = True
     _dict_struct_ = None
     _input_data_schema_ = None
+    _version_attr_ = None
 
     @classmethod
     def input_schema_post_processor(cls, sch):
@@ -130,7 +136,8 @@ class DictizableMixin(object):
 
     @classmethod
     def attrs_for_autogenerated_dict_struct(cls):
-        return list(class_mapper(cls).columns.keys()) + cls.col_assoc_proxy_keys()
+        metadata = cls.metadata_registry_entry()
+        return list(metadata.mapped_column_keys + metadata.col_assoc_proxy_keys)
         
 
     @classmethod
@@ -158,6 +165,26 @@ class DictizableMixin(object):
     @classmethod
     def generate_input_data_schema(model_cls, required=None,
                                    forbidden=None, post_processor=None):
+        """Returns the input schema of the class. The schema is generated
+        once per set of required and forbidden fields, and every call
+        returns a copy of it which the caller is free to modify.
+        """
+        schema = copy_schema(model_cls.shared_input_data_schema(
+            required=required, forbidden=forbidden))
+        if post_processor and callable(post_processor):
+            post_processor(schema)
+        return schema
+
+    @classmethod
+    def shared_input_data_schema(cls, required=None, forbidden=None):
+        """Returns the generated input schema of the class itself, which is
+        shared by all the callers and must not be modified.
+        """
+        return cls.metadata_registry_entry().input_data_schema(
+            required=required, forbidden=forbidden)
+
+    @classmethod
+    def build_input_data_schema(model_cls, required=None, forbidden=None):
         # if seen_classes is None:
         #     seen_classes = []
         if required is None:
@@ -196,7 +223,7 @@ class DictizableMixin(object):
 
         polymorphic_attr = model_cls.__mapper__.polymorphic_on
 
-        subclasses = [sc for sc in all_subclasses(model_cls) if len(all_subclasses(sc)) == 0]
+        subclasses = model_cls.metadata_registry_entry().leaf_subclasses
 
         if polymorphic_attr is not None:
             schema['fields'][polymorphic_attr.name] = {
@@ -239,8 +266,6 @@ class DictizableMixin(object):
                             polymorphic_identity]['fields'][
                                 assoc_proxy_name] = {"allowed": True}
 
-        if post_processor and callable(post_processor):
-            post_processor(schema)
         return schema
 
     @classmethod
@@ -277,26 +302,12 @@ class DictizableMixin(object):
 
     @classmethod
     def max_permissible_dict_structure(cls):
-        return {
-            "attrs": list(cls.__mapper__.columns.keys()),
-            "rels": {rel_name: {'attrs': list(rel_property.mapper.columns.keys())}
-                     for rel_name, rel_property
-                     in list(cls.__mapper__.relationships.items())}
-        }
+        return copy_schema(
+            cls.metadata_registry_entry().max_permissible_dict_structure)
 
     @classmethod
     def output_data_schema(cls):
-        return {
-            "model_name": cls.__name__,
-            "attrs": list(cls.__mapper__.columns.keys()),
-            "rels": {
-                rel_name: {
-                    "rel_model_name": rel_property.mapper.class_.__name__,
-                    "rel_type": "list" if rel_property.uselist else "scalar"
-                }
-                for rel_name, rel_property
-                in list(cls.__mapper__.relationships.items())}
-        }
+        return copy_schema(cls.metadata_registry_entry().output_data_schema)
 
 
 
@@ -324,46 +335,36 @@ class DictizableMixin(object):
                 }
             }
         """
-        # It is important to assign the passed kwarg to a differently named variable.
-        # A dict is passed by reference and using the same kwarg here results in it
-        # getting mutated - causing unforeseen side effects
-        dict_struct_to_use = (
-            self._dict_struct_ if dict_struct is None
-            else dict_struct)
-        if dict_struct_to_use is None and self._autogenerate_dict_struct_if_none_:
-            dict_struct_to_use = self.autogenerated_dict_structure()
-        elif dict_struct.get("attrs") is None:
-            dict_struct_to_use = {}
-            dict_struct_to_use["attrs"] = self.autogenerated_dict_structure()["attrs"]
-            if "rels" in dict_struct:
-                dict_struct_to_use["rels"] = dict_struct.get("rels")
-        result = self.serialize_attrs(*dict_struct_to_use.get('attrs', []))
-        for rel, rel_dict_struct in dict_struct_to_use.get('rels', {}).items():
-            rel_obj = getattr(self, rel) if hasattr(self, rel) else None
-            if rel_obj is not None:
-                if is_list_like(rel_obj):
-                    result[rel] = [i.todict_using_struct(dict_struct=rel_dict_struct)
-                                   if hasattr(i, 'todict_using_struct') else i
-                                   for i in rel_obj]
-                elif is_dict_like(rel_obj):
-                    result[rel] = {k: v.todict_using_struct(dict_struct=rel_dict_struct)
-                                   if hasattr(v, 'todict_using_struct') else v
-                                   for k, v in six.iteritems(rel_obj)}
-                else:
-                    result[rel] = rel_obj.todict_using_struct(
-                        dict_struct=rel_dict_struct) if hasattr(
-                        rel_obj, 'todict_using_struct') else rel_obj
-            else:
-                result[rel] = None
-        if isinstance(dict_post_processors, list):
-            for dict_post_processor in dict_post_processors:
-                if callable(dict_post_processor):
-                    result = dict_post_processor(result, self)
-        if key_modifications is not None:
-            for key, mod_key in key_modifications.items():
-                if key in result:
-                    result[mod_key] = result.pop(key)
-        return result
+        # The dict_struct is compiled once into a cached plan per model class,
+        # so that attribute filtering and relationship classification are not
+        # repeated for every instance being serialized.
+        return get_serializer_plan(type(self), dict_struct).serialize(
+            self, dict_post_processors=dict_post_processors,
+            key_modifications=key_modifications)
+
+    @classmethod
+    def serializer_plan(cls, dict_struct=None):
+        """Returns the compiled `SerializerPlan` used to convert instances of
+        this class to dicts with `dict_struct`.
+        """
+        return get_serializer_plan(cls, dict_struct)
+
+    @classmethod
+    def todict_list(cls, instances, dict_struct=None,
+                    dict_post_processors=None, key_modifications=None):
+        """Converts a list of instances to a list of dicts, compiling the
+        dict_struct only once for the whole list.
+
+        Examples:
+
+            >>> Customer.todict_list(Customer.all(), dict_struct={'attrs': ['id', 'name']})
+            [{'id': 1, 'name': u'James Bond'}, {'id': 2, 'name': u'Q'}]
+
+        """
+        return serialize_list_using_plans(
+            instances, dict_struct=dict_struct,
+            dict_post_processors=dict_post_processors,
+            key_modifications=key_modifications)
 
 
     # Version 5.0
@@ -566,10 +567,9 @@ class DictizableMixin(object):
                rels_to_expand=None,
                rels_to_serialize=None,
                key_modifications=None):
-        return json.dumps(
+        return json_dumps(
             self.todict(
                 attrs_to_serialize=attrs_to_serialize,
                 rels_to_expand=rels_to_expand,
                 rels_to_serialize=rels_to_serialize,
-                key_modifications=key_modifications),
-            default=json_encoder)
+                key_modifications=key_modifications))
@@ -0,0 +1,384 @@
+"""model_metadata
+Per model registry of the key sets which `ModelBooster` derives by walking
+the MRO, the class `__dict__`s and the mapper.
+
+Every set is computed once per mapped class, the first time it is needed,
+and kept until the mappers are configured again (which happens whenever new
+mappers have been defined), so that `new`, `update_without_commit` and the
+serializers do not repeat the reflection for every row.
+
+Ordered keys are kept as tuples, in the order the `ModelBooster` methods
+have always returned them. Key sets meant for membership tests are
+frozensets.
+
+"""
+
+from __future__ import absolute_import
+from collections import namedtuple
+from sqlalchemy import event
+from sqlalchemy.ext.associationproxy import AssociationProxy
+from sqlalchemy.ext.hybrid import hybrid_property
+from sqlalchemy.orm import class_mapper, configure_mappers
+from sqlalchemy.orm.mapper import Mapper
+from sqlalchemy.util import memoized_property
+from toolspy import all_subclasses
+import six
+
+from ..utils import get_rel_class_from_key, value_coercer
+
+
+MAX_CACHED_FILTER_KEY_PATHS = 1024
+
+_metadata_registry = {}
+
+
+FilterKeyPath = namedtuple('FilterKeyPath', [
+    # Tuples of (join target, joined class, join only if not joined yet)
+    'joins',
+    'model_class',
+    'attr_name',
+    # The type to coerce values to, None if attr_name is not a column
+    'column_type',
+    # The attribute to filter on, None if the class does not have it
+    'attr',
+    # Tuples of (subclass, attribute) for the subclasses having attr_name as
+    # a column, used when the class itself does not have the attribute
+    'subclass_attrs'
+])
+
+
+class ModelMetadata(object):
+    """The introspected keys of `model_class`. Use `get_model_metadata` to
+    obtain the registered instance instead of constructing one directly.
+    """
+
+    def __init__(self, model_class):
+        self.model_class = model_class
+        self._filter_key_paths = {}
+        self._input_data_schemas = {}
+
+    @memoized_property
+    def parents(self):
+        from . import ModelBooster
+        from .queryable_mixin import QueryableMixin
+        from .dictizable_mixin import DictizableMixin
+        from flask_sqlalchemy import Model
+        excluded = (
+            object, Model, QueryableMixin, DictizableMixin, ModelBooster,
+            self.model_class)
+        return tuple(c for c in self.model_class.mro() if c not in excluded)
+
+    @memoized_property
+    def all_keys(self):
+        keys = []
+        for c in self.parents:
+            keys += list(c.__dict__.keys())
+        keys += list(self.model_class.__dict__.keys())
+        return tuple(keys)
+
+    @memoized_property
+    def all_key_set(self):
+        return frozenset(self.all_keys)
+
+    @memoized_property
+    def dict_with_parent_class_fields(self):
+        result = {}
+        for c in self.parents:
+            for k, v in six.iteritems(c.__dict__):
+                result[k] = v
+        for k, v in six.iteritems(self.model_class.__dict__):
+            result[k] = v
+        return result
+
+    @memoized_property
+    def property_keys(self):
+        cls = self.model_class
+        internal_keys = cls.internal_keys()
+        return tuple(
+            k for k in self.all_keys if k not in internal_keys and
+            isinstance(getattr(cls, k), property))
+
+    @memoized_property
+    def property_key_set(self):
+        return frozenset(self.property_keys)
+
+    @memoized_property
+    def association_proxy_keys_dict(self):
+        return {
+            k: v for k, v in six.iteritems(self.dict_with_parent_class_fields)
+            if isinstance(v, AssociationProxy) and
+            not k.startswith("_AssociationProxy_")
+        }
+
+    @memoized_property
+    def association_proxy_keys(self):
+        return tuple(
+            k for k, v in six.iteritems(self.dict_with_parent_class_fields)
+            if isinstance(v, AssociationProxy) and
+            not k.startswith("_AssociationProxy_"))
+
+    @memoized_property
+    def own_association_proxy_keys(self):
+        return tuple(
+            k for k, v in six.iteritems(self.model_class.__dict__)
+            if isinstance(v, AssociationProxy) and
+            not k.startswith("_AssociationProxy_"))
+
+    @memoized_property
+    def association_proxy_key_set(self):
+        return frozenset(self.association_proxy_keys)
+
+    @memoized_property
+    def column_keys(self):
+        return tuple(c.key for c in class_mapper(self.model_class).columns)
+
+    @memoized_property
+    def mapped_column_keys(self):
+        # The attribute names of the columns, which differ from the column
+        # keys when a column is mapped to an attribute of another name
+        return tuple(class_mapper(self.model_class).columns.keys())
+
+    @memoized_property
+    def column_converters(self):
+        return {
+            attr_name: value_coercer(type(column.type))
+            for attr_name, column in class_mapper(self.model_class).columns.items()}
+
+    @memoized_property
+    def version_attr(self):
+        # The attribute which changes along with the row, None if there
+        # isn't one
+        if self.model_class._version_attr_:
+            return self.model_class._version_attr_
+        mapper = class_mapper(self.model_class)
+        if mapper.version_id_col is not None:
+            return mapper.get_property_by_column(mapper.version_id_col).key
+        return None
+
+    @memoized_property
+    def column_key_set(self):
+        return frozenset(self.column_keys)
+
+    @memoized_property
+    def relationship_keys(self):
+        return tuple(
+            r.key for r in class_mapper(self.model_class).relationships)
+
+    @memoized_property
+    def relationship_key_set(self):
+        return frozenset(self.relationship_keys)
+
+    @memoized_property
+    def relationships_by_key(self):
+        return dict(class_mapper(self.model_class).relationships.items())
+
+    def relationship_class(self, key):
+        return self.relationships_by_key[key].mapper.class_
+
+    @memoized_property
+    def subclasses(self):
+        return tuple(all_subclasses(self.model_class))
+
+    @memoized_property
+    def leaf_subclasses(self):
+        # The subclasses which have no subclasses of their own
+        return tuple(sc for sc in self.subclasses if not sc.__subclasses__())
+
+    def input_data_schema(self, required=None, forbidden=None):
+        """Returns the input schema of the class with the required and
+        forbidden fields, generating it on first use.
+        """
+        key = (frozenset(required or ()), frozenset(forbidden or ()))
+        schema = self._input_data_schemas.get(key)
+        if schema is None:
+            schema = self.model_class.build_input_data_schema(
+                required=list(required or ()), forbidden=list(forbidden or ()))
+            self._input_data_schemas[key] = schema
+        return schema
+
+    @memoized_property
+    def max_permissible_dict_structure(self):
+        mapper = class_mapper(self.model_class)
+        return {
+            "attrs": list(mapper.columns.keys()),
+            "rels": {rel_name: {'attrs': list(rel_property.mapper.columns.keys())}
+                     for rel_name, rel_property
+                     in list(mapper.relationships.items())}
+        }
+
+    @memoized_property
+    def output_data_schema(self):
+        mapper = class_mapper(self.model_class)
+        return {
+            "model_name": self.model_class.__name__,
+            "attrs": list(mapper.columns.keys()),
+            "rels": {
+                rel_name: {
+                    "rel_model_name": rel_property.mapper.class_.__name__,
+                    "rel_type": "list" if rel_property.uselist else "scalar"
+                }
+                for rel_name, rel_property
+                in list(mapper.relationships.items())}
+        }
+
+    @memoized_property
+    def hybrid_property_keys(self):
+        cls = self.model_class
+        return tuple(
+            k for k in self.all_keys
+            if hasattr(getattr(cls, k), 'descriptor') and
+            isinstance(getattr(cls, k).descriptor, hybrid_property))
+
+    @memoized_property
+    def settable_hybrid_property_keys(self):
+        cls = self.model_class
+        return tuple(
+            k for k in self.hybrid_property_keys
+            if callable(getattr(cls, k).setter))
+
+    @memoized_property
+    def all_settable_keys(self):
+        return (
+            self.column_keys + self.relationship_keys +
+            self.association_proxy_keys + self.settable_hybrid_property_keys)
+
+    @memoized_property
+    def all_settable_key_set(self):
+        return frozenset(self.all_settable_keys)
+
+    def _assoc_proxy_keys_with_value_attr(self, is_value_attr):
+        result = []
+        for k, assoc_proxy in six.iteritems(self.association_proxy_keys_dict):
+            assoc_rel_class = get_rel_class_from_key(
+                self.model_class, assoc_proxy.target_collection)
+            if is_value_attr(assoc_rel_class, assoc_proxy.value_attr):
+                result.append(k)
+        return tuple(result)
+
+    @memoized_property
+    def col_assoc_proxy_keys(self):
+        return self._assoc_proxy_keys_with_value_attr(
+            lambda klass, attr: attr in class_mapper(klass).columns.keys())
+
+    @memoized_property
+    def rel_assoc_proxy_keys(self):
+        return self._assoc_proxy_keys_with_value_attr(
+            lambda klass, attr: attr in class_mapper(klass).relationships.keys())
+
+    @memoized_property
+    def prop_assoc_proxy_keys(self):
+        return self._assoc_proxy_keys_with_value_attr(
+            lambda klass, attr: klass.is_property_attr(attr))
+
+
+    def filter_key_path(self, keyword):
+        """Returns the `FilterKeyPath` for a filter key, which may be a
+        column, an association proxy (followed to the attribute it proxies),
+        or a dotted path of class names or relationships and association
+        proxies ending in an attribute. Returns None if the path names a
+        class which is not mapped.
+        """
+        try:
+            return self._filter_key_paths[keyword]
+        except KeyError:
+            pass
+        path = self._resolve_filter_key(keyword)
+        if len(self._filter_key_paths) >= MAX_CACHED_FILTER_KEY_PATHS:
+            self._filter_key_paths.clear()
+        self._filter_key_paths[keyword] = path
+        return path
+
+    def _resolve_filter_key(self, keyword):
+        root_class = self.model_class
+        model_class = root_class
+        joins = []
+        if '.' in keyword:
+            kw_split_arr = keyword.split('.')
+            prefix_names = kw_split_arr[:-1]
+            attr_name = kw_split_arr[-1]
+            class_registry = root_class._decl_class_registry
+            if prefix_names[0] in class_registry:
+                for class_name in prefix_names:
+                    if class_name not in class_registry:
+                        return None
+                    model_class = class_registry[class_name]
+                    joins.append((model_class, model_class, True))
+            elif prefix_names[0] in self.all_key_set:
+                for rel_or_proxy_name in prefix_names:
+                    metadata = get_model_metadata(model_class)
+                    if rel_or_proxy_name in metadata.relationship_key_set:
+                        model_class = metadata.relationship_class(
+                            rel_or_proxy_name)
+                        joins.append((rel_or_proxy_name, model_class, True))
+                    elif rel_or_proxy_name in metadata.association_proxy_key_set:
+                        assoc_proxy = getattr(model_class, rel_or_proxy_name)
+                        assoc_rel_class = metadata.relationship_class(
+                            assoc_proxy.target_collection)
+                        joins.append((assoc_rel_class, assoc_rel_class, False))
+                        model_class = get_model_metadata(
+                            assoc_rel_class).relationship_class(
+                                assoc_proxy.value_attr)
+                        joins.append((model_class, model_class, True))
+        else:
+            attr_name = keyword
+            counter = 0  # to prevent infinite loop by some mistake
+            metadata = self
+            while (attr_name in metadata.association_proxy_key_set and
+                    counter < 10):
+                counter += 1
+                assoc_proxy = getattr(model_class, attr_name)
+                assoc_rel = metadata.relationships_by_key[
+                    assoc_proxy.target_collection]
+                prev_model_class = model_class
+                model_class = assoc_rel.mapper.class_
+                attr_name = assoc_proxy.value_attr
+                # Joining by the relationship rather than the class, as a
+                # class cannot be joined directly when there are multiple
+                # foreign keys to it
+                joins.append((
+                    getattr(prev_model_class, assoc_rel.key), model_class, True))
+                metadata = get_model_metadata(model_class)
+
+        columns = class_mapper(model_class).columns
+        column_type = type(
+            columns[attr_name].type) if attr_name in columns else None
+        attr = None
+        subclass_attrs = ()
+        if hasattr(model_class, attr_name):
+            attr = getattr(model_class, attr_name)
+        else:
+            subclass_attrs = tuple(
+                (subcls, getattr(subcls, attr_name))
+                for subcls in get_model_metadata(model_class).subclasses
+                if attr_name in get_model_metadata(subcls).column_key_set)
+        return FilterKeyPath(
+            tuple(joins), model_class, attr_name, column_type, attr,
+            subclass_attrs)
+
+
+def get_model_metadata(model_class):
+    """Returns the registered `ModelMetadata` of the class, creating it on
+    first use.
+    """
+    if Mapper._new_mappers:
+        # Configuring the pending mappers clears the registry, as their
+        # relationships and backrefs can change the keys of any class
+        configure_mappers()
+    metadata = _metadata_registry.get(model_class)
+    if metadata is None:
+        metadata = ModelMetadata(model_class)
+        _metadata_registry[model_class] = metadata
+    return metadata
+
+
+def clear_model_metadata():
+    _metadata_registry.clear()
+
+
+@event.listens_for(Mapper, 'after_configured')
+def _clear_model_metadata_on_reconfigure():
+    from .serializer_plans import clear_serializer_plans
+    from ..filter_plans import clear_filter_plans
+    clear_model_metadata()
+    clear_serializer_plans()
+    clear_filter_plans()
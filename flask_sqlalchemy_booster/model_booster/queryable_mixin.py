@@ -3,11 +3,14 @@ from __future__ import absolute_import
 from toolspy import subdict, remove_and_mark_duplicate_dicts, merge
 from sqlalchemy.ext.associationproxy import AssociationProxyInstance
 from sqlalchemy.ext.orderinglist import OrderingList
+from sqlalchemy import tuple_
 from sqlalchemy.orm import class_mapper
 from sqlalchemy.sql.schema import UniqueConstraint
 import six
 from six.moves import range
+from collections import OrderedDict
 from ..utils import cast_as_column_type
+from ..response_cache import record_changed_model
 
 
 class QueryableMixin(object):
@@ -25,6 +28,8 @@ class QueryableMixin(object):
     _prevent_primary_key_updation_ = True
     _fields_forbidden_from_being_set_ = None
     allow_updation_based_on_unique_keys = False
+    _bulk_query_chunk_size_ = 500
+    _upsert_chunk_size_ = 1000
 
     @classmethod
     def is_a_to_many_rel(cls, attr):
@@ -94,8 +99,9 @@ class QueryableMixin(object):
         cls = type(self)
         kwargs = cls.pre_save_adapter(kwargs, existing_instance=self)
         kwargs = self._prepare_data_for_saving(kwargs)
+        settable_keys = cls.metadata_registry_entry().all_settable_key_set
         for key, value in six.iteritems(kwargs):
-            if key not in cls.all_settable_keys():
+            if key not in settable_keys:
                 continue
             if not hasattr(cls, key) or isinstance(getattr(cls, key), property):
                 continue
@@ -436,9 +442,11 @@ class QueryableMixin(object):
                 return actual_cls(
                     **subdict(
                         actual_cls._prepare_data_for_saving(kwargs),
-                        actual_cls.all_settable_keys())
+                        actual_cls.metadata_registry_entry().all_settable_keys)
                 )
-        return cls(**subdict(cls._prepare_data_for_saving(kwargs), cls.all_settable_keys()))
+        return cls(**subdict(
+            cls._prepare_data_for_saving(kwargs),
+            cls.metadata_registry_entry().all_settable_keys))
 
     @classmethod
     def add(cls, model, commit=True):
@@ -593,6 +601,101 @@ class QueryableMixin(object):
             getattr(result, key): result for result in resultset.all()}
         return [key_result_mapping.get(kv) for kv in original_keyvals]
 
+    @classmethod
+    def find_all_by_keys(cls, list_of_kwargs, keys, chunk_size=None):
+        """Batch version of `cls.first(**subdict(kwargs, keys))`. Returns a
+        list of the existing instances matching each dict on the given keys
+        (None where there is no match), in the same order as the list of
+        dicts.
+
+        Instead of querying once per dict, all the dicts having the same set
+        of keys are matched with one `IN` (or tuple `IN`) query per chunk of
+        `chunk_size` distinct values, and the results are looked up in memory.
+        As the database may find a row equal to a value which is not equal to
+        it in python (case insensitive collations, padded strings etc), the
+        values of a chunk left without a match are checked with the database
+        again, by halves, when the chunk matched any row. Dicts having None
+        for a key, or keys which are not columns, are matched one by one as
+        before.
+
+        Examples:
+
+            >>> Customer.find_all_by_keys([
+            ... {'name': 'Vicky', 'email': 'vicky@x.com'},
+            ... {'name': 'Ron', 'email': 'ron@x.com'}], keys=['email'])
+            [vicky@x.com, None]
+        """
+        chunk_size = chunk_size or cls._bulk_query_chunk_size_
+        columns = class_mapper(cls).columns
+        results = [None] * len(list_of_kwargs)
+        groups = {}
+
+        def criterion_for(key_attrs, keyvals_list):
+            if len(key_attrs) == 1:
+                return key_attrs[0].in_([kv[0] for kv in keyvals_list])
+            return tuple_(*key_attrs).in_(keyvals_list)
+
+        def match_in_database(key_attrs, entries_by_keyvals):
+            # Values can be equal for the database without being equal in
+            # python (collations, padded strings etc). So the values left
+            # without a match are narrowed down by halves to the ones for
+            # which the database finds rows, which are then matched like
+            # `first` would.
+            keyvals_list = list(entries_by_keyvals.keys())
+            query = cls.query.filter(criterion_for(key_attrs, keyvals_list))
+            if len(keyvals_list) == 1:
+                match = query.first()
+                for idx in entries_by_keyvals[keyvals_list[0]]:
+                    results[idx] = match
+                return
+            if query.first() is None:
+                return
+            middle = len(keyvals_list) // 2
+            for half in (keyvals_list[:middle], keyvals_list[middle:]):
+                match_in_database(
+                    key_attrs,
+                    OrderedDict((kv, entries_by_keyvals[kv]) for kv in half))
+
+        for idx, kwargs in enumerate(list_of_kwargs):
+            if kwargs is None:
+                continue
+            filter_kwargs = subdict(kwargs, keys)
+            if filter_kwargs == {}:
+                continue
+            key_names = tuple(sorted(filter_kwargs.keys()))
+            if any(filter_kwargs[k] is None or k not in columns
+                   for k in key_names):
+                results[idx] = cls.first(**filter_kwargs)
+                continue
+            keyvals = tuple(
+                cast_as_column_type(filter_kwargs[k], columns[k])
+                for k in key_names)
+            groups.setdefault(key_names, []).append((idx, keyvals))
+        for key_names, entries in six.iteritems(groups):
+            key_attrs = [getattr(cls, k) for k in key_names]
+            entries_by_keyvals = OrderedDict()
+            for idx, keyvals in entries:
+                entries_by_keyvals.setdefault(keyvals, []).append(idx)
+            distinct_keyvals = list(entries_by_keyvals.keys())
+            for start in range(0, len(distinct_keyvals), chunk_size):
+                chunk = distinct_keyvals[start:start + chunk_size]
+                matches = {}
+                for obj in cls.query.filter(criterion_for(key_attrs, chunk)):
+                    matches.setdefault(
+                        tuple(getattr(obj, k) for k in key_names), obj)
+                unmatched = OrderedDict()
+                for keyvals in chunk:
+                    if keyvals in matches:
+                        for idx in entries_by_keyvals[keyvals]:
+                            results[idx] = matches[keyvals]
+                    else:
+                        unmatched[keyvals] = entries_by_keyvals[keyvals]
+                # When the database found no rows for the chunk, none of
+                # its values can match
+                if matches and unmatched:
+                    match_in_database(key_attrs, unmatched)
+        return results
+
     @classmethod
     def get_or_404(cls, id):
         """Same as Flask-SQLAlchemy's `get_or_404`.
@@ -659,13 +762,15 @@ class QueryableMixin(object):
         return cls.first(**subdict(kwargs, keys)) or cls.create(**kwargs)
 
     @classmethod
-    def get_updated_or_new_obj(cls, kwargs=None, filter_keys=None):
+    def get_updated_or_new_obj(cls, kwargs=None, filter_keys=None, matching_obj=None):
         if filter_keys is None:
             filter_keys = []
         if kwargs is None:
             kwargs = {}
         filter_kwargs = subdict(kwargs, filter_keys)
-        if filter_kwargs == {}:
+        if matching_obj is not None:
+            obj = matching_obj
+        elif filter_kwargs == {}:
             obj = None
         else:
             obj = cls.first(**filter_kwargs)
@@ -705,8 +810,45 @@ class QueryableMixin(object):
         return None
 
     @classmethod
-    def update_matching_obj_or_generate_new_obj(cls, kwargs):
-        obj = cls.get_matching_obj_using_unique_keys(kwargs)
+    def get_matching_objs_using_unique_keys(cls, list_of_kwargs):
+        """Batch version of `get_matching_obj_using_unique_keys`. Returns the
+        matching instance (or None) for each dict, in the same order.
+
+        The keys are tried in the same order of preference - the primary key,
+        then each unique column, then each unique constraint - but each one is
+        resolved for all the dicts still unmatched at once, with
+        `find_all_by_keys`. So the number of queries depends on the number of
+        unique keys and not on the number of dicts.
+        """
+        primary_key_name = cls.primary_key_name()
+        results = [None] * len(list_of_kwargs)
+        key_sets = [(primary_key_name,)] + [
+            (k,) for k in cls.unique_column_names() if k != primary_key_name
+        ] + [tuple(t) for t in cls.unique_constraint_col_name_tuples()]
+        # Single column unique constraints repeat the unique columns
+        key_sets = [ks for idx, ks in enumerate(key_sets)
+                    if ks not in key_sets[:idx]]
+        for key_set in key_sets:
+            candidates = [
+                kwargs if (
+                    results[idx] is None and kwargs is not None and
+                    all(k in kwargs for k in key_set) and
+                    # A primary key of None matches nothing
+                    not (key_set == (primary_key_name,) and
+                         kwargs[primary_key_name] is None))
+                else None
+                for idx, kwargs in enumerate(list_of_kwargs)]
+            if all(c is None for c in candidates):
+                continue
+            for idx, obj in enumerate(
+                    cls.find_all_by_keys(candidates, list(key_set))):
+                if obj is not None:
+                    results[idx] = obj
+        return results
+
+    @classmethod
+    def update_matching_obj_or_generate_new_obj(cls, kwargs, matching_obj=None):
+        obj = matching_obj or cls.get_matching_obj_using_unique_keys(kwargs)
         if obj is not None:
             update_kwargs = {
                 k: v for k, v in six.iteritems(kwargs)
@@ -730,11 +872,18 @@ class QueryableMixin(object):
             keys = []
         if keys is None or len(keys) == 0:
             return [
-                cls.update_matching_obj_or_generate_new_obj(kwargs)
-                for kwargs in list_of_kwargs
+                cls.update_matching_obj_or_generate_new_obj(
+                    kwargs, matching_obj=matching_obj)
+                if matching_obj is not None else cls.new(**kwargs)
+                for kwargs, matching_obj in zip(
+                    list_of_kwargs,
+                    cls.get_matching_objs_using_unique_keys(list_of_kwargs))
             ]
-        for kwargs in list_of_kwargs:
-            objs.append(cls.get_updated_or_new_obj(kwargs, keys))
+        matches = cls.find_all_by_keys(list_of_kwargs, keys)
+        for kwargs, matching_obj in zip(list_of_kwargs, matches):
+            objs.append(
+                cls.get_updated_or_new_obj(kwargs, keys, matching_obj=matching_obj)
+                if matching_obj is not None else cls.new(**kwargs))
         return objs
 
     @classmethod
@@ -856,9 +1005,10 @@ class QueryableMixin(object):
         """
         list_of_kwargs_wo_dupes, markers = remove_and_mark_duplicate_dicts(
             list_of_kwargs, keys)
+        matches = cls.find_all_by_keys(list_of_kwargs_wo_dupes, keys)
         added_objs = cls.add_all([
-            cls.first(**subdict(kwargs, keys)) or cls.new(**kwargs)
-            for kwargs in list_of_kwargs_wo_dupes])
+            match or cls.new(**kwargs)
+            for kwargs, match in zip(list_of_kwargs_wo_dupes, matches)])
         result_objs = []
         iterator_of_added_objs = iter(added_objs)
         for idx in range(len(list_of_kwargs)):
@@ -891,12 +1041,8 @@ class QueryableMixin(object):
             ... 'gender': 'Male'}], keys=['name', 'email'])
         """
         objs = []
-        for kwargs in list_of_kwargs:
-            filter_kwargs = subdict(kwargs, keys)
-            if filter_kwargs == {}:
-                obj = None
-            else:
-                obj = cls.first(**filter_kwargs)
+        matches = cls.find_all_by_keys(list_of_kwargs, keys)
+        for kwargs, obj in zip(list_of_kwargs, matches):
             if obj is not None:
                 for key, value in six.iteritems(kwargs):
                     if (key not in keys and
@@ -933,12 +1079,8 @@ class QueryableMixin(object):
             ... 'gender': 'Male'}], keys=['name', 'email'])
         """
         objs = []
-        for kwargs in list_of_kwargs:
-            filter_kwargs = subdict(kwargs, keys)
-            if filter_kwargs == {}:
-                obj = None
-            else:
-                obj = cls.first(**filter_kwargs)
+        matches = cls.find_all_by_keys(list_of_kwargs, keys)
+        for kwargs, obj in zip(list_of_kwargs, matches):
             if obj is not None:
                 for key, value in six.iteritems(kwargs):
                     if (key not in keys and
@@ -953,6 +1095,146 @@ class QueryableMixin(object):
             cls.session.rollback()
             raise
 
+    @classmethod
+    def upsert_all(cls, list_of_kwargs, keys=None, update_keys=None,
+                   chunk_size=None, commit=True):
+        """Inserts the rows, updating the existing rows which conflict with
+        them on `keys` instead, using the database's own upsert statement in
+        chunks of `chunk_size` rows - `INSERT ... ON CONFLICT DO UPDATE` on
+        PostgreSQL and `INSERT ... ON DUPLICATE KEY UPDATE` on MySQL. On
+        other databases, the existing rows are found with `find_all_by_keys`
+        and written with `bulk_update_mappings` and `bulk_insert_mappings`.
+
+        Unlike `update_or_create_all`, this works on the table directly. Only
+        the column values in the dicts are written, and `pre_save_adapter`,
+        relationships and ORM events are skipped, so it suits large syncs of
+        flat rows. When a chunk has more than one dict for the same keys, the
+        last one wins. The dicts and `keys` use the names of the mapped
+        attributes, which are translated to their columns. Models mapped to
+        more than one table (joined table inheritance) are rejected with a
+        ValueError.
+
+        Args:
+            list_of_kwargs(list of dicts): The rows to upsert
+
+            keys (list, optional): The attributes identifying a row. Their
+                columns need to have a unique constraint. Defaults to the primary key. MySQL
+                ignores this and matches on any unique key.
+
+            update_keys (list, optional): The attributes to update on the
+                existing rows. Defaults to all the column attributes in the
+                dicts except `keys`.
+
+            chunk_size (int, optional): Defaults to 1000
+
+        Returns:
+            int: The number of dicts upserted
+
+        Examples:
+
+            >>> Customer.upsert_all([
+            ... {'name': 'Vicky', 'email': 'vicky@x.com', 'age': 34},
+            ... {'name': 'Ron', 'age': 40, 'email': 'ron@x.com'}],
+            ... keys=['email'])
+            2
+        """
+        mapper = class_mapper(cls)
+        if len(mapper.tables) > 1:
+            raise ValueError(
+                "upsert_all writes to one table, but the columns of %s are "
+                "spread over the tables %s" % (
+                    cls.__name__, ", ".join(t.name for t in mapper.tables)))
+        table = mapper.local_table
+        # The dicts are keyed by the attributes, which can be named
+        # differently from their columns
+        columns = mapper.columns
+        if keys is None:
+            keys = [mapper.get_property_by_column(c).key
+                    for c in mapper.primary_key]
+        chunk_size = chunk_size or cls._upsert_chunk_size_
+        rows = [subdict(kwargs, set(columns.keys())) for kwargs in list_of_kwargs
+                if kwargs is not None]
+        for attr, col in columns.items():
+            if col is mapper.polymorphic_on and mapper.polymorphic_identity is not None:
+                for row in rows:
+                    row.setdefault(attr, mapper.polymorphic_identity)
+        dialect_name = cls.session.get_bind(mapper=mapper).dialect.name
+        try:
+            for start in range(0, len(rows), chunk_size):
+                # Rows are deduplicated on the keys and grouped by their
+                # columns, since a multi row INSERT needs the same columns in
+                # every row
+                deduped = []
+                positions = {}
+                for row in rows[start:start + chunk_size]:
+                    keyvals = tuple(row.get(k) for k in keys)
+                    if None in keyvals:
+                        deduped.append(row)
+                    elif keyvals in positions:
+                        deduped[positions[keyvals]] = row
+                    else:
+                        positions[keyvals] = len(deduped)
+                        deduped.append(row)
+                groups = {}
+                for row in deduped:
+                    groups.setdefault(tuple(sorted(row.keys())), []).append(row)
+                for row_keys, group in six.iteritems(groups):
+                    cols_to_update = [
+                        k for k in (update_keys or row_keys)
+                        if k in row_keys and k not in keys]
+                    if dialect_name in ('postgresql', 'mysql'):
+                        group = [
+                            {columns[k].key: v for k, v in six.iteritems(row)}
+                            for row in group]
+                        cols_to_update = [columns[k].key for k in cols_to_update]
+                    if dialect_name == 'postgresql':
+                        from sqlalchemy.dialects.postgresql import insert
+                        stmt = insert(table).values(group)
+                        index_elements = [columns[k] for k in keys]
+                        if cols_to_update:
+                            stmt = stmt.on_conflict_do_update(
+                                index_elements=index_elements,
+                                set_={k: stmt.excluded[k] for k in cols_to_update})
+                        else:
+                            stmt = stmt.on_conflict_do_nothing(
+                                index_elements=index_elements)
+                        cls.session.execute(stmt)
+                    elif dialect_name == 'mysql':
+                        from sqlalchemy.dialects.mysql import insert
+                        stmt = insert(table).values(group)
+                        if cols_to_update:
+                            stmt = stmt.on_duplicate_key_update(
+                                **{k: stmt.inserted[k] for k in cols_to_update})
+                        else:
+                            stmt = stmt.prefix_with('IGNORE')
+                        cls.session.execute(stmt)
+                    else:
+                        matches = cls.find_all_by_keys(group, keys)
+                        pk_names = [c.key for c in class_mapper(cls).primary_key]
+                        updates = []
+                        inserts = []
+                        for row, match in zip(group, matches):
+                            if match is None:
+                                inserts.append(row)
+                            elif cols_to_update:
+                                update_row = subdict(row, cols_to_update)
+                                for pk_name in pk_names:
+                                    update_row[pk_name] = getattr(match, pk_name)
+                                updates.append(update_row)
+                        if updates:
+                            cls.session.bulk_update_mappings(cls, updates)
+                        if inserts:
+                            cls.session.bulk_insert_mappings(cls, inserts)
+            # The statements above bypass the flush, so the cached responses
+            # reading the table are invalidated explicitly
+            record_changed_model(cls.session, cls)
+            if commit:
+                cls.session.commit()
+            return len(rows)
+        except:
+            cls.session.rollback()
+            raise
+
     @classmethod
     def build(cls, **kwargs):
         """Similar to create. But the transaction is not committed
@@ -990,7 +1272,8 @@ class QueryableMixin(object):
 
     @classmethod
     def find_or_new_all(cls, list_of_kwargs, keys=[]):
-        return [cls.first(**subdict(kwargs, keys)) or cls.new(**kwargs) for kwargs in list_of_kwargs]
+        return [match or cls.new(**kwargs) for kwargs, match in zip(
+            list_of_kwargs, cls.find_all_by_keys(list_of_kwargs, keys))]
 
     @classmethod
     def build_all(cls, list_of_kwargs):
@@ -0,0 +1,324 @@
+"""serializer_plans
+Compiled serialization plans for `DictizableMixin.todict_using_struct`.
+
+A plan is built once per `(model_class, dict_struct)` pair. It resolves
+the attributes to be read, drops the ones forbidden for serialization and
+classifies every relationship in the struct, so that serializing a row
+only involves attribute reads and dict construction.
+
+"""
+
+from __future__ import absolute_import
+from sqlalchemy.ext.associationproxy import AssociationProxy
+from sqlalchemy.orm import class_mapper, joinedload, selectinload
+from sqlalchemy.sql import sqltypes
+from sqlalchemy.types import PickleType
+import six
+
+from ..json_columns import JSONEncodedStruct
+from ..utils import is_list_like, is_dict_like
+
+
+MAX_CACHED_PLANS = 1024
+MAX_EAGER_LOAD_DEPTH = 6
+
+REL_MISSING = "missing"
+REL_SCALAR = "scalar"
+REL_LIST = "list"
+REL_DYNAMIC = "dynamic"
+
+_plans_cache = {}
+
+
+def _freeze(struct):
+    if isinstance(struct, dict):
+        return tuple(sorted(
+            (k, _freeze(v)) for k, v in six.iteritems(struct)))
+    if isinstance(struct, (list, tuple)):
+        return tuple(_freeze(v) for v in struct)
+    return struct
+
+
+def _func_of(klass, method_name):
+    method = getattr(klass, method_name, None)
+    return getattr(method, '__func__', method)
+
+
+def _overrides(klass, method_name):
+    from .dictizable_mixin import DictizableMixin
+    return _func_of(klass, method_name) is not _func_of(
+        DictizableMixin, method_name)
+
+
+def _attr_may_hold_collection(model_class, attr):
+    columns = class_mapper(model_class).columns
+    if attr not in columns:
+        return True
+    return isinstance(
+        columns[attr].type,
+        (JSONEncodedStruct, sqltypes.JSON, sqltypes.ARRAY, PickleType))
+
+
+def _eager_loader(rel_property, attr, parent_loader=None):
+    # Collections are loaded with a separate IN query so that LIMIT/OFFSET
+    # on the parent query stay correct. Scalar relationships are joined.
+    if rel_property.uselist:
+        if parent_loader is None:
+            return selectinload(attr)
+        return parent_loader.selectinload(attr)
+    if parent_loader is None:
+        return joinedload(attr)
+    return parent_loader.joinedload(attr)
+
+
+def _rel_kind(model_class, rel):
+    if not hasattr(model_class, rel):
+        return REL_MISSING
+    relationships = class_mapper(model_class).relationships
+    if rel in relationships:
+        rel_property = relationships[rel]
+        if not rel_property.uselist:
+            return REL_SCALAR
+        if rel_property.collection_class in (None, list, set):
+            return REL_LIST
+    return REL_DYNAMIC
+
+
+class SerializerPlan(object):
+    """Pre-resolved instructions for converting instances of `model_class`
+    to dicts as described by `dict_struct`. Use `get_serializer_plan` to
+    obtain a cached instance instead of constructing one directly.
+    """
+
+    def __init__(self, model_class, dict_struct=None):
+        self.model_class = model_class
+        if dict_struct is None:
+            dict_struct = model_class._dict_struct_
+        dict_struct = dict_struct or {}
+        attrs = dict_struct.get('attrs')
+        if attrs is None:
+            attrs = model_class.attrs_for_autogenerated_dict_struct()
+        forbidden = model_class.attrs_forbidden_for_serialization()
+        self.attr_names = [
+            a for a in attrs
+            if hasattr(model_class, a) and a not in forbidden]
+        self.attrs = [
+            (a, _attr_may_hold_collection(model_class, a))
+            for a in self.attr_names]
+        self.custom_attrs_serializer = _overrides(
+            model_class, 'serialize_attrs')
+        self.rels = [
+            (rel, _rel_kind(model_class, rel), rel_dict_struct)
+            for rel, rel_dict_struct in six.iteritems(
+                dict_struct.get('rels') or {})]
+        self._child_plans = {}
+        self._loader_options = None
+        self.projected_attrs = self._projectable_attrs()
+
+    def _projectable_attrs(self):
+        # A plan can be served straight from column rows only when every
+        # attribute it reads is a plain mapped column, and nothing else
+        # (relationships, overridden serializers, key modifications or
+        # polymorphic loading) needs the ORM instance.
+        mapper = class_mapper(self.model_class)
+        if (len(self.rels) > 0 or len(self.attr_names) == 0 or
+                mapper.polymorphic_on is not None or
+                self.model_class._key_modifications_ or
+                self.custom_attrs_serializer or
+                _overrides(self.model_class, 'todict') or
+                _overrides(self.model_class, 'todict_using_struct')):
+            return None
+        column_attr_keys = set(p.key for p in mapper.column_attrs)
+        if not all(a in column_attr_keys for a in self.attr_names):
+            return None
+        return list(self.attr_names)
+
+    def projection_columns(self):
+        """Returns the column attributes to select in order to build the
+        dicts described by this plan from rows, followed by any primary key
+        column not among them. None if the plan needs ORM instances.
+        """
+        if self.projected_attrs is None:
+            return None
+        mapper = class_mapper(self.model_class)
+        keys = list(self.projected_attrs)
+        for pk_col in mapper.primary_key:
+            pk_key = mapper.get_property_by_column(pk_col).key
+            if pk_key not in keys:
+                keys.append(pk_key)
+        return [getattr(self.model_class, k) for k in keys]
+
+    def serialize_row(self, row):
+        """Builds a dict from a row selected with `projection_columns`"""
+        return dict(zip(self.projected_attrs, row))
+
+    def serialize_rows(self, rows):
+        return [self.serialize_row(row) for row in rows]
+
+    def _child_plan(self, rel, klass, rel_dict_struct):
+        key = (rel, klass)
+        plan = self._child_plans.get(key)
+        if plan is None:
+            plan = get_serializer_plan(klass, rel_dict_struct)
+            self._child_plans[key] = plan
+        return plan
+
+    def _serialize_related(self, rel, item, rel_dict_struct):
+        klass = type(item)
+        if not hasattr(klass, 'todict_using_struct'):
+            return item
+        if _overrides(klass, 'todict_using_struct'):
+            return item.todict_using_struct(dict_struct=rel_dict_struct)
+        return self._child_plan(
+            rel, klass, rel_dict_struct).serialize(item)
+
+    def loader_options(self, parent_loader=None, depth=0):
+        """Returns the `selectinload`/`joinedload` options which load every
+        relationship read by this plan (including the ones behind association
+        proxies in attrs) along with the parent rows.
+        """
+        if parent_loader is None and self._loader_options is not None:
+            return self._loader_options
+        options = []
+        if depth < MAX_EAGER_LOAD_DEPTH:
+            mapper = class_mapper(self.model_class)
+            relationships = mapper.relationships
+            for attr in self.attr_names:
+                assoc_proxy = mapper.all_orm_descriptors.get(attr)
+                if (isinstance(assoc_proxy, AssociationProxy) and
+                        assoc_proxy.target_collection in relationships):
+                    rel_property = relationships[
+                        assoc_proxy.target_collection]
+                    if rel_property.lazy not in ('dynamic', 'noload'):
+                        options.append(_eager_loader(
+                            rel_property,
+                            getattr(self.model_class, rel_property.key),
+                            parent_loader))
+            for rel, kind, rel_dict_struct in self.rels:
+                if rel not in relationships:
+                    continue
+                rel_property = relationships[rel]
+                if rel_property.lazy in ('dynamic', 'noload'):
+                    continue
+                loader = _eager_loader(
+                    rel_property, getattr(self.model_class, rel),
+                    parent_loader)
+                child_options = get_serializer_plan(
+                    rel_property.mapper.class_,
+                    rel_dict_struct).loader_options(
+                        parent_loader=loader, depth=depth + 1)
+                options.extend(child_options or [loader])
+        if parent_loader is None:
+            self._loader_options = options
+        return options
+
+    def serialize(self, instance, dict_post_processors=None,
+                  key_modifications=None):
+        if self.custom_attrs_serializer:
+            result = instance.serialize_attrs(*self.attr_names)
+        else:
+            result = {}
+            for attr, may_hold_collection in self.attrs:
+                val = getattr(instance, attr)
+                if may_hold_collection and is_list_like(val):
+                    val = list(val)
+                result[attr] = val
+        for rel, kind, rel_dict_struct in self.rels:
+            rel_obj = None if kind == REL_MISSING else getattr(instance, rel)
+            if rel_obj is None:
+                result[rel] = None
+            elif kind == REL_LIST or (
+                    kind == REL_DYNAMIC and is_list_like(rel_obj)):
+                result[rel] = [
+                    self._serialize_related(rel, i, rel_dict_struct)
+                    for i in rel_obj]
+            elif kind == REL_DYNAMIC and is_dict_like(rel_obj):
+                result[rel] = {
+                    k: self._serialize_related(rel, v, rel_dict_struct)
+                    for k, v in six.iteritems(rel_obj)}
+            else:
+                result[rel] = self._serialize_related(
+                    rel, rel_obj, rel_dict_struct)
+        if isinstance(dict_post_processors, list):
+            for dict_post_processor in dict_post_processors:
+                if callable(dict_post_processor):
+                    result = dict_post_processor(result, instance)
+        if key_modifications is not None:
+            for key, mod_key in key_modifications.items():
+                if key in result:
+                    result[mod_key] = result.pop(key)
+        return result
+
+    def serialize_all(self, instances, dict_post_processors=None,
+                      key_modifications=None):
+        return [self.serialize(
+                    i, dict_post_processors=dict_post_processors,
+                    key_modifications=key_modifications)
+                for i in instances]
+
+
+def get_serializer_plan(model_class, dict_struct=None):
+    """Returns the cached `SerializerPlan` for the pair, compiling it on
+    first use.
+    """
+    try:
+        key = (model_class, _freeze(dict_struct))
+        hash(key)
+    except TypeError:
+        return SerializerPlan(model_class, dict_struct)
+    plan = _plans_cache.get(key)
+    if plan is None:
+        if len(_plans_cache) >= MAX_CACHED_PLANS:
+            _plans_cache.clear()
+        plan = SerializerPlan(model_class, dict_struct)
+        _plans_cache[key] = plan
+    return plan
+
+
+def clear_serializer_plans():
+    _plans_cache.clear()
+
+
+def serialize_list_using_plans(
+        olist, dict_struct=None, dict_post_processors=None,
+        key_modifications=None, **todict_kwargs):
+    """Serializes a list of instances, compiling a plan once per model
+    class in the list. Falsy items become None and items without a `todict`
+    method are converted to strings, as `serializable_obj` does. Instances
+    whose class overrides `todict` are serialized by calling it.
+    """
+    plans = {}
+    result = []
+    for obj in olist:
+        if not obj:
+            result.append(None)
+            continue
+        if isinstance(obj, dict):
+            # Already serialized, for example by a column projection
+            result.append(obj)
+            continue
+        klass = type(obj)
+        if klass not in plans:
+            if not hasattr(klass, 'todict'):
+                plans[klass] = None
+            elif _overrides(klass, 'todict') or _overrides(
+                    klass, 'todict_using_struct'):
+                plans[klass] = False
+            else:
+                plans[klass] = (
+                    get_serializer_plan(klass, dict_struct),
+                    klass._key_modifications_ if key_modifications is None
+                    else key_modifications)
+        plan = plans[klass]
+        if plan is None:
+            result.append(str(obj))
+        elif plan is False:
+            result.append(obj.todict(
+                dict_struct=dict_struct,
+                dict_post_processors=dict_post_processors,
+                key_modifications=key_modifications, **todict_kwargs))
+        else:
+            result.append(plan[0].serialize(
+                obj, dict_post_processors=dict_post_processors,
+                key_modifications=plan[1]))
+    return result
@@ -1,6 +1,125 @@
 from __future__ import absolute_import
+import base64
+import hashlib
+import math
+import time
+from flask import abort, request
+from flask.json import _json
 from flask_sqlalchemy import BaseQuery, Pagination
+from sqlalchemy import and_, or_, false
+import six
 from six.moves import range
+from .utils import cast_as_column_type, convert_to_column_type
+
+
+MAX_CACHED_COUNTS = 1024
+DEFAULT_COUNT_CACHE_TIMEOUT = 300
+
+_counts_cache = {}
+
+
+def _cursor_value(value):
+    # JSON keeps None, booleans, integers, floats and strings as they are.
+    # Any other value, Decimals included, goes as a string which
+    # `decode_cursor` casts back to the column's type, so that no precision
+    # is lost and the encoders registered for the responses do not apply.
+    if value is None or isinstance(
+            value, (bool, float) + six.integer_types + six.string_types):
+        return value
+    if hasattr(value, 'isoformat'):
+        return value.isoformat()
+    return six.text_type(value)
+
+
+def encode_cursor(values):
+    """Encodes the sort key values of a row into an opaque, url safe
+    cursor string"""
+    dumped = _json.dumps([_cursor_value(v) for v in values])
+    return base64.urlsafe_b64encode(
+        dumped.encode('utf-8')).decode('ascii').rstrip('=')
+
+
+def decode_cursor(cursor, columns):
+    """Decodes a cursor created by `encode_cursor` back to the sort key
+    values, cast from the strings or JSON values to the types of `columns`.
+    Only a JSON null decodes to None, so string keys like '' or 'null' keep
+    their values. Raises a ValueError if the cursor is not a valid one for
+    these columns."""
+    try:
+        padded = cursor + '=' * (-len(cursor) % 4)
+        values = _json.loads(
+            base64.urlsafe_b64decode(padded.encode('ascii')).decode('utf-8'))
+        if not isinstance(values, list) or len(values) != len(columns):
+            raise ValueError
+        return [convert_to_column_type(v, col)
+                for v, col in zip(values, columns)]
+    except (ValueError, TypeError, UnicodeError):
+        raise ValueError("INVALID_CURSOR")
+
+
+def _seek_condition(key, value, descending, nullable):
+    # The condition for the key to come after the value in the ordering of
+    # `keyset_paginate`, where NULLs come first, or last when descending
+    if descending:
+        if value is None:
+            return false()
+        return or_(key < value, key.is_(None)) if nullable else key < value
+    if value is None:
+        return key.isnot(None)
+    return key > value
+
+
+class BoosterPagination(Pagination):
+    """The result of `QueryBooster.paginate`. Unlike Flask-SQLAlchemy's
+    `Pagination`, `total` may be None when the count was skipped, in which
+    case `pages` is None too and `has_next` is known from the extra row
+    fetched along with the page. `total_is_estimate` is True when `total`
+    comes from the query planner instead of a count, and `total_is_capped`
+    is True when there are more items than `total`."""
+
+    def __init__(self, query, page, per_page, total, items,
+                 has_next=None, total_is_estimate=False,
+                 total_is_capped=False):
+        super(BoosterPagination, self).__init__(
+            query, page, per_page, total, items)
+        self._has_next = has_next
+        self.total_is_estimate = total_is_estimate
+        self.total_is_capped = total_is_capped
+
+    @property
+    def pages(self):
+        if self.total is None:
+            return None
+        if self.per_page == 0:
+            return 0
+        return int(math.ceil(self.total / float(self.per_page)))
+
+    @property
+    def has_next(self):
+        if self.total is None or self.total_is_capped:
+            return bool(self._has_next)
+        return self.page < self.pages
+
+
+class KeysetPagination(object):
+    """The result of `QueryBooster.keyset_paginate`. Has the `items` of the
+    page, and the cursors to be passed as `after` and `before` to fetch the
+    next and previous pages. A cursor is None if there is no such page."""
+
+    def __init__(self, query, per_page, items, next_cursor, prev_cursor):
+        self.query = query
+        self.per_page = per_page
+        self.items = items
+        self.next_cursor = next_cursor
+        self.prev_cursor = prev_cursor
+
+    @property
+    def has_next(self):
+        return self.next_cursor is not None
+
+    @property
+    def has_prev(self):
+        return self.prev_cursor is not None
 
 
 class QueryBooster(BaseQuery):
@@ -33,9 +152,11 @@ class QueryBooster(BaseQuery):
             return []
         if key is None:
             key = self.mapper_model_class.primary_key_name()
+        id_attr = getattr(self.mapper_model_class, key)
+        keyvals = [cast_as_column_type(v, id_attr) for v in keyvals]
         original_keyvals = keyvals
         keyvals_set = list(set(keyvals))
-        resultset = self.filter(getattr(self.mapper_model_class, key).in_(keyvals_set))
+        resultset = self.filter(id_attr.in_(keyvals_set))
         key_result_mapping = {getattr(result, key): result for result in resultset.all()}
         return [key_result_mapping.get(kv) for kv in original_keyvals]
 
@@ -53,6 +174,18 @@ class QueryBooster(BaseQuery):
     #     else:
     #         return self.filter(getattr(self.model_class, key) == keyval).first()
 
+    def eager_load_for_dict_struct(self, dict_struct=None):
+        """Adds loader options which fetch all the relationships that will be
+        read while serializing the results with `dict_struct`, so that they
+        are not lazy loaded one parent row at a time.
+        """
+        from .model_booster.serializer_plans import get_serializer_plan
+        options = get_serializer_plan(
+            self.mapper_model_class, dict_struct).loader_options()
+        if len(options) == 0:
+            return self
+        return self.options(*options)
+
     def is_joined_with(self, model_class):
         return model_class in [entity.class_ for entity in self._join_entities]
 
@@ -71,14 +204,239 @@ class QueryBooster(BaseQuery):
                 items = self.limit(bucket_size).offset(offset_to_start_from + bucket*bucket_size).all()
                 yield items
 
-    def paginate(self, *args, **kwargs):
-        pagination = super(QueryBooster, self).paginate(*args, **kwargs)
-        distinct_total = self.order_by(None).distinct().count()
-        items = self.distinct().limit(
-            pagination.per_page).offset(
-            (pagination.page - 1) * pagination.per_page
-            ).all()
-        return Pagination(
-            self, pagination.page, pagination.per_page,
-            distinct_total, items
-        )
+    def keyset_paginate(self, per_page, after=None, before=None,
+                        order_by=None, desc=False):
+        """Fetches a page of `per_page` items which come right after (or
+        right before) the row that the cursor `after` (or `before`) points
+        to. Pass neither to get the first page.
+
+        The rows are ordered by `order_by` (a column attribute) followed by
+        the primary key, so that the ordering is total. NULLs of a nullable
+        `order_by` come first, or last when `desc` is True. Instead of an OFFSET, the page is located using a WHERE clause
+        on these keys, so deep pages are as cheap to fetch as the first one
+        when the keys are indexed. Any ordering already applied on the query
+        is replaced.
+
+        Returns
+        ---------
+        KeysetPagination
+
+        Examples
+        ---------
+
+        >>> page = Order.query.keyset_paginate(50, order_by=Order.created_on)
+        >>> next_page = Order.query.keyset_paginate(
+        ...     50, after=page.next_cursor, order_by=Order.created_on)
+        """
+        # The query may have been projected with `with_entities`
+        mapper = self._mapper_zero()
+        model_class = mapper.class_
+        keys = [getattr(model_class, mapper.get_property_by_column(c).key)
+                for c in mapper.primary_key]
+        if order_by is not None and not any(order_by is k for k in keys):
+            keys.insert(0, order_by)
+        cursor = before if before is not None else after
+        backwards = before is not None
+        # Seeking backwards walks the rows in reverse and flips them back
+        descending = desc != backwards
+        # NULLs come before the other values of a nullable key (after them
+        # when descending), whatever the database's default is
+        nullable_keys = set(
+            i for i, k in enumerate(keys)
+            if any(getattr(c, 'nullable', True) for c in k.property.columns))
+        ordering = []
+        for i, key in enumerate(keys):
+            if i in nullable_keys:
+                ordering.append(
+                    key.isnot(None).desc() if descending
+                    else key.isnot(None).asc())
+            ordering.append(key.desc() if descending else key.asc())
+        query = self.order_by(None).order_by(*ordering)
+        if cursor:
+            values = decode_cursor(cursor, keys)
+            conditions = []
+            for i, key in enumerate(keys):
+                conditions.append(and_(*(
+                    [k.is_(None) if v is None else k == v
+                     for k, v in zip(keys[:i], values[:i])] +
+                    [_seek_condition(
+                        key, values[i], descending, i in nullable_keys)])))
+            query = query.filter(or_(*conditions))
+        rows = query.add_columns(*keys).limit(per_page + 1).all()
+        has_more = len(rows) > per_page
+        rows = rows[:per_page]
+        if backwards:
+            rows = rows[::-1]
+        num_keys = len(keys)
+        single_entity = len(self.column_descriptions) == 1 and isinstance(
+            self.column_descriptions[0]['type'], type)
+        items = [row[0] if single_entity else tuple(row[:-num_keys])
+                 for row in rows]
+        first_cursor = encode_cursor(rows[0][-num_keys:]) if rows else None
+        last_cursor = encode_cursor(rows[-1][-num_keys:]) if rows else None
+        if backwards:
+            next_cursor = last_cursor
+            prev_cursor = first_cursor if has_more else None
+        else:
+            next_cursor = last_cursor if has_more else None
+            prev_cursor = first_cursor if cursor else None
+        return KeysetPagination(
+            self, per_page, items, next_cursor, prev_cursor)
+
+    def estimated_count(self):
+        """Returns the number of rows the query planner expects the query to
+        return, without running it. Only PostgreSQL is supported; for other
+        databases this returns None.
+        """
+        bind = self.session.get_bind(mapper=self._mapper_zero())
+        if bind.dialect.name != 'postgresql':
+            return None
+        compiled = self.order_by(None).statement.compile(dialect=bind.dialect)
+        plan = self.session.connection(mapper=self._mapper_zero()).execute(
+            'EXPLAIN (FORMAT JSON) %s' % compiled, compiled.params).scalar()
+        if isinstance(plan, six.string_types):
+            plan = _json.loads(plan)
+        return int(plan[0]['Plan']['Plan Rows'])
+
+    def signature(self):
+        """Returns a digest of the SQL and parameters of the query, which
+        identifies the rows it selects."""
+        compiled = self.order_by(None).statement.compile(
+            dialect=self.session.get_bind(mapper=self._mapper_zero()).dialect)
+        return hashlib.sha1(repr((
+            six.text_type(compiled),
+            sorted((k, repr(v)) for k, v in six.iteritems(compiled.params))
+        )).encode('utf-8')).hexdigest()
+
+    def cached_count(self, timeout=None, cache=None):
+        """Returns the number of distinct rows of the query, counting them only
+        if the count for the same `signature` is not cached already or was
+        cached more than `timeout` seconds ago.
+
+        Parameters
+        ------------
+        timeout : int, optional
+            Defaults to 300 seconds
+        cache : optional
+            A Flask-Caching like object with `get` and `set` methods, for the
+            count to be shared across processes. An in-process cache is used
+            if it is not given.
+        """
+        timeout = DEFAULT_COUNT_CACHE_TIMEOUT if timeout is None else timeout
+        key = "flask_sqlalchemy_booster.count.%s" % self.signature()
+        if cache is not None:
+            count = cache.get(key)
+            if count is None:
+                count = self.order_by(None).distinct().count()
+                cache.set(key, count, timeout=timeout)
+            return count
+        now = time.time()
+        cached = _counts_cache.get(key)
+        if cached is not None and cached[0] > now:
+            return cached[1]
+        count = self.order_by(None).distinct().count()
+        if len(_counts_cache) >= MAX_CACHED_COUNTS:
+            _counts_cache.clear()
+        _counts_cache[key] = (now + timeout, count)
+        return count
+
+    def capped_count(self, cap):
+        """Counts the distinct rows of the query, but stops at `cap` + 1, so
+        that the database does not scan more than that many rows. A result
+        greater than `cap` means there are more than `cap` rows."""
+        return self.order_by(None).distinct().limit(
+            cap + 1).from_self().count()
+
+    def paginate(self, page=None, per_page=None, error_out=True,
+                 max_per_page=None, total=True, total_cap=None,
+                 total_cache_timeout=None, total_cache=None):
+        """Returns `per_page` distinct items from page `page`, resolving
+        `page` and `per_page` and handling `error_out` and `max_per_page` like
+        Flask-SQLAlchemy's `BaseQuery.paginate`.
+
+        At most one query fetches the items and at most one counts them.
+        The count is skipped when the total can be inferred from a short page.
+
+        Parameters
+        ------------
+        total : bool, int or str, optional
+            True to count the total number of distinct items, False to skip
+            counting (the total is then None), 'estimate' to take the
+            planner's estimate where the database supports it (falling back
+            to counting), 'cached' to use `cached_count`, 'approximate' to use
+            `capped_count`, or an int to use as the total.
+        total_cap : int, optional
+            The cap for 'approximate' totals. Defaults to 1000. When there
+            are more items, `total` is the cap (or the number of items up to
+            this page, if larger) and `total_is_capped` is set.
+        total_cache_timeout : int, optional
+            Passed as `timeout` to `cached_count`
+        total_cache : optional
+            Passed as `cache` to `cached_count`
+
+        Returns
+        ---------
+        BoosterPagination
+        """
+        if page is None or per_page is None:
+            try:
+                if page is None:
+                    page = int(request.args.get('page', 1)) if request else 1
+                if per_page is None:
+                    per_page = int(request.args.get('per_page', 20)) if request else 20
+            except (TypeError, ValueError):
+                if error_out:
+                    abort(404)
+                page = page if isinstance(page, int) else 1
+                per_page = per_page if isinstance(per_page, int) else 20
+        if max_per_page is not None:
+            per_page = min(per_page, max_per_page)
+        if page < 1:
+            if error_out:
+                abort(404)
+            page = 1
+        if per_page < 0:
+            if error_out:
+                abort(404)
+            per_page = 20
+
+        offset = (page - 1) * per_page
+        # Without an exact total, one extra row tells whether there is a
+        # next page
+        limit = per_page + 1 if total in (False, 'approximate') else per_page
+        items = self.distinct().limit(limit).offset(offset).all()
+        has_next = len(items) > per_page
+        items = items[:per_page]
+        if not items and page != 1 and error_out:
+            abort(404)
+
+        total_is_estimate = False
+        total_is_capped = False
+        if total is False:
+            total = None
+        elif not isinstance(total, six.integer_types) or isinstance(total, bool):
+            if 0 < len(items) < per_page or (page == 1 and not items):
+                # A short page is the last one
+                total = offset + len(items)
+            elif total == 'approximate':
+                cap = 1000 if total_cap is None else total_cap
+                count = self.capped_count(cap)
+                if count > cap:
+                    total = max(cap, offset + len(items))
+                    total_is_capped = True
+                else:
+                    total = count
+            elif total == 'cached':
+                total = self.cached_count(
+                    timeout=total_cache_timeout, cache=total_cache)
+            else:
+                estimate = self.estimated_count() if total == 'estimate' else None
+                if estimate is not None:
+                    total = max(estimate, offset + len(items))
+                    total_is_estimate = True
+                else:
+                    total = self.order_by(None).distinct().count()
+        return BoosterPagination(
+            self, page, per_page, total, items, has_next=has_next,
+            total_is_estimate=total_is_estimate,
+            total_is_capped=total_is_capped)
@@ -0,0 +1,225 @@
+"""response_cache
+Tag based invalidation for the responses cached by the Get and Index views.
+
+Every cached response is tagged with the tables it was read from, except
+that a Get of an instance by its primary key is tagged with the instance
+itself, and with its tables' bulk tags, which change only when the rows of
+a table are written without going through the unit of work. Every
+tag has a version stored in the cache, and the versions of the tags of a
+response are part of its cache key. When a session commits, the tags of
+the instances it inserted, updated or deleted are given new versions, so
+the responses cached under the old versions are never read again and
+expire on their own.
+
+"""
+
+from __future__ import absolute_import
+from sqlalchemy import event
+from sqlalchemy.orm import Session, class_mapper, object_mapper
+from sqlalchemy.orm.exc import UnmappedInstanceError
+import uuid
+import six
+
+
+TAG_VERSION_KEY_PREFIX = 'fsb_tag_version:'
+
+CHANGED_TAGS_KEY = 'fsb_changed_tags'
+
+# The cache handlers which hold tag versions. Tags are invalidated in all
+# of them on commit.
+_tagged_caches = []
+
+
+def table_tag(table_name):
+    return 't:%s' % table_name
+
+
+def bulk_tag(table_name):
+    return 'b:%s' % table_name
+
+
+def instance_tag(model_class, pk_value):
+    return 'i:%s:%s' % (
+        class_mapper(model_class).base_mapper.local_table.name, pk_value)
+
+
+def model_tags(model_class):
+    """Returns the tags of all the tables the instances of the class and of
+    its subclasses are stored in.
+    """
+    mapper = class_mapper(model_class)
+    return set(
+        table_tag(table.name) for m in mapper.self_and_descendants
+        for table in m.tables if hasattr(table, 'name'))
+
+
+def instance_tags(model_class, pk_values):
+    """Returns the tags of a Get of the instances with the primary keys."""
+    mapper = class_mapper(model_class)
+    tags = set(instance_tag(model_class, v) for v in pk_values)
+    tags.update(
+        bulk_tag(table.name) for m in mapper.self_and_descendants
+        for table in m.tables if hasattr(table, 'name'))
+    return tags
+
+
+def dict_struct_tags(model_class, dict_struct, seen=None):
+    """Returns the tags of the classes whose instances are read while
+    serializing an instance of `model_class` with `dict_struct`, not
+    including `model_class` itself.
+    """
+    if seen is None:
+        seen = set([model_class])
+    tags = set()
+    if not dict_struct:
+        return tags
+    mapper = class_mapper(model_class)
+    relationships = mapper.relationships
+    metadata = model_class.metadata_registry_entry() if hasattr(
+        model_class, 'metadata_registry_entry') else None
+    assoc_proxies = metadata.association_proxy_keys_dict if metadata else {}
+    for attr in dict_struct.get('attrs') or ():
+        assoc_proxy = assoc_proxies.get(attr)
+        if assoc_proxy is not None and (
+                assoc_proxy.target_collection in relationships):
+            target_class = relationships[
+                assoc_proxy.target_collection].mapper.class_
+            tags |= model_tags(target_class)
+            target_relationships = class_mapper(target_class).relationships
+            if assoc_proxy.value_attr in target_relationships:
+                tags |= model_tags(target_relationships[
+                    assoc_proxy.value_attr].mapper.class_)
+    for rel, rel_dict_struct in six.iteritems(dict_struct.get('rels') or {}):
+        if rel not in relationships:
+            continue
+        rel_class = relationships[rel].mapper.class_
+        tags |= model_tags(rel_class)
+        if rel_class not in seen:
+            seen.add(rel_class)
+            tags |= dict_struct_tags(rel_class, rel_dict_struct, seen)
+    return tags
+
+
+def filter_keys_tags(model_class, keys):
+    """Returns the tags of the classes joined to filter `model_class` by
+    the keys.
+    """
+    tags = set()
+    for key in keys:
+        path = model_class.filter_key_path(key)
+        if path is None:
+            continue
+        for _, joined_class, _ in path.joins:
+            if isinstance(joined_class, type):
+                tags |= model_tags(joined_class)
+        if path.model_class is not model_class:
+            tags |= model_tags(path.model_class)
+    return tags
+
+
+def filter_shape_keys(shape):
+    """Returns the keys in the shape of a parsed `_f` filter."""
+    keys = []
+    for child in shape[1]:
+        if len(child) == 2:
+            keys.extend(filter_shape_keys(child))
+        else:
+            keys.append(child[0])
+    return keys
+
+
+def register_tagged_cache(cache_handler):
+    """Makes commits invalidate the tags whose versions are held in
+    cache_handler.
+    """
+    if not any(c is cache_handler for c in _tagged_caches):
+        _tagged_caches.append(cache_handler)
+
+
+def tags_version(cache_handler, tags):
+    """Returns a string of the current versions of the tags, to be added to
+    the cache key of a response tagged with them. Tags which have no version
+    yet (or whose version has been evicted) are given a new one.
+    """
+    tags = sorted(tags)
+    if len(tags) == 0:
+        return ''
+    keys = [TAG_VERSION_KEY_PREFIX + tag for tag in tags]
+    versions = list(cache_handler.get_many(*keys))
+    missing = {}
+    for idx, version in enumerate(versions):
+        if version is None:
+            versions[idx] = missing[keys[idx]] = uuid.uuid4().hex[:12]
+    if missing:
+        cache_handler.set_many(missing, timeout=0)
+    return '.'.join(versions)
+
+
+def invalidate_tags(tags, cache_handlers=None):
+    """Gives new versions to the tags, so that the responses cached under
+    the current versions are not used anymore.
+    """
+    if not tags:
+        return
+    mapping = {
+        TAG_VERSION_KEY_PREFIX + tag: uuid.uuid4().hex[:12] for tag in tags}
+    for cache_handler in (
+            _tagged_caches if cache_handlers is None else cache_handlers):
+        cache_handler.set_many(mapping, timeout=0)
+
+
+def record_changed_model(session, model_class):
+    """Records that instances of the class were changed in the session
+    without going through the unit of work, as with bulk inserts or core
+    statements, so that its tags are invalidated when the session commits.
+    """
+    if _tagged_caches:
+        tags = session.info.setdefault(CHANGED_TAGS_KEY, set())
+        for table in class_mapper(model_class).tables:
+            tags.add(table_tag(table.name))
+            tags.add(bulk_tag(table.name))
+
+
+@event.listens_for(Session, 'after_flush')
+def _record_flushed_instances(session, flush_context):
+    if not _tagged_caches:
+        return
+    tags = session.info.setdefault(CHANGED_TAGS_KEY, set())
+    for instances in (session.new, session.dirty, session.deleted):
+        for instance in instances:
+            try:
+                mapper = object_mapper(instance)
+            except UnmappedInstanceError:
+                continue
+            for table in mapper.tables:
+                tags.add(table_tag(table.name))
+            pk = mapper.primary_key_from_instance(instance)
+            if all(v is not None for v in pk):
+                tags.add(instance_tag(
+                    mapper.class_, ','.join(six.text_type(v) for v in pk)))
+
+
+@event.listens_for(Session, 'after_bulk_update')
+def _record_bulk_update(update_context):
+    if update_context.mapper is not None:
+        record_changed_model(
+            update_context.session, update_context.mapper.class_)
+
+
+@event.listens_for(Session, 'after_bulk_delete')
+def _record_bulk_delete(delete_context):
+    if delete_context.mapper is not None:
+        record_changed_model(
+            delete_context.session, delete_context.mapper.class_)
+
+
+@event.listens_for(Session, 'after_commit')
+def _invalidate_committed_tags(session):
+    tags = session.info.pop(CHANGED_TAGS_KEY, None)
+    if tags:
+        invalidate_tags(tags)
+
+
+@event.listens_for(Session, 'after_rollback')
+def _discard_rolled_back_tags(session):
+    session.info.pop(CHANGED_TAGS_KEY, None)
@@ -1,14 +1,18 @@
 from __future__ import absolute_import
 from flask.json import _json
 from flask_sqlalchemy import DefaultMeta
-from flask import Response, request, render_template, g
+from flask import (
+    Response, request, render_template, g, stream_with_context, current_app)
 from functools import wraps
+from itertools import islice
 from toolspy import deep_group, merge, add_kv_to_dict, boolify, all_subclasses
 import inspect
+from copy import deepcopy
 
 from sqlalchemy.sql import sqltypes
 from decimal import Decimal
 import dateutil.parser
+import hashlib
 import math
 from flask_sqlalchemy import Pagination
 import traceback
@@ -18,24 +22,36 @@ from sqlalchemy.orm import class_mapper
 from sqlalchemy.orm.query import Query
 from sqlalchemy import or_, and_, not_
 
-from .json_encoder import json_encoder
-from .query_booster import QueryBooster
-from .utils import type_coerce_value
+from .json_encoder import json_encoder, json_dumps
+from .core import sanitized_json
+from .query_booster import QueryBooster, KeysetPagination
+from .model_booster.serializer_plans import (
+    get_serializer_plan, serialize_list_using_plans)
+from .model_booster.model_metadata import get_model_metadata
+from .utils import value_coercer, coerce_values
+from .filter_plans import (
+    OPERATOR_FUNC, parse_filters, filters_shape_and_values, get_filter_plan)
 import six
 from six.moves import zip
 
 
+getargspec = inspect.getfullargspec if six.PY3 else inspect.getargspec
+
+
 RESTRICTED = ['limit', 'sort', 'orderby', 'groupby', 'attrs',
               'rels', 'expand', 'offset', 'page', 'per_page']
 
+# The args holding the cursors, which are not filters in the views having
+# keyset pagination
+KEYSET_PAGINATION_ARGS = ['after', 'before']
+
 PER_PAGE_ITEMS_COUNT = 20
 
+STREAM_CHUNK_SIZE = 1000
+
+NDJSON_MIMETYPE = 'application/x-ndjson'
+
 OPERATORS = ['~', '=', '>', '<', '>=', '!', '<=']
-OPERATOR_FUNC = {
-    '~': 'ilike', '=': '__eq__', '>': '__gt__', '<': '__lt__',
-    '>=': '__ge__', '<=': '__le__', '!': '__ne__', '!=': '__ne__',
-    'in': 'in_'
-}
 
 
 def get_request_json():
@@ -43,6 +59,21 @@ def get_request_json():
         return g.json
     return request.get_json()
 
+def get_raw_request_json():
+    """Returns the request json parsed again from the raw body, which the
+    request keeps, and sanitized like `g.json`. Nothing in it is shared
+    with `get_request_json()`, so it holds the input as it was sent even
+    after the views have modified the request json.
+    """
+    sanitizes_lazily = getattr(current_app, 'sanitizes_json_lazily', None)
+    if sanitizes_lazily is False:
+        # g.json was set by a custom sanitizer, which is not run again
+        return deepcopy(g.json)
+    json_data = request.get_json(cache=False)
+    if sanitizes_lazily:
+        return sanitized_json(json_data)
+    return json_data
+
 def get_request_args():
     if 'args' in g:
         return g.args
@@ -50,9 +81,7 @@ def get_request_args():
 
 
 def json_dump(obj):
-    return _json.dumps(
-        obj,
-        default=json_encoder)
+    return json_dumps(obj)
 
 
 def json_response(json_string, status=200):
@@ -154,14 +183,14 @@ def serializable_list(
                 })
         return result
     else:
-        result_list = [serialized_obj(
-                o, attrs_to_serialize=attrs_to_serialize,
-                rels_to_expand=rels_to_expand,
-                group_listrels_by=group_listrels_by,
-                rels_to_serialize=rels_to_serialize,
-                key_modifications=key_modifications,
-                dict_struct=dict_struct,
-                dict_post_processors=dict_post_processors) for o in olist]
+        result_list = serialize_list_using_plans(
+            olist, dict_struct=dict_struct,
+            dict_post_processors=dict_post_processors,
+            key_modifications=key_modifications,
+            attrs_to_serialize=attrs_to_serialize,
+            rels_to_expand=rels_to_expand,
+            group_listrels_by=group_listrels_by,
+            rels_to_serialize=rels_to_serialize)
         if keyvals_to_merge:
             result_list = [merge(obj_dict, kvdict)
                            for obj_dict, kvdict in
@@ -213,11 +242,10 @@ def jsoned(struct, wrap=True, meta=None, struct_key=None, pre_render_callback=No
     ... '[3, 4, 5]'
 
     """
-    return _json.dumps(
+    return json_dumps(
         structured(
             struct, wrap=wrap, meta=meta, struct_key=struct_key,
-            pre_render_callback=pre_render_callback),
-        default=json_encoder)
+            pre_render_callback=pre_render_callback))
     # if wrap:
         # output = {'status': 'success', struct_key: struct}
         # if meta:
@@ -341,7 +369,7 @@ def success_json():
 
 def convert_error_to_json_response(e):
     response = e.get_response()
-    response.data = _json.dumps({
+    response.data = json_dumps({
         "status": "failure",
         "error": {
             "code": e.code,
@@ -354,10 +382,9 @@ def convert_error_to_json_response(e):
 
 
 def error_json(status_code, error=None):
-    return Response(_json.dumps({
+    return Response(json_dumps({
         'status': 'failure',
-        'error': error},
-        default=json_encoder),
+        'error': error}),
         status_code, mimetype='application/json')
 
 ds_schema = {
@@ -411,6 +438,17 @@ def _serializable_params(args, check_groupby=False):
     return params
 
 
+def requested_dict_struct(dict_struct=None):
+    """Returns the dict_struct which will be used to serialize the response
+    of the current request, i.e. `dict_struct` merged with the `_ds` request
+    argument if one was passed.
+    """
+    params = _serializable_params(request.args)
+    if dict_struct is not None and 'dict_struct' in params:
+        return merge(dict_struct, params['dict_struct'])
+    return params.get('dict_struct', dict_struct)
+
+
 def params_for_serialization(
         attrs_to_serialize=None, rels_to_expand=None,
         rels_to_serialize=None, group_listrels_by=None,
@@ -480,135 +518,58 @@ def as_list(func):
 #         value = dateutil.parser.parse(value).date()
 #     return value
 
+def _join_filter_key_path(query, joins, joined_classes=None):
+    if joined_classes is None:
+        joined_classes = [entity.class_ for entity in query._join_entities]
+    for target, joined_class, only_if_not_joined in joins:
+        if only_if_not_joined and joined_class in joined_classes:
+            continue
+        query = query.join(target)
+        joined_classes.append(joined_class)
+    return query, joined_classes
+
+
 def return_joined_query_model_class_and_attr_name(query, keyword):
-    # print("in return_joined_query_model_class_and_attr_name")
-    # print(query, keyword)
-    # print("query.model_class ", query.model_class)
-    # print("query.criterion ", query._criterion)
-    if '.' in keyword:
-        kw_split_arr = keyword.split('.')
-        prefix_names = kw_split_arr[:-1]
-        attr_name = kw_split_arr[-1]
-        _query = query
-        model_class = query.model_class
-        if prefix_names[0] in query.model_class._decl_class_registry:
-            for class_name in prefix_names:
-                if class_name not in query.model_class._decl_class_registry:
-                    return (query, None)
-                model_class = query.model_class._decl_class_registry[
-                    class_name]
-                if model_class not in [entity.class_ for entity in _query._join_entities]:
-                    _query = _query.join(model_class)
-
-        elif prefix_names[0] in query.model_class.all_keys():
-            model_class = query.model_class
-            for rel_or_proxy_name in prefix_names:
-                if rel_or_proxy_name in model_class.relationship_keys():
-                    mapped_rel = next(
-                        r for r in model_class.__mapper__.relationships
-                        if r.key == rel_or_proxy_name)
-                    model_class = mapped_rel.mapper.class_
-                    if model_class not in [entity.class_ for entity in _query._join_entities]:
-                        # print("About to join model_class ", model_class)
-                        # print("rel_or_proxy_name is ", rel_or_proxy_name)
-                        # _query = _query.join(model_class)
-                        _query = _query.join(rel_or_proxy_name)
-                elif rel_or_proxy_name in model_class.association_proxy_keys():
-                    assoc_proxy = getattr(model_class, rel_or_proxy_name)
-                    assoc_rel = next(
-                        r for r in model_class.__mapper__.relationships
-                        if r.key == assoc_proxy.target_collection)
-                    assoc_rel_class = assoc_rel.mapper.class_
-                    _query = _query.join(assoc_rel_class)
-                    actual_rel_in_assoc_class = next(
-                        r for r in assoc_rel_class.__mapper__.relationships
-                        if r.key == assoc_proxy.value_attr)
-                    model_class = actual_rel_in_assoc_class.mapper.class_
-                    if model_class not in [entity.class_ for entity in _query._join_entities]:
-                        _query = _query.join(model_class)
-    else:
-        # print(". not in attr_name")
-        model_class = query.model_class
-        attr_name = keyword
-        _query = query
-        counter = 0  # to prevent infinite loop by some mistake
-
-        while attr_name in model_class.association_proxy_keys() and counter < 10:
-            # print("attr_name in assoc proxy keys ", attr_name)
-            counter += 1
-            assoc_proxy = getattr(model_class, attr_name)
-            assoc_rel = next(
-                r for r in model_class.__mapper__.relationships
-                if r.key == assoc_proxy.target_collection)
-            prev_model_class = model_class
-            model_class = assoc_rel.mapper.class_
-            attr_name = assoc_proxy.value_attr
-            # print("prev_model_class ", prev_model_class)
-            # print("model_class ", model_class)
-            # print("attr_name ", attr_name)
-            if model_class not in [entity.class_ for entity in _query._join_entities]:
-                # _query = _query.join(model_class)
-                # Commenting this out because it is not possibel to directly
-                # join a class when there are multiple foreign keys to it.
-                # Instead it is preferable to join by mentioning the relationshp
-                # itself.
-                _query = _query.join(getattr(prev_model_class, assoc_rel.key))
-    return (_query, model_class, attr_name)
+    path = query.model_class.filter_key_path(keyword)
+    if path is None:
+        return (query, None)
+    _query, _ = _join_filter_key_path(query, path.joins)
+    return (_query, path.model_class, path.attr_name)
 
 
 def modify_query_and_get_filter_function(query, keyword, value, op, negate=False):
-    # print(
-    #     "in modify_query_and_get_filter_functions ", keyword, value, op, negate)
-    _query, model_class, attr_name = return_joined_query_model_class_and_attr_name(query, keyword)
-    # print("in modify query, model_class ", model_class)
-    # print("in modify query, attr_name ", attr_name)
-    # print("in modify query, count ", _query.count())
-
-    columns = getattr(
-        getattr(model_class, '__mapper__'),
-        'columns')
-    column_type = None
-    if attr_name in columns:
-        column_type = type(
-            columns[attr_name].type)
+    path = query.model_class.filter_key_path(keyword)
+    if path is None:
+        # Unknown class in the key
+        raise ValueError("Cannot resolve the filter key %s" % keyword)
+    _query, joined_classes = _join_filter_key_path(query, path.joins)
+    column_type = path.column_type
     if op == '~':
         value = "%{0}%".format(value)
     if op in ['=', '>', '<', '>=', '<=', '!', '!=']:
-        if attr_name in columns:
+        if column_type is not None:
             if value is not None and not isinstance(value, bool):
-                # if value.lower() == 'none' or value.lower() == 'null' or value.strip() == '':
-                #     value = None
-                # else:
-                value = type_coerce_value(column_type, value)
+                value = value_coercer(column_type)(value)
     elif op == 'in':
-        value = [type_coerce_value(column_type, v) for v in value]
+        value = coerce_values(value_coercer(column_type), value)
 
-    # print("in modify_query, value ", value)
-
-    if hasattr(model_class, attr_name):
-        fltr = getattr(
-            getattr(model_class, attr_name), OPERATOR_FUNC[op])(value)
+    if path.attr is not None:
+        fltr = getattr(path.attr, OPERATOR_FUNC[op])(value)
         if negate:
             fltr = not_(fltr)
         return (_query, fltr)
     else:
         subcls_filters = []
-        for subcls in all_subclasses(model_class):
-            if attr_name in subcls.column_keys():
-                if '.' in keyword:
-                    if not _query.is_joined_with(subcls):
-                        _query = _query.join(subcls)
-                fltr = getattr(
-                    getattr(subcls, attr_name),
-                    OPERATOR_FUNC[op]
-                )(value)
-                if negate:
-                    fltr = not_(fltr)
-                subcls_filters.append(fltr)
-            # print "adding filter to subcls filters ", subcls, attr_name, value
+        for subcls, subcls_attr in path.subclass_attrs:
+            if '.' in keyword:
+                _query, joined_classes = _join_filter_key_path(
+                    _query, [(subcls, subcls, True)], joined_classes)
+            fltr = getattr(subcls_attr, OPERATOR_FUNC[op])(value)
+            if negate:
+                fltr = not_(fltr)
+            subcls_filters.append(fltr)
         if len(subcls_filters) > 0:
             return (_query, or_(*subcls_filters))
-            # return _query.filter(or_(*subcls_filters))
         return (query, None)
 
 
@@ -648,7 +609,7 @@ def convert_filters_to_sqlalchemy_filter(query, filters, connector):
     return (query, None)
 
 
-def filter_query_using_filters_list(result, filters_dict):
+def filter_query_using_filters_list(result, filters_dict, shape_and_values=None):
     """
     filters = {
         "c": "AND",
@@ -689,6 +650,19 @@ def filter_query_using_filters_list(result, filters_dict):
             result = result.query
     filters = filters_dict['f']
     connector = filters_dict.get('c') or 'AND'
+    model_class = getattr(result, 'model_class', None)
+    if model_class is not None:
+        try:
+            shape, values = shape_and_values or filters_shape_and_values(
+                filters, connector)
+            plan = get_filter_plan(
+                model_class, shape,
+                [entity.class_ for entity in result._join_entities])
+        except TypeError:
+            # Keys which cannot be hashed are left to the uncompiled path
+            plan = None
+        if plan is not None:
+            return plan.apply(result, values)
     result, sqfilter = convert_filters_to_sqlalchemy_filter(
         result, filters, connector)
     if sqfilter is not None:
@@ -739,7 +713,31 @@ def filter_query_using_args(result, args_to_skip=None):
 
 def fetch_results_in_requested_format(
         result, default_limit=None, default_sort=None, default_orderby=None,
-        default_offset=None, default_page=None, default_per_page=None):
+        default_offset=None, default_page=None, default_per_page=None,
+        projection=None, yield_per=None, keyset_pagination=False,
+        pagination_total=True, pagination_total_cap=None,
+        pagination_total_cache_timeout=None, pagination_total_cache=None):
+    """Applies the sorting, pagination, limit and offset request arguments
+    to the query and fetches the results.
+
+    If `keyset_pagination` is True and the request has an `after` or a
+    `before` argument, a `KeysetPagination` is returned with the `per_page`
+    rows following (or preceding) the row that cursor points to, ordered by
+    `orderby` and the primary key. An empty `after` gets the first page.
+
+    `pagination_total`, `pagination_total_cap`,
+    `pagination_total_cache_timeout` and `pagination_total_cache` are passed
+    on as the `total`, `total_cap`, `total_cache_timeout` and `total_cache`
+    arguments of `QueryBooster.paginate` for page numbered requests.
+
+    If `projection` (a `SerializerPlan` as returned by
+    `column_projection_for_query`) is given, only the columns it needs are
+    selected and the results are returned as dicts instead of instances.
+
+    If `yield_per` is given and the request is not paginated, the rows are
+    not fetched upfront. An iterator which fetches `yield_per` rows at a
+    time is returned instead.
+    """
     limit = request.args.get('limit', default_limit)
     sort = request.args.get('sort', default_sort)
     orderby = request.args.get('orderby') or default_orderby or 'id'
@@ -748,6 +746,25 @@ def fetch_results_in_requested_format(
     page = request.args.get('page', None) or default_page
     per_page = request.args.get('per_page') or default_per_page or PER_PAGE_ITEMS_COUNT
 
+    if keyset_pagination and (
+            'after' in request.args or 'before' in request.args):
+        result, model_class, attr_name = return_joined_query_model_class_and_attr_name(result, orderby)
+        if projection is not None:
+            result = result.with_entities(*projection.projection_columns())
+        per_page = int(per_page)
+        try:
+            pagination = result.keyset_paginate(
+                per_page,
+                after=request.args.get('after') or None,
+                before=request.args.get('before') or None,
+                order_by=getattr(model_class, attr_name),
+                desc=sort == 'desc')
+        except ValueError:
+            raise Exception("INVALID_CURSOR")
+        if projection is not None:
+            pagination.items = projection.serialize_rows(pagination.items)
+        return pagination
+
     if sort:
         result, model_class, attr_name = return_joined_query_model_class_and_attr_name(result, orderby)
         attr = getattr(model_class, attr_name)
@@ -755,21 +772,52 @@ def fetch_results_in_requested_format(
             result = result.order_by(attr.asc())
         elif sort == 'desc':
             result = result.order_by(attr.desc())
+    if projection is not None:
+        result = result.with_entities(*projection.projection_columns())
     if page:
         try:
-            pagination = result.paginate(int(page), int(per_page))
+            if isinstance(result, QueryBooster):
+                pagination = result.paginate(
+                    int(page), int(per_page), total=pagination_total,
+                    total_cap=pagination_total_cap,
+                    total_cache_timeout=pagination_total_cache_timeout,
+                    total_cache=pagination_total_cache)
+            else:
+                pagination = result.paginate(int(page), int(per_page))
         except:
             raise Exception("PAGE_NOT_FOUND")
+        if projection is not None:
+            pagination.items = projection.serialize_rows(pagination.items)
         return pagination
     else:
         if limit:
             result = result.limit(limit)
         if offset:
             result = result.offset(int(offset) - 1)
+        if yield_per:
+            result = result.yield_per(int(yield_per))
+            if projection is not None:
+                result = six.moves.map(projection.serialize_row, result)
+            return result
         result = result.all()
+        if projection is not None:
+            result = projection.serialize_rows(result)
     return result
 
 
+def column_projection_for_query(query, dict_struct=None):
+    """Returns the serializer plan for the query's model if the response for
+    `dict_struct` can be built from column rows alone, without loading
+    ORM instances. Returns None otherwise.
+    """
+    if not isinstance(query, QueryBooster) or 'groupby' in request.args:
+        return None
+    plan = get_serializer_plan(query.mapper_model_class, dict_struct)
+    if plan.projected_attrs is None:
+        return None
+    return plan
+
+
 def convert_result_to_response_structure(
         result, meta={}, attrs_to_serialize=None, rels_to_expand=None,
         rels_to_serialize=None, group_listrels_by=None,
@@ -785,7 +833,7 @@ def convert_result_to_response_structure(
     if isinstance(result, Pagination):
         page = int(request.args.get('page', 1))
         per_page = int(request.args.get('per_page', PER_PAGE_ITEMS_COUNT ))
-        if result.total != 0 and int(page) > result.pages:
+        if result.total is not None and result.total != 0 and int(page) > result.pages:
             return {
                 "status": "failure",
                 "error": "PAGE_NOT_FOUND",
@@ -797,13 +845,34 @@ def convert_result_to_response_structure(
             'page': page,
             'per_page': per_page,
             'curr_page_first_item_index': (page - 1) * per_page + 1,
-            'curr_page_last_item_index': min(page * per_page, result.total)
+            'curr_page_last_item_index': (page - 1) * per_page + len(result.items)
+            if result.total is None else min(page * per_page, result.total)
         }
+        if result.total is None:
+            # The total was not counted
+            pages_meta['has_next'] = result.has_next
+        elif getattr(result, 'total_is_capped', False):
+            # There are more than total_items items
+            pages_meta['total_is_capped'] = True
+            pages_meta['has_next'] = result.has_next
+        elif getattr(result, 'total_is_estimate', False):
+            pages_meta['total_is_estimate'] = True
         if isinstance(meta, dict) and len(list(meta.keys())) > 0:
             pages_meta = merge(pages_meta, meta)
         return structured(
             serializable_list(result.items, **params_to_be_serialized),
             meta=pages_meta)
+    if isinstance(result, KeysetPagination):
+        cursors_meta = {
+            'per_page': result.per_page,
+            'next_cursor': result.next_cursor,
+            'prev_cursor': result.prev_cursor
+        }
+        if isinstance(meta, dict) and len(list(meta.keys())) > 0:
+            cursors_meta = merge(cursors_meta, meta)
+        return structured(
+            serializable_list(result.items, **params_to_be_serialized),
+            meta=cursors_meta)
     if isinstance(meta, dict) and len(list(meta.keys())) > 0:
         kwargs = merge(params_to_be_serialized, {'meta': meta})
     else:
@@ -821,9 +890,204 @@ def decide_status_code_for_response(obj):
     return status
 
 
-def convert_result_to_response(result, **kwargs):
+def convert_result_to_response(result, etag=False, **kwargs):
+    """Serializes the fetched result into a JSON response.
+
+    If `etag` is True, the response gets a strong ETag derived from its body,
+    and a request whose If-None-Match matches it gets a 304 response instead.
+    `etag` can also be an ETag computed beforehand (see `rows_version_etag`)
+    to be used instead.
+    """
     obj = convert_result_to_response_structure(result, **kwargs)
-    return json_response(json_dump(obj), status=decide_status_code_for_response(obj))
+    response = json_response(
+        json_dump(obj), status=decide_status_code_for_response(obj))
+    if etag:
+        if isinstance(etag, six.string_types) and response.status_code == 200:
+            response.set_etag(etag)
+        return conditional_response(response)
+    return response
+
+
+def not_modified_response(etag):
+    response = Response(status=304)
+    response.set_etag(etag)
+    return response
+
+
+def request_has_etag(etag):
+    """Checks if the If-None-Match header of the request matches the etag."""
+    return request.method in ('GET', 'HEAD') and (
+        request.if_none_match.contains_weak(etag))
+
+
+def conditional_response(response):
+    """Returns a 304 response in place of a successful response whose ETag
+    the request's If-None-Match matches. Responses without an ETag are given
+    one derived from their body first. Streamed responses are returned as
+    they are.
+    """
+    if (not isinstance(response, Response) or response.status_code != 200 or
+            response.is_streamed):
+        return response
+    etag = response.get_etag()[0]
+    if etag is None:
+        response.add_etag()
+        etag = response.get_etag()[0]
+    if request_has_etag(etag):
+        return not_modified_response(etag)
+    return response
+
+
+def supports_version_etag(model_class, dict_struct=None, **params):
+    """Checks if the responses serializing instances of the class with the
+    params can be identified by the primary keys and versions of the
+    instances alone, i.e. if the class has a version attribute and every
+    serialized attribute, including the `attrs_to_serialize` requested, is a
+    column of the class's own rows.
+    """
+    if not isinstance(model_class, DefaultMeta):
+        return False
+    metadata = get_model_metadata(model_class)
+    if metadata.version_attr is None:
+        return False
+    if any(params.get(k) for k in (
+            'rels_to_expand', 'rels_to_serialize', 'group_listrels_by',
+            'dict_post_processors', 'groupby')):
+        return False
+    # Properties, association proxies, relationships and overridden
+    # serializers can change without the version changing. The plan is only
+    # projectable when the attributes are all plain columns and nothing
+    # overrides their serialization.
+    plan = get_serializer_plan(model_class, dict_struct)
+    if plan.projected_attrs is None:
+        return False
+    serialized_attrs = plan.attr_names + list(
+        params.get('attrs_to_serialize') or ())
+    return set(serialized_attrs).issubset(metadata.mapped_column_keys)
+
+
+def version_etag_columns(model_class):
+    """Returns the primary key columns and the version column of the
+    class, the columns `rows_version_etag` expects in each row.
+    """
+    mapper = class_mapper(model_class)
+    return [
+        getattr(model_class, mapper.get_property_by_column(c).key)
+        for c in mapper.primary_key] + [
+        getattr(model_class, get_model_metadata(model_class).version_attr)]
+
+
+def rows_version_etag(model_class, rows, dict_struct=None, meta=None):
+    """Returns a strong ETag for the response of the current request built
+    from the rows, given as tuples of the columns returned by
+    `version_etag_columns`. `meta` holds anything else which goes into the
+    response, like the pagination totals.
+    """
+    digest = hashlib.sha1()
+    for part in (
+            model_class.__name__, request.full_path,
+            json_dump(dict_struct), json_dump(meta)):
+        digest.update(six.text_type(part).encode('utf-8'))
+    for row in rows:
+        digest.update(six.text_type(tuple(row)).encode('utf-8'))
+    return digest.hexdigest()
+
+
+def obj_version_etag(obj, dict_struct=None):
+    return rows_version_etag(
+        type(obj),
+        [tuple(getattr(obj, attr.key) for attr in version_etag_columns(type(obj)))],
+        dict_struct=dict_struct)
+
+
+class VersionsProjection(object):
+    # Stands in for a serializer plan in `fetch_results_in_requested_format`
+    # to fetch only the columns needed by `rows_version_etag`
+
+    def __init__(self, model_class):
+        self.columns = version_etag_columns(model_class)
+
+    def projection_columns(self):
+        return self.columns
+
+    def serialize_row(self, row):
+        return tuple(row)
+
+    def serialize_rows(self, rows):
+        return [tuple(row) for row in rows]
+
+
+def requested_stream_format(stream, default_page=None):
+    """Decides whether the list response for the current request is to be
+    streamed and in which format.
+
+    Parameters
+    ------------
+    stream : bool or str
+        False to never stream, 'json' or 'ndjson' to stream in that format,
+        or True to stream NDJSON to clients which prefer it in their Accept
+        header and a JSON array to the others.
+    default_page : int, optional
+        Paginated responses (including the ones paginated with `after`
+        or `before` cursors) are never streamed.
+
+    Returns
+    ---------
+    'json', 'ndjson' or None
+    """
+    if not stream:
+        return None
+    if (request.args.get('page') or default_page or
+            'groupby' in request.args or 'after' in request.args or
+            'before' in request.args):
+        return None
+    if stream is True:
+        if request.accept_mimetypes.best_match(
+                ['application/json', NDJSON_MIMETYPE]) == NDJSON_MIMETYPE:
+            return 'ndjson'
+        return 'json'
+    return stream
+
+
+def streamed_list_response(
+        rows, stream_format='json', chunk_size=None, **kwargs):
+    """Returns a response which serializes `rows` and writes them out
+    `chunk_size` rows at a time while iterating over them, so that the
+    complete list is never held in memory.
+
+    With `stream_format` 'json', the body is the same
+    `{"status": "success", "result": [...]}` document returned by
+    `convert_result_to_response`. With 'ndjson', every row is written as a
+    JSON document on its own line. The remaining keyword arguments are used
+    as in `convert_result_to_response_structure`.
+    """
+    chunk_size = chunk_size or STREAM_CHUNK_SIZE
+    # Resolved upfront, as the request arguments decide the structure
+    params = params_for_serialization(**kwargs)
+    rows = iter(rows)
+
+    def generate():
+        if stream_format == 'json':
+            yield '{"status": "success", "result": ['
+        separator = ''
+        while True:
+            chunk = list(islice(rows, chunk_size))
+            if len(chunk) == 0:
+                break
+            dumped_rows = [
+                json_dump(d) for d in serializable_list(chunk, **params)]
+            if stream_format == 'ndjson':
+                yield ''.join(d + '\n' for d in dumped_rows)
+            else:
+                yield separator + ', '.join(dumped_rows)
+                separator = ', '
+        if stream_format == 'json':
+            yield ']}'
+
+    return Response(
+        stream_with_context(generate()),
+        mimetype=NDJSON_MIMETYPE if stream_format == 'ndjson'
+        else 'application/json')
 
 
 def convert_query_to_response_object(
@@ -853,26 +1117,44 @@ def template_response_from_obj(
 
 def process_args_and_fetch_rows(
         q, default_limit=None, default_sort=None, default_orderby=None,
-        default_offset=None, default_page=None, default_per_page=None):
+        default_offset=None, default_page=None, default_per_page=None,
+        dict_struct=None, eager_load=True, projection=False,
+        yield_per=None, keyset_pagination=False, pagination_total=True,
+        pagination_total_cap=None, pagination_total_cache_timeout=None,
+        pagination_total_cache=None, versions_only=False):
+    """Filters the query with the request args and fetches the rows in the
+    requested format. If `versions_only` is True, only the primary keys and
+    versions of the rows are fetched, as tuples (see `rows_version_etag`).
+    """
 
     if isinstance(q, Response):
         return q
 
     if '_f' in request.args:
-        filters = _json.loads(request.args['_f'])
-        if isinstance(filters, str) or isinstance(filters, six.text_type):
-            filters = _json.loads(filters)
-        # print("filters are ", filters)
-        q = filter_query_using_filters_list(q, filters)
-        # print("after applying filters")
-        # print(str(q))
+        filters, shape, values = parse_filters(request.args['_f'])
+        q = filter_query_using_filters_list(
+            q, filters, shape_and_values=(shape, values))
 
-    filtered_query = filter_query_using_args(q)
+    filtered_query = filter_query_using_args(
+        q, args_to_skip=list(KEYSET_PAGINATION_ARGS) if keyset_pagination else None)
 
     count_only = boolify(request.args.get('count_only', 'false'))
     if count_only:
         return as_json(filtered_query.count())
 
+    effective_dict_struct = requested_dict_struct(dict_struct)
+    if versions_only:
+        projection_plan = VersionsProjection(filtered_query.mapper_model_class)
+    elif projection:
+        projection_plan = column_projection_for_query(
+            filtered_query, effective_dict_struct)
+    else:
+        projection_plan = None
+    if (projection_plan is None and eager_load and
+            isinstance(filtered_query, QueryBooster)):
+        filtered_query = filtered_query.eager_load_for_dict_struct(
+            effective_dict_struct)
+
     result = fetch_results_in_requested_format(
         filtered_query,
         default_limit=default_limit,
@@ -880,7 +1162,14 @@ def process_args_and_fetch_rows(
         default_orderby=default_orderby,
         default_offset=default_offset,
         default_page=default_page,
-        default_per_page=default_per_page
+        default_per_page=default_per_page,
+        projection=projection_plan,
+        yield_per=yield_per,
+        keyset_pagination=keyset_pagination,
+        pagination_total=pagination_total,
+        pagination_total_cap=pagination_total_cap,
+        pagination_total_cache_timeout=pagination_total_cache_timeout,
+        pagination_total_cache=pagination_total_cache
     )
     return result
 
@@ -891,10 +1180,9 @@ def process_args_and_render_json_list(q, **kwargs):
         return q
 
     if '_f' in request.args:
-        filters = _json.loads(request.args['_f'])
-        if isinstance(filters, str) or isinstance(filters, six.text_type):
-            filters = _json.loads(filters)
-        q = filter_query_using_filters_list(q, filters)
+        filters, shape, values = parse_filters(request.args['_f'])
+        q = filter_query_using_filters_list(
+            q, filters, shape_and_values=(shape, values))
 
     filtered_query = filter_query_using_args(q)
 
@@ -902,6 +1190,16 @@ def process_args_and_render_json_list(q, **kwargs):
     if count_only:
         return as_json(filtered_query.count())
 
+    if (kwargs.pop('eager_load', True) and
+            isinstance(filtered_query, QueryBooster)):
+        filtered_query = filtered_query.eager_load_for_dict_struct(
+            requested_dict_struct(kwargs.get('dict_struct')))
+
+    default_page = kwargs.pop('default_page', None)
+    stream_format = requested_stream_format(
+        kwargs.pop('stream', False), default_page=default_page)
+    stream_chunk_size = kwargs.pop('stream_chunk_size', None)
+
     try:
         result = fetch_results_in_requested_format(
             filtered_query,
@@ -909,8 +1207,10 @@ def process_args_and_render_json_list(q, **kwargs):
             default_sort=kwargs.pop('default_sort', None),
             default_orderby=kwargs.pop('default_orderby', None),
             default_offset=kwargs.pop('default_offset', None),
-            default_page=kwargs.pop('default_page', None),
-            default_per_page=kwargs.pop('default_per_page', None))
+            default_page=default_page,
+            default_per_page=kwargs.pop('default_per_page', None),
+            yield_per=(stream_chunk_size or STREAM_CHUNK_SIZE)
+            if stream_format else None)
     except:
         traceback.print_exc()
         per_page = request.args.get('per_page', PER_PAGE_ITEMS_COUNT)
@@ -920,6 +1220,10 @@ def process_args_and_render_json_list(q, **kwargs):
             "total_pages": int(math.ceil(float(filtered_query.count()) / int(per_page)))
         }, status=404, wrap=False)
 
+    if stream_format:
+        return streamed_list_response(
+            result, stream_format=stream_format,
+            chunk_size=stream_chunk_size, **kwargs)
     return convert_result_to_response(result, **kwargs)
 
 
@@ -932,11 +1236,32 @@ def merge_params_with_request_args_while_deep_merging_dict_struct(kwargs):
     return merged_params
 
 
-def render_json_obj_with_requested_structure(obj, **kwargs):
+def render_json_obj_with_requested_structure(obj, etag=False, **kwargs):
+    """Renders the object as JSON, with the params merged with the request
+    args.
+
+    If `etag` is True, the response gets a strong ETag and a request whose
+    If-None-Match matches it gets a 304 response instead. When the model has
+    a version attribute and the response holds nothing but the object's own
+    attributes, the ETag is derived from its primary key and version, and the
+    304 is returned without serializing the object. Otherwise it is derived
+    from the body.
+    """
     if isinstance(obj, Response):
         return obj
     merged_params = merge_params_with_request_args_while_deep_merging_dict_struct(kwargs)
-    return as_json_obj(obj, **merged_params)
+    if etag and supports_version_etag(type(obj), **merged_params):
+        version_etag = obj_version_etag(
+            obj, dict_struct=merged_params.get('dict_struct'))
+        if request_has_etag(version_etag):
+            return not_modified_response(version_etag)
+        response = as_json_obj(obj, **merged_params)
+        response.set_etag(version_etag)
+        return response
+    response = as_json_obj(obj, **merged_params)
+    if etag:
+        return conditional_response(response)
+    return response
 
 def render_dict_with_requested_structure(obj, **kwargs):
     if isinstance(obj, Response):
@@ -968,7 +1293,7 @@ def render_dict_list_with_requested_structure(obj, **kwargs):
         obj, **merge_params_with_request_args_while_deep_merging_dict_struct(kwargs))
 
 
-def as_processed_list(func):
+def as_processed_list(func=None, stream=False, stream_chunk_size=None):
     """ A decorator used to return a JSON response of a list of model
         objects. It differs from `as_list` in that it accepts a variety
         of querying parameters and can use them to filter and modify the
@@ -977,6 +1302,10 @@ def as_processed_list(func):
         of the Model class. It then converts the instances to dicts
         and serializes them into a json response
 
+        When called with `stream` (see `requested_stream_format`), unpaginated
+        responses are streamed, fetching and serializing `stream_chunk_size`
+        rows at a time.
+
         Examples:
 
             >>> @app.route('/api/customers')
@@ -988,10 +1317,21 @@ def as_processed_list(func):
             ... @as_processed_list
             ... def list_editors():
             ...     return User.filter(role='editor')
+
+            >>> @app.route('/api/orders/export')
+            ... @as_processed_list(stream='ndjson')
+            ... def export_orders():
+            ...     return Order
     """
+    if func is None:
+        def decorator(f):
+            return as_processed_list(
+                f, stream=stream, stream_chunk_size=stream_chunk_size)
+        return decorator
+
     @wraps(func)
     def wrapper(*args, **kwargs):
-        func_argspec = inspect.getargspec(func)
+        func_argspec = getargspec(func)
         func_args = func_argspec.args
         for kw in request.args:
             if (kw in func_args and kw not in RESTRICTED and
@@ -1001,7 +1341,8 @@ def as_processed_list(func):
                 kwargs[kw] = request.args.get(kw)
         func_output = func(*args, **kwargs)
 
-        return process_args_and_render_json_list(func_output)
+        return process_args_and_render_json_list(
+            func_output, stream=stream, stream_chunk_size=stream_chunk_size)
 
     return wrapper
 
@@ -15,6 +15,10 @@ import dateutil.parser
 from decimal import Decimal
 import six
 from contextlib import contextmanager
+import csv
+import re
+import json
+import hashlib
 
 
 @contextmanager
@@ -31,17 +35,29 @@ def session_scope(session_creator):
         session.close()
 
 
+LIST_LIKE_TYPES = (
+    list, set, _AssociationList, _AssociationSet, InstrumentedList)
+
+DICT_LIKE_TYPES = (dict, _AssociationDict, MappedCollection)
+
+
 def is_list_like(rel_instance):
-    return (isinstance(rel_instance, list) or isinstance(rel_instance, set)
-            or isinstance(rel_instance, _AssociationList)
-            or isinstance(rel_instance, _AssociationSet)
-            or isinstance(rel_instance, InstrumentedList))
+    return isinstance(rel_instance, LIST_LIKE_TYPES)
 
 
 def is_dict_like(rel_instance):
-    return (isinstance(rel_instance, dict) or isinstance(
-        rel_instance, _AssociationDict) or isinstance(
-        rel_instance, MappedCollection))
+    return isinstance(rel_instance, DICT_LIKE_TYPES)
+
+
+def copy_schema(schema):
+    """Copies the dicts and lists of a schema, sharing the types, callables
+    and other values held in them.
+    """
+    if isinstance(schema, dict):
+        return {k: copy_schema(v) for k, v in six.iteritems(schema)}
+    if isinstance(schema, list):
+        return [copy_schema(v) for v in schema]
+    return schema
 
 
 def all_cols_including_subclasses(model_cls):
@@ -70,7 +86,7 @@ def nullify_empty_values_in_dict(d):
     return d
 
 def remove_empty_values_in_dict(d):
-    for k in d.keys():
+    for k in list(d.keys()):
         if d[k] == '':
             del d[k]
     return d
@@ -84,38 +100,232 @@ def save_file_from_request(_file, location=None):
     _file.save(file_path)
     return file_path
 
-def type_coerce_value(column_type, value):
-    if value is None:
-        return None
-    if isinstance(value, six.text_type) or isinstance(value, str):
-        if value.lower() == 'none' or value.lower() == 'null' or value.strip() == '':
+def save_rows_as_json_lines(rows, location=None):
+    """Writes the rows to a new file in `location`, one JSON document per
+    line, and returns the path of the file.
+    """
+    file_path = os.path.join(location, "{}_{}_rows.jsonl".format(
+        datetime.utcnow().strftime("%Y%m%d_%H%M%S%f"), uuid.uuid4().hex[0:6]))
+    with open(file_path, 'w') as rows_file:
+        for row in rows:
+            rows_file.write(json.dumps(row))
+            rows_file.write('\n')
+    return file_path
+
+def read_json_lines(file_path):
+    """Lazily yields the rows written by `save_rows_as_json_lines`."""
+    with open(file_path) as rows_file:
+        for line in rows_file:
+            yield json.loads(line)
+
+ISO_DATETIME_RE = re.compile(
+    r'^(\d{4})-(\d{2})-(\d{2})'
+    r'(?:[T ](\d{2}):(\d{2})(?::(\d{2})(?:\.(\d{1,6}))?)?)?$')
+
+
+def parse_datetime(value):
+    """Parses a datetime string. Naive ISO-8601 values are parsed directly
+    and everything else is left to `dateutil.parser.parse`.
+    """
+    if isinstance(value, six.string_types):
+        match = ISO_DATETIME_RE.match(value)
+        if match:
+            (year, month, day, hour, minute, second,
+             fraction) = match.groups()
+            try:
+                return datetime(
+                    int(year), int(month), int(day), int(hour or 0),
+                    int(minute or 0), int(second or 0),
+                    int((fraction or '0').ljust(6, '0')))
+            except ValueError:
+                pass
+    return dateutil.parser.parse(value)
+
+
+def _is_null_string(value):
+    return value.lower() == 'none' or value.lower() == 'null' or value.strip() == ''
+
+
+def _coercer(convert):
+    def coerce(value):
+        if value is None:
+            return None
+        if isinstance(value, six.string_types) and _is_null_string(value):
             return None
-    if column_type is sqltypes.Integer:
-        value = int(value)
-    elif column_type is sqltypes.Numeric:
-        value = Decimal(value)
-    elif column_type is sqltypes.Boolean:
-        value = boolify(value)
-    elif column_type is sqltypes.DateTime:
-        value = dateutil.parser.parse(value)
-    elif column_type is sqltypes.Date:
-        value = dateutil.parser.parse(value).date()
-    return value
+        return convert(value)
+    return coerce
+
+
+_identity_coercer = _coercer(lambda value: value)
+
+# The conversions of the values to the column types, which the coercers
+# apply to everything but None and the null strings
+_converters = {
+    sqltypes.Integer: int,
+    sqltypes.Numeric: Decimal,
+    sqltypes.Boolean: boolify,
+    sqltypes.DateTime: parse_datetime,
+    sqltypes.Date: lambda value: parse_datetime(value).date(),
+}
+
+_coercers = {
+    column_type: _coercer(convert)
+    for column_type, convert in _converters.items()}
+
+
+def value_coercer(column_type):
+    """Returns the function which `type_coerce_value` applies for the
+    column type, so that the type dispatch can be done once per column.
+    """
+    return _coercers.get(column_type, _identity_coercer)
+
+
+def type_coerce_value(column_type, value):
+    return value_coercer(column_type)(value)
+
+
+def coerce_values(coercer, values):
+    """Coerces a column of values, converting each distinct string only once"""
+    converted = {}
+    result = []
+    for value in values:
+        if isinstance(value, six.string_types):
+            if value not in converted:
+                converted[value] = coercer(value)
+            result.append(converted[value])
+        else:
+            result.append(coercer(value))
+    return result
+
 
 def convert_to_proper_types(data, model_class):
-    columns = getattr(
-        getattr(model_class, '__mapper__'),
-        'columns')
+    converters = column_type_converters(model_class)
     for attr_name, value in data.items():
-        if attr_name in columns:
-            column_type = type(
-                columns[attr_name].type)
-            data[attr_name] = type_coerce_value(column_type, value)
+        if attr_name in converters:
+            data[attr_name] = converters[attr_name](value)
     return data
 
+def column_type_converters(model_class):
+    """Returns a dict mapping each column attribute of the model to a
+    function which coerces a value to the column's type. The dict is built
+    once per model and must not be modified.
+    """
+    from .model_booster.model_metadata import get_model_metadata
+    return get_model_metadata(model_class).column_converters
+
+def convert_row_using_converters(row, converters):
+    """Drops the empty values in the row and coerces the rest using the
+    converters returned by `column_type_converters`.
+    """
+    return {
+        k: converters[k](v) if k in converters else v
+        for k, v in row.items() if v != ''}
+
+def convert_rows_using_converters(rows, converters):
+    """Same as `convert_row_using_converters` applied to every row, but
+    coerces the rows one column at a time with `coerce_values`.
+    """
+    rows = [{k: v for k, v in row.items() if v != ''} for row in rows]
+    keys = set()
+    for row in rows:
+        keys.update(row.keys())
+    for key in keys:
+        if key not in converters:
+            continue
+        rows_with_key = [row for row in rows if key in row]
+        for row, value in zip(rows_with_key, coerce_values(
+                converters[key], [row[key] for row in rows_with_key])):
+            row[key] = value
+    return rows
+
+def read_csv_in_chunks(file_path, chunk_size, offset=None, limit=None):
+    """Reads the CSV file lazily and yields tuples of (offset, rows), where
+    rows is a list of at most chunk_size dicts and offset is the position in
+    the file at which the first of those rows starts. The offset can be passed
+    back to resume reading from that row. At most `limit` rows are read if
+    it is given.
+    """
+    with open(file_path) as csv_file:
+        # readline is used instead of iterating over the file so that
+        # csv_file.tell() stays usable between the rows
+        csv_reader = csv.DictReader(iter(csv_file.readline, ''))
+        if not csv_reader.fieldnames:
+            return
+        if offset:
+            csv_file.seek(offset)
+        chunk_offset = csv_file.tell()
+        rows = []
+        rows_read = 0
+        for row in csv_reader:
+            rows.append(row)
+            rows_read += 1
+            if limit and rows_read >= limit:
+                break
+            if len(rows) == chunk_size:
+                yield chunk_offset, rows
+                rows = []
+                chunk_offset = csv_file.tell()
+        if rows:
+            yield chunk_offset, rows
+
+def unique_keys_of_model(model_class, extra_keys=None):
+    """Returns the tuples of attributes whose values identify a row of the
+    model: the primary key, then `extra_keys` (e.g. the unique identifier
+    fields of a batch save), then the unique columns and unique constraints
+    of the mapped tables.
+    """
+    from sqlalchemy import UniqueConstraint
+    mapper = class_mapper(model_class)
+    keys = [tuple(
+        mapper.get_property_by_column(col).key for col in mapper.primary_key)]
+    if extra_keys:
+        keys.append(tuple(extra_keys))
+    for table in mapper.tables:
+        for constraint in table.constraints:
+            if isinstance(constraint, UniqueConstraint):
+                keys.append(tuple(
+                    mapper.get_property_by_column(col).key
+                    for col in constraint.columns
+                    if col in mapper.columns.values()))
+        for col in table.columns:
+            if col.unique and col in mapper.columns.values():
+                keys.append((mapper.get_property_by_column(col).key,))
+    # Deduplicated in order, as the first keys are the ones rows are
+    # matched and partitioned by
+    unique_keys = []
+    for key in keys:
+        if key and key not in unique_keys:
+            unique_keys.append(key)
+    return unique_keys
+
+def row_partition(row, row_idx, keys, partitions):
+    """Returns the partition, out of `partitions`, which a row of a batch
+    belongs to. The partition is a stable hash of the values of the first of
+    the keys (tuples of fields) whose values are all set in the row, so that
+    rows sharing those values land in the same partition wherever they are
+    read. Rows without any of the keys are spread by their position.
+    """
+    for key in keys:
+        values = [row.get(field) for field in key]
+        if any(v is None or v == '' for v in values):
+            continue
+        digest = hashlib.md5(json.dumps(
+            [six.text_type(v) for v in values]).encode('utf-8')).hexdigest()
+        return int(digest, 16) % partitions
+    return row_idx % partitions
+
 def cast_as_column_type(value, col):
-    col_type = type(col.type)
-    return type_coerce_value(col_type, value)
+    return value_coercer(type(col.type))(value)
+
+
+def convert_to_column_type(value, col):
+    """Same as `cast_as_column_type`, except that only None is taken as a
+    null. Strings like '', 'null' or 'none' are converted as they are.
+    """
+    if value is None:
+        return None
+    convert = _converters.get(type(col.type))
+    return convert(value) if convert else value
 
 
 def tz_str(mins):
@@ -0,0 +1,428 @@
+"""validation_plans
+Compiled plans for validating input data against schemalite schemas.
+
+`schemalite.core.validate_dict` interprets the schema on every call: it
+looks up the properties of every field, decides how to check its type,
+and merges the fields of the polymorphic sub-schemas into the schema. A
+plan is compiled once per schema into a function per field, which does
+only the checks that field has, and holds the fields of every polymorphic
+identity merged ahead of time. Validating a dict with a plan gives the
+same result and errors as `validate_dict`, without modifying the schema.
+
+Nested schemas, and the schemas of relationships looked up in the schemas
+registry, are compiled when they are first used.
+
+"""
+
+from __future__ import absolute_import
+from datetime import date, datetime
+from decimal import Decimal
+from schemalite.core import instance_of
+import six
+
+
+# The types whose instances `instance_of` also recognizes in strings
+COERCIBLE_TYPES = (datetime, date, int, float, Decimal)
+
+
+def type_checker(type_):
+    """Returns a function which checks if a value is an instance of the
+    type or of one of the types in a tuple, as `instance_of` does.
+    """
+    if isinstance(type_, tuple):
+        if not any(t in COERCIBLE_TYPES for t in type_):
+            return lambda value: isinstance(value, type_)
+        checkers = [type_checker(t) for t in type_]
+        return lambda value: any(check(value) for check in checkers)
+    if type_ in COERCIBLE_TYPES:
+        return lambda value: instance_of(value, type_)
+    return lambda value: isinstance(value, type_)
+
+
+def _type_names(type_):
+    if isinstance(type_, tuple):
+        return "/".join([t.__name__ for t in type_])
+    return type_.__name__
+
+
+class _Call(object):
+    # The arguments of one validation of a dict, shared by its fields
+
+    __slots__ = (
+        'dictionary', 'schema', 'context', 'parent_contexts',
+        'siblings_list', 'idx', 'allow_unknown_fields',
+        'allow_required_fields_to_be_skipped')
+
+    def __init__(self, dictionary, schema, context, parent_contexts,
+                 siblings_list, idx, allow_unknown_fields,
+                 allow_required_fields_to_be_skipped):
+        self.dictionary = dictionary
+        self.schema = schema
+        self.context = context
+        self.parent_contexts = parent_contexts
+        self.siblings_list = siblings_list
+        self.idx = idx
+        self.allow_unknown_fields = allow_unknown_fields
+        self.allow_required_fields_to_be_skipped = (
+            allow_required_fields_to_be_skipped)
+
+    def nested_parent_contexts(self):
+        if isinstance(self.parent_contexts, list):
+            return self.parent_contexts + [self.context]
+        return [self.context]
+
+
+class ValidationPlan(object):
+    """The compiled validator of a schema.
+
+    Parameters
+    ----------
+    schema: dict
+        A schemalite schema. It should not be modified after the plan is
+        compiled.
+
+    schemas_registry: dict, optional
+        The schemas of relationships declared with `is_a_relation_to`, by
+        class name.
+
+    """
+
+    def __init__(self, schema, schemas_registry=None):
+        self.schema = schema
+        self.schemas_registry = schemas_registry
+        self._nested_plans = {}
+        fields = schema.get('fields')
+        self.has_fields = bool(fields)
+        self.field_checks = self._compile_fields(fields or {})
+        self.validators = list(schema.get('validators', []))
+        self.polymorphic_on = schema.get('polymorphic_on') if fields else None
+        self.polymorphs = {}
+        if self.polymorphic_on:
+            for identity, additional_schema in six.iteritems(
+                    schema.get('additional_schema_for_polymorphs', {})):
+                merged_fields = dict(fields)
+                merged_fields.update(additional_schema.get('fields', {}))
+                self.polymorphs[identity] = (
+                    self._compile_fields(merged_fields),
+                    self.validators + list(
+                        additional_schema.get('validators', [])))
+
+    def _compile_fields(self, fields):
+        return [
+            (field_name, self._compile_missing_check(field_name, props),
+             self._compile_present_check(field_name, props))
+            for field_name, props in six.iteritems(fields)]
+
+    def _nested_plan(self, schema):
+        # Nested schemas are validated without the registry, as in
+        # validate_dict
+        key = id(schema)
+        if key not in self._nested_plans:
+            self._nested_plans[key] = (schema, ValidationPlan(schema))
+        return self._nested_plans[key][1]
+
+    def _compile_missing_check(self, field_name, props):
+        required = props.get('required', False)
+        if callable(required):
+            def check_missing(call):
+                error_message = required.desc or required.__name__
+                if required(
+                        call.dictionary, schema=call.schema,
+                        context=call.context,
+                        parent_contexts=call.parent_contexts,
+                        siblings_list=call.siblings_list,
+                        curr_obj_idx_in_siblings_list=call.idx):
+                    return error_message
+                return None
+            return check_missing
+        if required:
+            error_message = '%s is a required field' % field_name
+            return lambda call: error_message
+        return None
+
+    def _compile_present_check(self, field_name, props):
+        """Returns a function of the value of the field and the call, which
+        returns the errors of the field, or None if it is valid.
+        """
+        checks = []
+        allowed = props.get('allowed', True)
+        if callable(allowed):
+            def allowed_error(call):
+                error_message = allowed.desc or allowed.__name__
+                if allowed(
+                        call.dictionary, schema=call.schema,
+                        context=call.context,
+                        parent_contexts=call.parent_contexts,
+                        siblings_list=call.siblings_list,
+                        curr_obj_idx_in_siblings_list=call.idx) == False:
+                    return error_message
+                return None
+        elif allowed == False:
+            not_allowed_message = '%s is not an allowed field' % field_name
+            allowed_error = lambda call: not_allowed_message
+        else:
+            allowed_error = None
+
+        field_type = props.get('type')
+        if field_type is not None:
+            if type(field_type) == type:
+                if field_type == dict:
+                    if not props.get('is_mapped_collection'):
+                        checks.append(self._compile_dict_check(props))
+                elif field_type == list:
+                    checks.append(self._compile_list_check(props))
+                else:
+                    is_of_type = type_checker(field_type)
+                    type_error = "Field data should be of type {0}".format(
+                        field_type.__name__)
+
+                    def check_type(value, call, field_errors):
+                        if not is_of_type(value):
+                            field_errors['TYPE_ERROR'] = type_error
+                            return False
+                        return True
+                    checks.append(check_type)
+            elif type(field_type) == tuple:
+                is_of_types = type_checker(field_type)
+                types_error = "Field data should be of type {0}".format(
+                    _type_names(field_type))
+
+                def check_types(value, call, field_errors):
+                    if not is_of_types(value):
+                        field_errors['TYPE_ERROR'] = types_error
+                        return False
+                    return True
+                checks.append(check_types)
+
+        if 'permitted_values' in props:
+            permitted_values = props['permitted_values']
+
+            def check_permitted_value(value, call, field_errors):
+                if value not in permitted_values:
+                    field_errors['PERMITTED_VALUES_ERROR'] = (
+                        "Field data can be one of the following only: "
+                        "{0}".format("/".join([v for v in permitted_values])))
+                    return False
+                return True
+            checks.append(check_permitted_value)
+
+        validators = [v for v in props.get('validators', []) if v is not None]
+        if validators:
+            def run_validators(value, call, field_errors):
+                is_valid = True
+                for _validator in validators:
+                    validation_result, validation_errors = _validator(
+                        value, call.dictionary, schema=call.schema,
+                        context=call.context,
+                        parent_contexts=call.parent_contexts,
+                        siblings_list=call.siblings_list,
+                        curr_obj_idx_in_siblings_list=call.idx)
+                    if not validation_result:
+                        validator_name = (
+                            _validator.desc.upper() or
+                            _validator.__name__.upper()).replace(" ", "_")
+                        field_errors[validator_name] = validation_errors
+                        is_valid = False
+                return is_valid
+            checks.append(run_validators)
+
+        def check_present(value, call):
+            field_errors = {}
+            if allowed_error is not None:
+                error_message = allowed_error(call)
+                if error_message is not None:
+                    field_errors['FIELD_NOT_ALLOWED_ERROR'] = error_message
+                    return field_errors
+            is_valid = True
+            for check in checks:
+                is_valid = check(value, call, field_errors) and is_valid
+            return None if is_valid else field_errors
+        return check_present
+
+    def _compile_dict_check(self, props):
+        dict_schema = props.get('dict_schema')
+        rel_schema_cls_name = props.get('is_a_relation_to')
+        schemas_registry = self.schemas_registry
+
+        def check_dict(value, call, field_errors):
+            schema = dict_schema
+            if schema is None and rel_schema_cls_name and schemas_registry:
+                schema = schemas_registry.get(rel_schema_cls_name)
+            if not schema:
+                return True
+            validation_result, validation_errors = self._nested_plan(
+                schema).validate_dict(
+                value, allow_unknown_fields=call.allow_unknown_fields,
+                allow_required_fields_to_be_skipped=(
+                    call.allow_required_fields_to_be_skipped),
+                parent_contexts=call.nested_parent_contexts())
+            if not validation_result:
+                field_errors['VALIDATION_ERRORS_FOR_OBJECT'] = (
+                    validation_errors)
+            return validation_result
+        return check_dict
+
+    def _compile_list_check(self, props):
+        list_item_type = props.get('list_item_type')
+        list_item_schema = props.get('list_item_schema')
+        rel_schema_cls = props.get('is_a_relation_to')
+        schemas_registry = self.schemas_registry
+        permitted_values = props.get('permitted_values_for_list_items')
+        has_permitted_values = 'permitted_values_for_list_items' in props
+        is_of_item_type = None
+        if type(list_item_type) == type and list_item_type != dict or (
+                type(list_item_type) == tuple):
+            is_of_item_type = type_checker(list_item_type)
+            item_type_error = {"TYPE_ERROR": "Item should be of type {0}".format(
+                _type_names(list_item_type))}
+
+        def check_list(value, call, field_errors):
+            is_valid = True
+            item_errors = field_errors[
+                'VALIDATION_ERRORS_FOR_OBJECTS_IN_LIST'] = []
+            if value is not None:
+                if list_item_type == dict and type(list_item_type) == type:
+                    schema = list_item_schema
+                    if schema is None and rel_schema_cls is not None and (
+                            schemas_registry is not None):
+                        schema = schemas_registry.get(rel_schema_cls.__name__)
+                    if schema:
+                        validation_result, validation_errors = self._nested_plan(
+                            schema).validate_list_of_dicts(
+                            value, allow_unknown_fields=call.allow_unknown_fields,
+                            allow_required_fields_to_be_skipped=(
+                                call.allow_required_fields_to_be_skipped),
+                            parent_contexts=call.nested_parent_contexts())
+                        if not validation_result:
+                            item_errors = field_errors[
+                                'VALIDATION_ERRORS_FOR_OBJECTS_IN_LIST'] = (
+                                validation_errors)
+                            is_valid = False
+                elif is_of_item_type is not None:
+                    for item in value:
+                        if is_of_item_type(item):
+                            item_errors.append(None)
+                        else:
+                            item_errors.append(dict(item_type_error))
+                            is_valid = False
+            if has_permitted_values:
+                for idx, item in enumerate(value):
+                    if item not in permitted_values:
+                        if item_errors[idx] is None:
+                            item_errors[idx] = {}
+                        item_errors[idx]['PERMITTED_VALUES_ERROR'] = (
+                            "Field data can be one of the following only: "
+                            "{0}".format("/".join(
+                                [str(v) for v in permitted_values])))
+                        is_valid = False
+            return is_valid
+        return check_list
+
+    def validate_dict(
+            self, dictionary, allow_unknown_fields=None,
+            allow_required_fields_to_be_skipped=None,
+            polymorphic_identity=None, context=None, parent_contexts=None,
+            siblings_list=None, curr_obj_idx_in_siblings_list=None):
+        """Validates the dict against the schema, taking the arguments of
+        `schemalite.core.validate_dict` other than the schema and the
+        schemas registry.
+
+        Returns
+        -------
+        tuple
+            The validation status and the errors, if any.
+        """
+        if not isinstance(dictionary, dict):
+            return (False, {'TYPE_ERROR': "Object is not a dict"})
+        schema = self.schema
+        if allow_unknown_fields is None:
+            allow_unknown_fields = schema.get('allow_unknown_fields', False)
+        if allow_required_fields_to_be_skipped is None:
+            allow_required_fields_to_be_skipped = schema.get(
+                'allow_required_fields_to_be_skipped', False)
+        is_valid = True
+        errors = None
+        field_checks = self.field_checks
+        schema_validators = self.validators
+        if self.has_fields:
+            if self.polymorphic_on:
+                if polymorphic_identity is None:
+                    polymorphic_identity = dictionary.get(self.polymorphic_on)
+                if polymorphic_identity and (
+                        polymorphic_identity in self.polymorphs):
+                    field_checks, schema_validators = self.polymorphs[
+                        polymorphic_identity]
+            call = _Call(
+                dictionary, schema, context, parent_contexts, siblings_list,
+                curr_obj_idx_in_siblings_list, allow_unknown_fields,
+                allow_required_fields_to_be_skipped)
+            if not allow_unknown_fields:
+                field_names = set(name for name, _, _ in field_checks)
+                unknown_fields = [
+                    k for k in dictionary.keys() if k not in field_names]
+                if unknown_fields:
+                    is_valid = False
+                    errors = {'UNKNOWN_FIELDS': unknown_fields}
+            for field_name, check_missing, check_present in field_checks:
+                if field_name not in dictionary:
+                    if allow_required_fields_to_be_skipped or (
+                            check_missing is None):
+                        continue
+                    error_message = check_missing(call)
+                    if error_message is None:
+                        continue
+                    is_valid = False
+                    if errors is None:
+                        errors = {}
+                    errors.setdefault('MISSING_FIELDS', []).append(field_name)
+                    field_errors = {'MISSING_FIELD_ERROR': error_message}
+                else:
+                    field_errors = check_present(dictionary[field_name], call)
+                    if field_errors is None:
+                        continue
+                    is_valid = False
+                if errors is None:
+                    errors = {}
+                errors.setdefault('FIELD_LEVEL_ERRORS', {})[
+                    field_name] = field_errors
+        for schema_validator in schema_validators:
+            validation_result, validation_errors = schema_validator(
+                dictionary, schema=schema, context=context,
+                siblings_list=siblings_list, parent_contexts=parent_contexts,
+                curr_obj_idx_in_siblings_list=curr_obj_idx_in_siblings_list)
+            if validation_result is False:
+                if errors is None:
+                    errors = {}
+                errors.setdefault('SCHEMA_LEVEL_ERRORS', []).append(
+                    validation_errors)
+                is_valid = False
+        return (is_valid, errors)
+
+    def validate_list_of_dicts(
+            self, list_of_dicts, allow_unknown_fields=None,
+            allow_required_fields_to_be_skipped=None, context=None,
+            parent_contexts=None):
+        """Validates every dict in the list, as
+        `schemalite.core.validate_list_of_dicts` does.
+        """
+        if not isinstance(list_of_dicts, list):
+            return (False, "Expected a list")
+        is_valid = True
+        errors = []
+        for idx, dictionary in enumerate(list_of_dicts):
+            dictionary_validity, dictionary_errors = self.validate_dict(
+                dictionary, allow_unknown_fields=allow_unknown_fields,
+                allow_required_fields_to_be_skipped=(
+                    allow_required_fields_to_be_skipped),
+                context=context, siblings_list=list_of_dicts,
+                parent_contexts=parent_contexts,
+                curr_obj_idx_in_siblings_list=idx)
+            errors.append(
+                dictionary_errors if dictionary_validity is False else None)
+            is_valid = is_valid and dictionary_validity
+        return (is_valid, errors)
+
+
+def compile_schema(schema, schemas_registry=None):
+    """Compiles a schemalite schema into a `ValidationPlan`."""
+    return ValidationPlan(schema, schemas_registry=schemas_registry)
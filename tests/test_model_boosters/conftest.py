@@ -0,0 +1,49 @@
+import pytest
+from flask_sqlalchemy_booster import (
+    FlaskBooster, EntitiesRouter, Entity, Get, Index, Post, Put, Delete,
+    BatchSave)
+from .models import db, User, Project, Task
+
+
+def create_app(database_uri='sqlite://'):
+    app = FlaskBooster(__name__)
+    app.config['SQLALCHEMY_DATABASE_URI'] = database_uri
+    app.config['SQLALCHEMY_TRACK_MODIFICATIONS'] = False
+    app.testing = True
+    db.init_app(app)
+    with app.app_context():
+        db.create_all()
+    EntitiesRouter(
+        mount_point=app,
+        routes={
+            "users": Entity(
+                model_class=User, get=Get(), index=Index(), post=Post(),
+                put=Put(), delete=Delete(), batch_save=BatchSave()),
+            "tasks": Entity(
+                model_class=Task, get=Get(), index=Index(), post=Post(),
+                put=Put(), delete=Delete(), batch_save=BatchSave()),
+            "projects": Entity(
+                model_class=Project, get=Get(),
+                index=Index(stream=True, stream_chunk_size=3))
+        })
+    return app
+
+
+@pytest.fixture
+def app():
+    app = create_app()
+    with app.test_request_context():
+        for i in range(10):
+            user = User.create(
+                name="User %d" % i, email="user%d@x.com" % i, score=i)
+            project = Project.create(
+                name="Project %d" % i, owning_user_id=user.id)
+            Task.create_all([
+                {"title": "Task %d" % i, "user_id": user.id,
+                 "project_id": project.id},
+                {"title": "Task %db" % i, "user_id": user.id,
+                 "project_id": project.id}])
+    yield app
+    with app.app_context():
+        db.session.remove()
+        db.drop_all()
@@ -0,0 +1,60 @@
+from flask_sqlalchemy_booster import FlaskSQLAlchemyBooster
+from sqlalchemy import func
+from sqlalchemy.ext.associationproxy import association_proxy
+
+
+db = FlaskSQLAlchemyBooster()
+
+
+class User(db.Model):
+    id = db.Column(db.Integer, primary_key=True, unique=True)
+    created_on = db.Column(db.DateTime(), default=func.now())
+    name = db.Column(db.String(100), nullable=False)
+    email = db.Column(db.String(100), unique=True, nullable=False)
+    score = db.Column(db.Numeric)
+
+    _attrs_forbidden_for_serialization_ = ['score']
+
+    @property
+    def first_name(self):
+        return self.name.split(" ")[0]
+
+
+class Project(db.Model):
+    allow_updation_based_on_unique_keys = True
+
+    id = db.Column(db.Integer, primary_key=True, unique=True)
+    name = db.Column(db.String(300), unique=True)
+    owning_user_id = db.Column(db.Integer, db.ForeignKey('user.id'))
+
+    owning_user = db.relationship("User", backref=db.backref("projects"))
+
+
+class Task(db.Model):
+    id = db.Column(db.Integer, primary_key=True, unique=True)
+    created_on = db.Column(db.DateTime(), default=func.now())
+    title = db.Column(db.String(300))
+    user_id = db.Column(db.Integer, db.ForeignKey('user.id'))
+    project_id = db.Column(db.Integer, db.ForeignKey('project.id'))
+    completed = db.Column(db.Boolean, default=False)
+
+    user = db.relationship("User", backref=db.backref("tasks"))
+    project = db.relationship("Project", backref=db.backref("tasks"))
+    user_email = association_proxy(
+        "user", "email", creator=lambda email: User.first(email=email))
+
+
+class Milestone(db.Model):
+    id = db.Column(db.Integer, primary_key=True, unique=True)
+    title = db.Column(db.String(300))
+    version = db.Column(db.Integer, nullable=False)
+
+    __mapper_args__ = {"version_id_col": version}
+
+
+class Tag(db.Model):
+    id = db.Column(db.Integer, primary_key=True, unique=True)
+    name = db.Column(
+        "tag_name", db.String(100, collation="NOCASE"), unique=True)
+    uses = db.Column(db.Integer, default=0)
+    before = db.Column(db.Integer)
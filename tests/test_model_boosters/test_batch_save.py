@@ -0,0 +1,234 @@
+import io
+import json
+import pytest
+from flask import Blueprint
+from flask_sqlalchemy_booster import EntitiesRouter, Entity, BatchSave, Post
+from flask_sqlalchemy_booster.utils import (
+    read_csv_in_chunks, unique_keys_of_model, row_partition)
+from .conftest import create_app
+from .models import db, User
+
+
+def post_json(client, url, data):
+    return json.loads(client.post(
+        url, data=json.dumps(data),
+        content_type="application/json").data)
+
+
+def test_set_based_batch_save_commits_once_per_chunk(app):
+    bp = Blueprint("bulk", __name__)
+    EntitiesRouter(
+        mount_point=bp,
+        routes={
+            "bulk-users": Entity(
+                model_class=User, url_slug="bulk-users",
+                batch_save=BatchSave(
+                    set_based=True, chunk_size=2,
+                    unique_identifier_fields=['email']))
+        })
+    app.register_blueprint(bp)
+    commits = []
+    on_commit = commits.append
+    db.event.listen(db.session, "after_commit", on_commit)
+    try:
+        result = post_json(app.test_client(), "/batch-save/bulk-users", [
+            {"email": "user1@x.com", "name": "Renamed"},
+            {"email": "new@x.com", "name": "New"},
+            {"email": "other@x.com"},
+            {"email": "another@x.com", "name": "Another"}])
+    finally:
+        db.event.remove(db.session, "after_commit", on_commit)
+    assert result["status"] == "success"
+    rows = result["result"]
+    # The second chunk fails on the missing name, and is saved again row by
+    # row so that only the invalid row fails
+    assert [r["status"] for r in rows] == [
+        "success", "success", "failure", "success"]
+    assert rows[0]["result"]["id"] == 2 and rows[1]["result"]["id"] == 11
+    assert rows[2]["input"] == {"email": "other@x.com"}
+    assert rows[3]["result"]["name"] == "Another"
+    assert len(commits) == 2
+    with app.test_request_context():
+        assert User.count() == 12
+        assert User.get("user1@x.com", key="email").name == "Renamed"
+
+
+def test_rows_failing_at_flush_fail_alone(app):
+    bp = Blueprint("bulk", __name__)
+    EntitiesRouter(
+        mount_point=bp,
+        routes={
+            "bulk-users": Entity(
+                model_class=User, url_slug="bulk-users",
+                batch_save=BatchSave(set_based=True))
+        })
+    app.register_blueprint(bp)
+    result = post_json(app.test_client(), "/batch-save/bulk-users", [
+        {"email": "dup@x.com", "name": "First"},
+        {"email": "dup@x.com", "name": "Second"}])
+    assert [r["status"] for r in result["result"]] == ["success", "failure"]
+    with app.test_request_context():
+        assert User.count() == 11
+
+
+def test_post_processors_run_after_the_chunk_is_committed(app):
+    commits = []
+    commits_seen_by_processors = []
+
+    def after_save(obj, input_data, **kwargs):
+        commits_seen_by_processors.append(len(commits))
+        if obj.name == "Faulty":
+            raise ValueError("Processor failed")
+    bp = Blueprint("bulk", __name__)
+    EntitiesRouter(
+        mount_point=bp,
+        routes={
+            "bulk-users": Entity(
+                model_class=User, url_slug="bulk-users",
+                post=Post(after_save=[after_save]),
+                batch_save=BatchSave(set_based=True))
+        })
+    app.register_blueprint(bp)
+    on_commit = commits.append
+    db.event.listen(db.session, "after_commit", on_commit)
+    try:
+        result = post_json(app.test_client(), "/batch-save/bulk-users", [
+            {"email": "faulty@x.com", "name": "Faulty"},
+            {"email": "fine@x.com", "name": "Fine"}])
+    finally:
+        db.event.remove(db.session, "after_commit", on_commit)
+    # A failing processor fails its row only, as the rows are saved
+    assert [r["status"] for r in result["result"]] == ["failure", "success"]
+    assert commits_seen_by_processors == [1, 1]
+    with app.test_request_context():
+        assert User.count() == 12
+
+
+def test_raw_input_is_parsed_again_from_the_request_body(app):
+    saved = []
+
+    def after_save(obj, input_data, raw_input_data=None):
+        saved.append((input_data, raw_input_data))
+    bp = Blueprint("bulk", __name__)
+    EntitiesRouter(
+        mount_point=bp,
+        routes={
+            "raw-users": Entity(
+                model_class=User, url_slug="raw-users",
+                non_settable_fields=["score"],
+                post=Post(after_save=[after_save]),
+                batch_save=BatchSave(set_based=True))
+        })
+    app.register_blueprint(bp)
+    client = app.test_client()
+    post_json(client, "/raw-users", {
+        "email": "raw@x.com", "name": "<script>Raw</script>", "score": 5})
+    input_data, raw_input_data = saved[0]
+    assert "score" not in input_data
+    assert raw_input_data == {
+        "email": "raw@x.com", "name": "&lt;script&gt;Raw&lt;/script&gt;", "score": 5}
+    result = post_json(client, "/batch-save/raw-users", [
+        {"email": "raw2@x.com", "score": 7}])
+    assert result["result"][0]["status"] == "failure"
+    assert result["result"][0]["input"] == {"email": "raw2@x.com", "score": 7}
+
+
+def test_read_csv_in_chunks_resumes_from_offsets(tmp_path):
+    csv_path = tmp_path / "rows.csv"
+    csv_path.write_text(
+        'name,email\n"Multi\nline",a@x.com\nB,b@x.com\nC,c@x.com\n')
+    chunks = list(read_csv_in_chunks(str(csv_path), 2))
+    assert [[r["email"] for r in rows] for _, rows in chunks] == [
+        ["a@x.com", "b@x.com"], ["c@x.com"]]
+    assert chunks[0][1][0]["name"] == "Multi\nline"
+    resumed = list(read_csv_in_chunks(str(csv_path), 2, offset=chunks[1][0]))
+    assert resumed == [chunks[1]]
+
+
+def test_streamed_csv_upload(app, tmp_path):
+    bp = Blueprint("bulk", __name__)
+    EntitiesRouter(
+        mount_point=bp,
+        tmp_folder_path=str(tmp_path),
+        routes={
+            "bulk-users": Entity(
+                model_class=User, url_slug="bulk-users",
+                batch_save=BatchSave(
+                    stream_csv_input=True, chunk_size=2,
+                    unique_identifier_fields=['email']))
+        })
+    app.register_blueprint(bp)
+    result = json.loads(app.test_client().post(
+        "/batch-save/bulk-users", content_type="multipart/form-data",
+        data={"file": (io.BytesIO(
+            b"name,email,score\nRenamed,user1@x.com,\n"
+            b"New,new@x.com,7\nNewer,newer@x.com,8\n"), "users.csv")}).data)
+    assert [r["status"] for r in result["result"]] == ["success"] * 3
+    with app.test_request_context():
+        assert User.count() == 12
+        assert User.get("user1@x.com", key="email").name == "Renamed"
+        assert User.get("newer@x.com", key="email").score == 8
+
+
+def test_parallel_batch_save_on_a_local_pool(tmp_path):
+    app = create_app("sqlite:///%s" % (tmp_path / "bulk.db"))
+    bp = Blueprint("bulk", __name__)
+    EntitiesRouter(
+        mount_point=bp,
+        tmp_folder_path=str(tmp_path),
+        routes={
+            "bulk-users": Entity(
+                model_class=User, url_slug="bulk-users",
+                batch_save=BatchSave(parallel_workers=3, chunk_size=2))
+        })
+    app.register_blueprint(bp)
+    with app.test_request_context():
+        User.create(name="Existing", email="existing@x.com", score=1)
+    rows = [{"name": "User %d" % i, "email": "user%d@x.com" % i, "score": i}
+            for i in range(6)]
+    rows.insert(3, {"id": 1, "name": "Renamed"})
+    result = post_json(app.test_client(), "/batch-save/bulk-users", rows)
+    assert [r["status"] for r in result["result"]] == ["success"] * 7
+    assert [r["result"]["name"] for r in result["result"]] == [
+        row["name"] for row in rows]
+    with app.test_request_context():
+        assert User.count() == 7
+        assert User.get(1).name == "Renamed"
+
+    result = json.loads(app.test_client().post(
+        "/batch-save/bulk-users", content_type="multipart/form-data",
+        data={"file": (io.BytesIO(
+            b"id,name,email,score\n2,Again,,\n,Csv,csv@x.com,9\n"), "users.csv")}).data)
+    assert [r["result"]["name"] for r in result["result"]] == ["Again", "Csv"]
+    with app.test_request_context():
+        assert User.count() == 8
+
+
+def test_async_parallel_batch_save_needs_a_celery_worker(app):
+    bp = Blueprint("bulk", __name__)
+    with pytest.raises(ValueError) as e:
+        EntitiesRouter(
+            mount_point=bp,
+            routes={
+                "bulk-users": Entity(
+                    model_class=User, url_slug="bulk-users",
+                    batch_save=BatchSave(
+                        parallel_workers=2, run_as_async_task=True))
+            })
+    assert "celery_worker" in str(e.value)
+
+
+def test_rows_sharing_a_key_land_in_one_partition():
+    keys = unique_keys_of_model(User, ["name"])
+    assert keys[:2] == [("id",), ("name",)] and ("email",) in keys
+    rows = [
+        {"email": "a@x.com"}, {"email": "b@x.com", "name": "B"},
+        {"email": "c@x.com"}, {"email": "d@x.com", "name": "B"},
+        {"id": 1, "email": "e@x.com"}, {"id": "1"}, {"email": "a@x.com"},
+        {}, {}, {}]
+    partitions = [row_partition(row, idx, keys, 4) for idx, row in enumerate(rows)]
+    assert all(0 <= p < 4 for p in partitions)
+    assert partitions[0] == partitions[6]
+    assert partitions[1] == partitions[3]
+    assert partitions[4] == partitions[5]
+    assert partitions[7:] == [7 % 4, 8 % 4, 9 % 4]
@@ -0,0 +1,86 @@
+from .models import db, User, Project, Tag
+from .test_eager_loading import count_queries
+
+
+def test_update_or_create_all_fetches_matches_in_one_query(app):
+    with app.test_request_context():
+        rows = [{"email": "user%d@x.com" % i, "name": "Renamed %d" % i}
+                for i in range(8)]
+        rows.append({"email": "new@x.com", "name": "New"})
+        users, queries = count_queries(
+            app, lambda: User.update_or_build_all(rows, keys=['email']))
+        # One select for the matches, and one checking that the database
+        # does not find the email left unmatched. The flush happens later.
+        assert queries == 2
+        assert [u.id for u in users[:8]] == list(range(1, 9))
+        assert users[3].name == "Renamed 3" and users[8].id is None
+        users = User.update_or_create_all(rows, keys=['email'])
+        assert User.count() == 11 and users[8].id == 11
+
+
+def test_find_all_by_keys_on_multiple_columns(app):
+    with app.test_request_context():
+        matches = Project.find_all_by_keys([
+            {"name": "Project 2", "owning_user_id": "3"},
+            {"name": "Project 2", "owning_user_id": 4},
+            {"name": "Project 5"}], keys=['name', 'owning_user_id'])
+        assert [m and m.id for m in matches] == [3, None, 6]
+
+
+def test_upsert_all(app):
+    with app.test_request_context():
+        count = User.upsert_all([
+            {"email": "user1@x.com", "name": "Updated", "score": 100},
+            {"email": "new@x.com", "name": "Inserted", "score": 1},
+            {"email": "new@x.com", "name": "Inserted again", "score": 2}],
+            keys=['email'])
+        assert count == 3
+        db.session.expire_all()
+        assert User.get("user1@x.com", key="email").name == "Updated"
+        assert User.get("new@x.com", key="email").name == "Inserted again"
+        assert User.count() == 11
+
+
+
+def test_update_or_new_all_matches_on_unique_keys_in_bulk(app):
+    with app.test_request_context():
+        rows = [{"id": 2, "name": "By id"},
+                {"id": None, "email": "user4@x.com", "name": "By email"},
+                {"name": "Nobody", "email": "nobody@x.com"}]
+        rows += [{"email": "user%d@x.com" % i, "name": "Bulk %d" % i}
+                 for i in range(5, 10)]
+        users, queries = count_queries(
+            app, lambda: User.update_or_new_all(rows))
+        # One query for the primary keys, one for the emails and one
+        # checking the email left unmatched
+        assert queries == 3
+        assert [u.id for u in users] == [2, 5, None, 6, 7, 8, 9, 10]
+        assert users[1].name == "By email" and users[7].name == "Bulk 9"
+
+
+def test_find_all_by_keys_matches_the_way_the_database_compares(app):
+    with app.test_request_context():
+        db.session.add_all([Tag(name="green"), Tag(name="Blue")])
+        db.session.commit()
+        matches, queries = count_queries(app, lambda: Tag.find_all_by_keys([
+            {"name": "green"}, {"name": "GREEN"}, {"name": "blue"},
+            {"name": "red"}, {"name": "Red"}], keys=['name']))
+        assert [m and m.name for m in matches] == [
+            "green", "green", "Blue", None, None]
+        # One IN query, then the 4 unmatched values are halved down to the
+        # ones the database matches: 4 -> (2 -> 1 + 1) + 2
+        assert queries == 6
+        assert Tag.find_all_by_keys([{"name": "red"}], keys=['name']) == [None]
+
+
+def test_upsert_all_maps_attributes_to_their_columns(app):
+    with app.test_request_context():
+        db.session.add(Tag(name="green", uses=1))
+        db.session.commit()
+        count = Tag.upsert_all([
+            {"name": "green", "uses": 2}, {"name": "blue", "uses": 3}],
+            keys=['name'])
+        assert count == 2
+        db.session.expire_all()
+        assert sorted((t.name, t.uses) for t in Tag.all()) == [
+            ("blue", 3), ("green", 2)]
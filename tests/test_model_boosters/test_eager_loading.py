@@ -0,0 +1,37 @@
+from sqlalchemy import event
+from .models import db
+
+
+def count_queries(app, func):
+    statements = []
+
+    def before_cursor_execute(conn, cursor, statement, *args):
+        statements.append(statement)
+
+    with app.app_context():
+        engine = db.engine
+    event.listen(engine, "before_cursor_execute", before_cursor_execute)
+    try:
+        result = func()
+    finally:
+        event.remove(engine, "before_cursor_execute", before_cursor_execute)
+    return result, len(statements)
+
+
+def test_index_query_count_does_not_grow_with_rows(app):
+    with app.test_client() as client:
+        resp, queries = count_queries(app, lambda: client.jget(
+            '/tasks?_ds={"rels":{"user":{"rels":{"projects":{}}},"project":{}}}'))
+        assert resp['status'] == 'success'
+        assert len(resp['result']) == 20
+        assert resp['result'][0]['user']['projects'][0]['name'] == "Project 0"
+        assert queries == 2
+
+
+def test_get_loads_nested_rels_eagerly(app):
+    with app.test_client() as client:
+        resp, queries = count_queries(app, lambda: client.jget(
+            '/users/1?_ds={"rels":{"tasks":{"rels":{"project":{}}}}}'))
+        assert resp['status'] == 'success'
+        assert len(resp['result']['tasks']) == 2
+        assert queries == 2
@@ -0,0 +1,87 @@
+import json
+import pytest
+from flask import Blueprint
+from flask_sqlalchemy_booster import EntitiesRouter, Entity, Get, Index
+from flask_sqlalchemy_booster import responses
+from .models import db, User, Milestone
+
+
+@pytest.fixture
+def etag_app(app):
+    bp = Blueprint("conditional", __name__)
+    EntitiesRouter(
+        mount_point=bp,
+        routes={
+            "milestones": Entity(
+                model_class=Milestone, url_slug="milestones", etag=True,
+                get=Get(), index=Index()),
+            "etag-users": Entity(
+                model_class=User, url_slug="etag-users", etag=True,
+                get=Get())
+        })
+    app.register_blueprint(bp)
+    with app.test_request_context():
+        Milestone.create_all([{"title": "M%d" % i} for i in range(5)])
+    return app
+
+
+def test_get_answers_matching_etag_without_serializing(etag_app, monkeypatch):
+    client = etag_app.test_client()
+    response = client.get("/milestones/1")
+    etag = response.headers["ETag"]
+    assert json.loads(response.data)["result"]["title"] == "M0"
+
+    def fail(*args, **kwargs):
+        raise AssertionError("serialized")
+    monkeypatch.setattr(responses, "as_json_obj", fail)
+    response = client.get("/milestones/1", headers={"If-None-Match": etag})
+    assert response.status_code == 304
+    assert response.headers["ETag"] == etag
+    monkeypatch.undo()
+
+    with etag_app.test_request_context():
+        Milestone.get(1).update(title="Renamed")
+    response = client.get("/milestones/1", headers={"If-None-Match": etag})
+    assert response.status_code == 200
+    assert response.headers["ETag"] != etag
+
+
+def test_index_etag_changes_with_the_rows_of_the_page(etag_app):
+    client = etag_app.test_client()
+    url = "/milestones?page=1&per_page=2"
+    # Unconditional requests get the same ETag as the conditional ones
+    etag = client.get(url).headers["ETag"]
+    response = client.get(url, headers={"If-None-Match": etag})
+    assert response.status_code == 304
+    assert response.headers["ETag"] == etag
+    # The ETags of other pages and representations differ
+    assert client.get(
+        url + '&_ds={"attrs":["title"]}',
+        headers={"If-None-Match": etag}).headers["ETag"] != etag
+    with etag_app.test_request_context():
+        Milestone.create(title="M5")
+    # The new row is on another page, but the total has changed
+    response = client.get(url, headers={"If-None-Match": etag})
+    assert response.status_code == 200
+    assert json.loads(response.data)["total_items"] == 6
+
+
+def test_etags_fall_back_to_the_body_without_a_version(etag_app):
+    client = etag_app.test_client()
+    response = client.get("/etag-users/1")
+    etag = response.headers["ETag"]
+    response = client.get("/etag-users/1", headers={"If-None-Match": etag})
+    assert response.status_code == 304 and response.data == b""
+    with etag_app.test_request_context():
+        User.get(1).update(name="Renamed")
+    response = client.get("/etag-users/1", headers={"If-None-Match": etag})
+    assert response.status_code == 200
+
+
+def test_version_etags_need_the_serialized_attrs_to_be_columns(app):
+    with app.test_request_context():
+        assert responses.supports_version_etag(Milestone)
+        assert not responses.supports_version_etag(
+            Milestone, attrs_to_serialize=["title", "versions_label"])
+        # Models without a version_id_col or _version_attr_ have no versions
+        assert not responses.supports_version_etag(User)
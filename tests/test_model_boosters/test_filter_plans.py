@@ -0,0 +1,49 @@
+import json
+from flask_sqlalchemy_booster.filter_plans import (
+    get_filter_plan, parse_filters)
+from .models import Task
+
+
+def filtered_titles(app, filters):
+    response = app.test_client().get(
+        "/tasks", query_string={"_f": json.dumps(filters)})
+    return sorted(t["title"] for t in json.loads(response.data)["result"])
+
+
+def test_filters_with_the_same_shape_share_a_plan(app):
+    def filters(email, title):
+        return {"c": "AND", "f": [
+            {"k": "user.email", "op": "=", "v": email},
+            {"c": "OR", "f": [
+                {"k": "title", "op": "~", "v": title},
+                {"k": "id", "op": "in", "v": ["1", "2"]}]}]}
+
+    assert filtered_titles(app, filters("user3@x.com", "b")) == ["Task 3b"]
+    assert filtered_titles(app, filters("user0@x.com", "zz")) == [
+        "Task 0", "Task 0b"]
+    _, shape, values = parse_filters(json.dumps(filters("a", "b")))
+    assert values == ["a", "b", ["1", "2"]]
+    with app.test_request_context():
+        plan = get_filter_plan(Task, shape)
+        assert get_filter_plan(Task, shape) is plan
+        assert plan.joins == ["user"]
+
+
+def test_double_encoded_filters(app):
+    filters = {"f": [{"k": "project.name", "op": "=", "v": "Project 4"}]}
+    assert filtered_titles(app, json.dumps(filters)) == ["Task 4", "Task 4b"]
+
+
+def test_filter_key_paths_are_indexed_per_model(app):
+    with app.test_request_context():
+        path = Task.filter_key_path("user.email")
+        assert Task.filter_key_path("user.email") is path
+        assert [j[0] for j in path.joins] == ["user"]
+        assert path.model_class.__name__ == "User"
+        proxied = Task.filter_key_path("user_email")
+        assert (proxied.attr_name, proxied.column_type is not None) == (
+            "email", True)
+        assert Task.filter_key_path("User.Missing.name") is None
+    response = app.test_client().get("/tasks?user_email=user2@x.com")
+    assert sorted(t["title"] for t in json.loads(response.data)["result"]) == [
+        "Task 2", "Task 2b"]
@@ -0,0 +1,78 @@
+import json
+import uuid
+import pytest
+from datetime import datetime, date
+from decimal import Decimal
+from flask import Blueprint
+from flask_sqlalchemy_booster import EntitiesRouter, Entity, Get
+from flask_sqlalchemy_booster.json_encoder import (
+    set_json_backend, get_json_backend, get_default_json_backend, json_dumps,
+    register_json_encoder, unregister_json_encoder, _encode_datetime)
+from .conftest import create_app
+from .models import User
+
+
+@pytest.fixture
+def restore_backend():
+    backend = get_default_json_backend()
+    yield
+    set_json_backend(backend)
+
+
+def test_backends_agree_with_the_stdlib(app, restore_backend):
+    pytest.importorskip("orjson")
+    with app.test_request_context():
+        obj = {
+            "at": datetime(2020, 1, 2, 3, 4, 5, 6000), "on": date(2020, 1, 2),
+            "price": Decimal("10.25"), "id": uuid.UUID(int=1),
+            "tags": set(["a"]), "user": User.get(1), "big": 2 ** 70,
+            1: "non string key"
+        }
+        set_json_backend("stdlib")
+        expected = json.loads(json_dumps(obj))
+        assert set_json_backend("orjson").name == "orjson"
+        assert json.loads(json_dumps(obj)) == expected
+
+
+def test_missing_backends_fall_back_to_the_stdlib(restore_backend, monkeypatch):
+    def import_module(name):
+        raise ImportError(name)
+    monkeypatch.setattr("importlib.import_module", import_module)
+    assert set_json_backend("auto").name == "stdlib"
+    with pytest.warns(UserWarning):
+        assert set_json_backend("orjson").name == "stdlib"
+    with pytest.raises(ValueError):
+        set_json_backend("yaml")
+
+
+def test_routers_set_the_backend_of_their_app_only(restore_backend):
+    app = create_app()
+    other_app = create_app()
+    bp = Blueprint("fast", __name__)
+    EntitiesRouter(
+        mount_point=bp, json_backend="stdlib",
+        routes={"fast-users": Entity(model_class=User, get=Get())})
+    # The backend is set on the app when the blueprint is registered
+    with app.app_context():
+        assert get_json_backend() is get_default_json_backend()
+    app.register_blueprint(bp)
+    set_json_backend("stdlib")
+    with app.app_context():
+        assert get_json_backend() is not get_default_json_backend()
+        assert get_json_backend().name == "stdlib"
+    with other_app.app_context():
+        assert get_json_backend() is get_default_json_backend()
+
+
+def test_native_backends_apply_the_registered_encoders(restore_backend):
+    pytest.importorskip("orjson")
+    obj = {"at": datetime(2020, 1, 2), "on": date(2020, 1, 2)}
+    set_json_backend("orjson")
+    register_json_encoder(date, lambda d: d.strftime("%d/%m/%Y"))
+    register_json_encoder(datetime, lambda d: "epoch")
+    try:
+        assert json.loads(json_dumps(obj)) == {"at": "epoch", "on": "02/01/2020"}
+    finally:
+        unregister_json_encoder(date)
+        register_json_encoder(datetime, _encode_datetime)
+    assert json.loads(json_dumps(obj))["at"] == "2020-01-02T00:00:00"
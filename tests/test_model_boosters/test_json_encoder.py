@@ -0,0 +1,48 @@
+from collections import OrderedDict
+from datetime import datetime
+from decimal import Decimal
+from flask_sqlalchemy_booster import json_encoder, register_json_encoder
+from flask_sqlalchemy_booster.json_encoder import unregister_json_encoder
+from .models import User
+
+
+class Money(object):
+    def __init__(self, amount):
+        self.amount = amount
+
+
+class Rupees(Money):
+    pass
+
+
+class Points(int):
+    pass
+
+
+def test_builtin_types_keep_their_encodings(app):
+    with app.test_request_context():
+        user = User.get(1)
+        assert json_encoder(datetime(2020, 1, 2)) == "2020-01-02T00:00:00"
+        assert json_encoder(Decimal("1.5")) == 1.5
+        assert json_encoder(Points(3)) == 3
+        assert json_encoder(OrderedDict([("a", Decimal(1))])) == [["a", 1.0]]
+        assert json_encoder(set([Decimal(2)])) == [2.0]
+        assert json_encoder({"d": Decimal(2)}) == {"d": 2.0}
+        assert json_encoder(user) == user.todict()
+        assert json_encoder(user.tasks) == [t.todict() for t in user.tasks]
+        assert json_encoder(Money(1)).startswith("<")
+
+
+def test_registered_encoders_apply_to_subclasses():
+    @register_json_encoder(Money)
+    def encode_money(money):
+        return {"amount": money.amount}
+    try:
+        assert json_encoder(Rupees(5)) == {"amount": 5}
+        register_json_encoder(Rupees, lambda r: "Rs. %s" % r.amount)
+        assert json_encoder(Rupees(5)) == "Rs. 5"
+        assert json_encoder(Money(5)) == {"amount": 5}
+    finally:
+        unregister_json_encoder(Rupees)
+        unregister_json_encoder(Money)
+    assert json_encoder(Rupees(5)).startswith("<")
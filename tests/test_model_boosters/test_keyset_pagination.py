@@ -0,0 +1,101 @@
+from datetime import datetime
+from decimal import Decimal
+import pytest
+from flask_sqlalchemy_booster.query_booster import (
+    encode_cursor, decode_cursor)
+from flask_sqlalchemy_booster.responses import (
+    fetch_results_in_requested_format, process_args_and_fetch_rows)
+from .models import db, Task, User, Tag
+
+
+def test_walking_forwards_and_backwards_with_cursors(app):
+    with app.test_client() as client:
+        first = client.jget('/tasks?after=&per_page=8&orderby=title')
+        assert first['prev_cursor'] is None
+        second = client.jget(
+            '/tasks?after=%s&per_page=8&orderby=title' % first['next_cursor'])
+        last = client.jget(
+            '/tasks?after=%s&per_page=8&orderby=title' % second['next_cursor'])
+        assert last['next_cursor'] is None
+        walked = [t['title'] for page in (first, second, last)
+                  for t in page['result']]
+        assert len(walked) == 20
+        assert walked == sorted(walked)
+        back = client.jget(
+            '/tasks?before=%s&per_page=8&orderby=title' % last['prev_cursor'])
+        assert back['result'] == second['result']
+
+
+def test_descending_pages_with_column_projection(app):
+    with app.test_client() as client:
+        page = client.jget(
+            '/users?after=&per_page=3&sort=desc&_ds={"attrs":["id","name"]}')
+        assert page['result'] == [
+            {'id': i, 'name': 'User %d' % (i - 1)} for i in (10, 9, 8)]
+        page = client.jget(
+            '/users?after=%s&per_page=3&sort=desc&_ds={"attrs":["id"]}'
+            % page['next_cursor'])
+        assert page['result'] == [{'id': 7}, {'id': 6}, {'id': 5}]
+
+
+def test_keyset_paginate_on_query(app):
+    with app.test_request_context():
+        page = Task.query.filter(Task.user_id > 5).keyset_paginate(
+            3, order_by=Task.title, desc=True)
+        assert [t.title for t in page.items] == [
+            "Task 9b", "Task 9", "Task 8b"]
+        page = Task.query.filter(Task.user_id > 5).keyset_paginate(
+            3, after=page.next_cursor, order_by=Task.title, desc=True)
+        assert [t.title for t in page.items] == [
+            "Task 8", "Task 7b", "Task 7"]
+        assert page.has_prev and page.has_next
+
+
+def test_cursors_keep_the_exact_values_of_the_keys():
+    columns = [User.score, User.created_on, User.id]
+    values = [
+        Decimal("12345678901234567.1"), datetime(2020, 1, 2, 3, 4, 5, 6), 7]
+    assert decode_cursor(encode_cursor(values), columns) == values
+
+
+def test_walking_over_empty_and_null_sort_keys(app):
+    with app.test_request_context():
+        Task.query.delete()
+        titles = ["", None, "", "null", None, "a", "none", "b"]
+        db.session.add_all([Task(title=title) for title in titles])
+        db.session.commit()
+        for desc in (False, True):
+            walked = []
+            page = Task.query.keyset_paginate(2, order_by=Task.title, desc=desc)
+            while True:
+                walked.extend(t.title for t in page.items)
+                if page.next_cursor is None:
+                    break
+                page = Task.query.keyset_paginate(
+                    2, after=page.next_cursor, order_by=Task.title, desc=desc)
+            expected = [None, None] + sorted(t for t in titles if t is not None)
+            assert walked == (expected[::-1] if desc else expected)
+            # And back from the last page
+            back = Task.query.keyset_paginate(
+                2, before=page.prev_cursor, order_by=Task.title, desc=desc)
+            assert [t.title for t in back.items] == walked[-4:-2]
+
+
+def test_cursor_args_are_filters_without_keyset_pagination(app):
+    with app.test_request_context():
+        db.session.add_all([Tag(name="a", before=1), Tag(name="b", before=2)])
+        db.session.commit()
+    with app.test_request_context("/?before=2"):
+        rows = process_args_and_fetch_rows(Tag, keyset_pagination=False)
+        assert [t.name for t in rows] == ["b"]
+        # With keyset pagination, it is a cursor
+        with pytest.raises(Exception) as e:
+            process_args_and_fetch_rows(Tag, keyset_pagination=True)
+        assert str(e.value) == "INVALID_CURSOR"
+
+
+def test_a_bad_per_page_is_not_an_invalid_cursor(app):
+    with app.test_request_context("/?after=&per_page=many"):
+        with pytest.raises(ValueError):
+            fetch_results_in_requested_format(
+                Task.query, keyset_pagination=True)
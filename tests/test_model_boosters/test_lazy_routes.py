@@ -0,0 +1,75 @@
+import json
+from flask import Blueprint
+from flask_sqlalchemy_booster import EntitiesRouter, Entity, Get, Index, Post
+from flask_sqlalchemy_booster.entities_router import LazyView
+from .models import User, Task
+
+
+def mount_lazy_router(app):
+    bp = Blueprint("lazy", __name__, url_prefix="/lazy")
+    router = EntitiesRouter(
+        mount_point=bp, lazy=True,
+        routes={
+            "users": Entity(
+                model_class=User, get=Get(), index=Index(), post=Post()),
+            "tasks": Entity(model_class=Task, get=Get())
+        })
+    app.register_blueprint(bp)
+    return router
+
+
+def test_views_are_built_on_the_first_request_to_the_entity(app):
+    router = mount_lazy_router(app)
+    registry = router.get_registry_entry()
+    assert registry["views"]["User"]["post"]["url"] == "/users"
+    # The schemas are populated on mounting, only the views are deferred
+    assert "input_schema" in registry["model_schemas"]["User"]
+    get_view = app.view_functions["lazy.get_user"]
+    assert isinstance(get_view, LazyView) and get_view.view is None
+
+    client = app.test_client()
+    response = client.get("/lazy/users/1")
+    assert json.loads(response.data)["result"]["name"] == "User 0"
+    assert get_view.view is not None
+    report = {t["url_slug"]: t for t in router.boot_timing_report()}
+    assert report["users"]["build"] is not None
+    assert report["tasks"]["build"] is None
+    # The other views of the entity were built along with it
+    assert json.loads(client.get("/lazy/users").data)["result"]
+
+    report = {t["url_slug"]: t for t in router.warmup()}
+    assert report["tasks"]["build"] is not None
+    assert app.view_functions["lazy.get_task"].view is None
+    assert json.loads(client.get("/lazy/tasks/1").data)["result"]["id"] == 1
+
+
+def test_schema_definition_builds_all_the_entities(app):
+    mount_lazy_router(app)
+    schemas = json.loads(
+        app.test_client().get("/lazy/schema-def").data)["model_schemas"]
+    assert "User" in schemas and "Task" in schemas
+
+
+def test_schema_modifiers_apply_whichever_entity_is_built_first(app):
+    def require_title(schema):
+        schema["fields"]["title"]["required"] = True
+        return schema
+
+    bp = Blueprint("lazy", __name__, url_prefix="/lazy")
+    router = EntitiesRouter(
+        mount_point=bp, lazy=True,
+        routes={
+            # Task is reached through the relationships of User first
+            "users": Entity(model_class=User, post=Post()),
+            "tasks": Entity(
+                model_class=Task, post=Post(),
+                input_schema_modifier=require_title)
+        })
+    app.register_blueprint(bp)
+    schemas = router.get_registry_entry()["model_schemas"]
+    assert schemas["Task"]["input_schema"]["fields"]["title"]["required"]
+    response = app.test_client().post(
+        "/lazy/users", data=json.dumps({
+            "name": "U", "email": "u@x.com", "tasks": [{"completed": True}]}),
+        content_type="application/json")
+    assert response.status_code == 400
@@ -0,0 +1,55 @@
+from flask_sqlalchemy_booster.model_booster.model_metadata import (
+    get_model_metadata)
+from .models import db, User, Project
+
+
+def test_keys_are_computed_once_per_class(app):
+    metadata = get_model_metadata(User)
+    assert get_model_metadata(User) is metadata
+    assert metadata.all_settable_keys is metadata.all_settable_keys
+    assert "projects" in metadata.all_settable_key_set
+    keys = User.all_settable_keys()
+    keys.append("not_a_key")
+    assert "not_a_key" not in User.all_settable_keys()
+    assert User.property_keys() == ["first_name"]
+
+
+def test_registry_is_cleared_when_new_mappers_are_configured(app):
+    metadata = get_model_metadata(Project)
+    assert "labels" not in metadata.relationship_keys
+
+    class ProjectLabel(db.Model):
+        id = db.Column(db.Integer, primary_key=True)
+        project_id = db.Column(db.Integer, db.ForeignKey('project.id'))
+        project = db.relationship("Project", backref="labels")
+
+    assert get_model_metadata(Project) is not metadata
+    assert "labels" in Project.relationship_keys()
+
+
+def test_input_schemas_are_generated_once_and_copied(app):
+    class Vehicle(db.Model):
+        id = db.Column(db.Integer, primary_key=True)
+        kind = db.Column(db.String(20))
+        __mapper_args__ = {
+            "polymorphic_on": kind, "polymorphic_identity": "vehicle"}
+
+    class Car(Vehicle):
+        __mapper_args__ = {"polymorphic_identity": "car"}
+
+    class SportsCar(Car):
+        __mapper_args__ = {"polymorphic_identity": "sports_car"}
+
+    class Truck(Vehicle):
+        __mapper_args__ = {"polymorphic_identity": "truck"}
+
+    assert get_model_metadata(Vehicle).leaf_subclasses == (Truck, SportsCar)
+    schema = Vehicle.shared_input_data_schema()
+    assert Vehicle.shared_input_data_schema() is schema
+    assert Vehicle.shared_input_data_schema(forbidden=["kind"]) is not schema
+    assert schema["fields"]["kind"]["permitted_values"] == [
+        "truck", "sports_car"]
+    copied = Vehicle.generate_input_data_schema()
+    assert copied == schema
+    copied["fields"]["kind"]["permitted_values"].append("bus")
+    assert "bus" not in schema["fields"]["kind"]["permitted_values"]
@@ -0,0 +1,49 @@
+from .models import Task
+from .test_eager_loading import count_queries
+
+
+def test_paginate_runs_one_fetch_and_one_count(app):
+    with app.test_request_context():
+        pagination, queries = count_queries(
+            app, lambda: Task.query.paginate(2, 6))
+        assert [t.id for t in pagination.items] == list(range(7, 13))
+        assert pagination.total == 20 and pagination.pages == 4
+        assert queries == 2
+        # The last page is short, so the total is known without counting
+        pagination, queries = count_queries(
+            app, lambda: Task.query.paginate(4, 6))
+        assert pagination.total == 20 and len(pagination.items) == 2
+        assert queries == 1
+
+
+def test_paginate_without_total(app):
+    with app.test_request_context():
+        pagination, queries = count_queries(
+            app, lambda: Task.query.paginate(3, 6, total=False))
+        assert pagination.total is None and pagination.has_next
+        assert queries == 1
+        assert not Task.query.paginate(4, 6, total=False).has_next
+        assert Task.query.paginate(1, 6, total=35).pages == 6
+
+
+def test_approximate_total_is_capped(app):
+    with app.test_request_context():
+        pagination = Task.query.paginate(
+            1, 5, total='approximate', total_cap=8)
+        assert pagination.total == 8 and pagination.total_is_capped
+        assert pagination.has_next
+        pagination = Task.query.paginate(
+            1, 5, total='approximate', total_cap=50)
+        assert pagination.total == 20 and not pagination.total_is_capped
+
+
+def test_cached_total_is_reused_per_filter(app):
+    with app.test_request_context():
+        query = Task.query.filter(Task.user_id > 2)
+        assert query.paginate(1, 5, total='cached').total == 16
+        Task.query.filter(Task.user_id == 10).delete()
+        assert Task.query.filter(
+            Task.user_id > 3).paginate(1, 5, total='cached').total == 12
+        pagination, queries = count_queries(
+            app, lambda: query.paginate(1, 5, total='cached'))
+        assert pagination.total == 16 and queries == 1
@@ -0,0 +1,118 @@
+import functools
+import json
+import pytest
+from flask import Blueprint, request
+from flask_sqlalchemy_booster import EntitiesRouter, Entity, Get, Index, Put
+from flask_sqlalchemy_booster import response_cache
+from .models import db, User, Task
+
+
+class DictCache(object):
+    # The subset of the Flask-Caching interface used by the views
+
+    def __init__(self):
+        self.store = {}
+
+    def get_many(self, *keys):
+        return [self.store.get(k) for k in keys]
+
+    def set_many(self, mapping, timeout=None):
+        self.store.update(mapping)
+
+    def cached(self, timeout=None, key_prefix='view/%s', unless=None):
+        def decorator(f):
+            @functools.wraps(f)
+            def wrapper(*args, **kwargs):
+                if callable(key_prefix):
+                    key = key_prefix()
+                else:
+                    key = key_prefix % request.path
+                if key not in self.store:
+                    self.store[key] = f(*args, **kwargs)
+                return self.store[key]
+            return wrapper
+        return decorator
+
+    def memoize(self, timeout=None, make_name=None):
+        def decorator(f):
+            @functools.wraps(f)
+            def wrapper(*args, **kwargs):
+                key = (make_name(f.__name__), args, tuple(sorted(kwargs.items())))
+                if key not in self.store:
+                    self.store[key] = f(*args, **kwargs)
+                return self.store[key]
+            return wrapper
+        return decorator
+
+
+@pytest.fixture
+def cached_app(app):
+    cache = DictCache()
+    bp = Blueprint("cached", __name__)
+    EntitiesRouter(
+        mount_point=bp, cache_handler=cache,
+        routes={
+            "cached-users": Entity(
+                model_class=User, url_slug="cached-users",
+                enable_caching=True, invalidate_cache_on_write=True,
+                get=Get(enable_caching=True), index=Index(), put=Put()),
+            "cached-tasks": Entity(
+                model_class=Task, url_slug="cached-tasks",
+                enable_caching=True, invalidate_cache_on_write=True,
+                index=Index())
+        })
+    app.register_blueprint(bp)
+    yield app
+    response_cache._tagged_caches.remove(cache)
+
+
+def get_json(client, url):
+    return json.loads(client.get(url).data)
+
+
+def rename_user_bypassing_the_session(user_id, name):
+    db.engine.execute(
+        User.__table__.update().where(User.id == user_id).values(name=name))
+
+
+def test_cached_get_is_invalidated_by_writes_to_the_instance(cached_app):
+    client = cached_app.test_client()
+    assert get_json(client, "/cached-users/1")["result"]["name"] == "User 0"
+    with cached_app.test_request_context():
+        rename_user_bypassing_the_session(1, "Stale")
+        # Writes to other instances leave the cached response in place
+        User.get(2).update(name="Renamed 1")
+    assert get_json(client, "/cached-users/1")["result"]["name"] == "User 0"
+    client.put(
+        "/cached-users/1", data=json.dumps({"name": "Renamed 0"}),
+        content_type="application/json")
+    assert get_json(client, "/cached-users/1")["result"]["name"] == "Renamed 0"
+
+
+def test_bulk_updates_invalidate_cached_gets(cached_app):
+    client = cached_app.test_client()
+    assert get_json(client, "/cached-users/1")["result"]["name"] == "User 0"
+    with cached_app.test_request_context():
+        User.update_all(User.id == 1, name="Bulk renamed")
+    assert get_json(client, "/cached-users/1")["result"]["name"] == "Bulk renamed"
+
+
+def test_cached_index_is_invalidated_by_writes_to_joined_tables(cached_app):
+    client = cached_app.test_client()
+    url = "/cached-tasks?user.name=User%200"
+    assert len(get_json(client, url)["result"]) == 2
+    with cached_app.test_request_context():
+        User.get(1).update(name="Renamed")
+    assert len(get_json(client, url)["result"]) == 0
+
+
+def test_rolled_back_writes_do_not_invalidate(cached_app):
+    client = cached_app.test_client()
+    assert get_json(client, "/cached-users/1")["result"]["name"] == "User 0"
+    with cached_app.test_request_context():
+        rename_user_bypassing_the_session(1, "Stale")
+        user = User.get(1)
+        user.name = "Rolled back"
+        db.session.flush()
+        db.session.rollback()
+    assert get_json(client, "/cached-users/1")["result"]["name"] == "User 0"
@@ -0,0 +1,64 @@
+import json
+from flask import g, jsonify
+from flask_sqlalchemy_booster import skip_sanitization
+from flask_sqlalchemy_booster import core
+
+
+def add_echo_routes(app):
+    @app.route("/echo", methods=["POST"])
+    def echo():
+        return jsonify({"json": g.json, "args": g.args})
+
+    @app.route("/raw-echo", methods=["POST"])
+    @skip_sanitization
+    def raw_echo():
+        return jsonify({"json": g.json})
+
+    @app.route("/page-echo", methods=["POST"])
+    @skip_sanitization(fields=["html"])
+    def page_echo():
+        return jsonify({"json": g.json})
+
+
+def post_json(client, url, data):
+    return json.loads(client.post(
+        url, data=json.dumps(data), content_type="application/json").data)
+
+
+def test_nested_values_are_cleaned_in_one_walk(app):
+    add_echo_routes(app)
+    result = post_json(app.test_client(), "/echo?q=<script>x</script>", {
+        "name": "<script>alert(1)</script>", "empty": "", "count": 3,
+        "ratio": 1.5, "flag": True,
+        "tags": ["plain", "a & b", {"<k>": "<i>ok</i>"}]})
+    assert result["json"] == {
+        "name": "&lt;script&gt;alert(1)&lt;/script&gt;", "empty": None,
+        "count": 3, "ratio": 1.5, "flag": True,
+        "tags": ["plain", "a &amp; b", {"&lt;k&gt;": "<i>ok</i>"}]}
+    assert result["args"] == {"q": "&lt;script&gt;x&lt;/script&gt;"}
+
+
+def test_sanitization_runs_only_for_markup_that_is_read(app, monkeypatch):
+    add_echo_routes(app)
+    cleaned = []
+    clean = core.bleach.clean
+    monkeypatch.setattr(
+        core.bleach, "clean", lambda s: cleaned.append(s) or clean(s))
+    client = app.test_client()
+    # The Get view never reads g.json
+    client.get("/users/1", data=json.dumps({"name": "<b>"}),
+               content_type="application/json")
+    post_json(client, "/echo", [{"name": "plain text"}])
+    assert cleaned == []
+    post_json(client, "/echo", [{"name": "<b>"}])
+    assert cleaned == ["<b>"]
+
+
+def test_views_and_fields_can_skip_sanitization(app):
+    add_echo_routes(app)
+    client = app.test_client()
+    data = {"html": "<script>x</script>", "title": "<script>y</script>"}
+    assert post_json(client, "/raw-echo", data)["json"] == data
+    assert post_json(client, "/page-echo", data)["json"] == {
+        "html": "<script>x</script>",
+        "title": "&lt;script&gt;y&lt;/script&gt;"}
@@ -0,0 +1,54 @@
+from flask_sqlalchemy_booster.model_booster.serializer_plans import (
+    get_serializer_plan)
+from .models import User, Task
+from .test_eager_loading import count_queries
+
+
+def test_plan_is_cached_per_model_and_struct(app):
+    with app.test_request_context():
+        ds = {"attrs": ["id", "title"], "rels": {"user": {}}}
+        assert get_serializer_plan(Task, ds) is get_serializer_plan(
+            Task, {"rels": {"user": {}}, "attrs": ["id", "title"]})
+        assert get_serializer_plan(Task, ds) is not get_serializer_plan(
+            Task, {"attrs": ["id"]})
+
+
+def test_plan_drops_forbidden_and_unknown_attrs(app):
+    with app.test_request_context():
+        plan = User.serializer_plan(
+            {"attrs": ["id", "score", "no_such_attr", "first_name"]})
+        assert plan.attr_names == ["id", "first_name"]
+
+
+def test_todict_list_matches_todict(app):
+    with app.test_request_context():
+        ds = {"attrs": ["id", "title", "user_email"],
+              "rels": {"user": {"rels": {"projects": {}}}, "project": {}}}
+        tasks = Task.all()
+        assert Task.todict_list(tasks, dict_struct=ds) == [
+            t.todict(dict_struct=ds) for t in tasks]
+        task_dict = tasks[0].todict(dict_struct=ds)
+        assert 'score' not in task_dict['user']
+        assert task_dict['user']['projects'][0]['name'] == "Project 0"
+
+
+def test_post_processors_and_key_modifications(app):
+    with app.test_request_context():
+        result = Task.todict_list(
+            Task.all(limit=1), dict_struct={"attrs": ["id", "title"]},
+            dict_post_processors=[
+                lambda d, obj: dict(d, upper=obj.title.upper())],
+            key_modifications={"title": "name"})
+        assert result == [{"id": 1, "name": "Task 0", "upper": "TASK 0"}]
+
+
+def test_attrs_only_index_is_served_from_column_rows(app):
+    with app.test_client() as client:
+        resp, queries = count_queries(app, lambda: client.jget(
+            '/users?_ds={"attrs":["id","name"]}&sort=desc&orderby=id'))
+        assert resp['status'] == 'success'
+        assert resp['result'][0] == {'id': 10, 'name': 'User 9'}
+        assert queries == 1
+        # Forbidden attrs stay out of the projection
+        resp = client.jget('/users?_ds={"attrs":["id","score"]}')
+        assert resp['result'][0] == {'id': 1}
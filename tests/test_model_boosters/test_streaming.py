@@ -0,0 +1,29 @@
+import json
+
+
+def test_streamed_json_matches_regular_response(app):
+    with app.test_client() as client:
+        resp = client.get('/projects?_ds={"rels":{"owning_user":{}}}')
+        assert 'Content-Length' not in resp.headers
+        result = json.loads(resp.get_data(as_text=True))
+        assert result['status'] == 'success'
+        assert len(result['result']) == 10
+        assert result['result'][9]['owning_user']['name'] == "User 9"
+
+
+def test_ndjson_is_streamed_when_accepted(app):
+    with app.test_client() as client:
+        resp = client.get(
+            '/projects?limit=5&_ds={"attrs":["id","name"]}',
+            headers={'Accept': 'application/x-ndjson'})
+        assert resp.mimetype == 'application/x-ndjson'
+        lines = resp.get_data(as_text=True).splitlines()
+        assert [json.loads(l) for l in lines] == [
+            {"id": i, "name": "Project %d" % (i - 1)} for i in range(1, 6)]
+
+
+def test_paginated_index_is_not_streamed(app):
+    with app.test_client() as client:
+        resp = client.get('/projects?page=2&per_page=4')
+        assert 'Content-Length' in resp.headers
+        assert len(resp.json['result']) == 4
@@ -0,0 +1,33 @@
+from datetime import date
+from decimal import Decimal
+import dateutil.parser
+from flask_sqlalchemy_booster.utils import (
+    parse_datetime, column_type_converters, convert_row_using_converters,
+    convert_rows_using_converters, type_coerce_value)
+from sqlalchemy.sql import sqltypes
+from .models import User
+
+
+def test_parse_datetime_matches_dateutil():
+    for value in [
+            "2014-11-10", "2014-11-10T11:53", "2014-11-10 11:53:33",
+            "2014-11-10T11:53:33.25", "2014-11-10T11:53:33+05:30",
+            "2014-11-10T11:53:33Z", "Nov 10 2014 11:53AM", "20141110"]:
+        assert parse_datetime(value) == dateutil.parser.parse(value)
+    assert type_coerce_value(sqltypes.Date, "2014-11-10") == date(2014, 11, 10)
+    assert type_coerce_value(sqltypes.Integer, "null") is None
+
+
+def test_rows_are_coerced_column_wise(app):
+    rows = [
+        {"id": "1", "name": "A", "score": "1.5", "created_on": "2020-01-02"},
+        {"id": "2", "name": "", "score": "1.5", "created_on": "2020-01-02"},
+        {"id": "3", "name": "C", "score": "none", "extra": "x"}]
+    converters = column_type_converters(User)
+    converted = convert_rows_using_converters(rows, converters)
+    assert converted == [
+        convert_row_using_converters(row, converters) for row in rows]
+    assert converted[1] == {
+        "id": 2, "score": Decimal("1.5"),
+        "created_on": parse_datetime("2020-01-02")}
+    assert converted[2]["score"] is None and converted[2]["extra"] == "x"
@@ -0,0 +1,85 @@
+from copy import deepcopy
+from datetime import datetime
+from decimal import Decimal
+from schemalite.core import validate_dict, func_and_desc
+from flask_sqlalchemy_booster.validation_plans import compile_schema
+from .models import User, Project
+
+
+def is_positive(value, dictionary, **kwargs):
+    return (value > 0, "Should be positive")
+
+
+def names_differ(dictionary, **kwargs):
+    return (dictionary.get("name") != dictionary.get("nickname"), "Same names")
+
+
+SCHEMA = {
+    "fields": {
+        "name": {"required": True, "type": (str,)},
+        "nickname": {"type": str},
+        "age": {"type": int, "validators": [
+            func_and_desc(is_positive, "is positive")]},
+        "price": {"type": (Decimal, float)},
+        "born_at": {"type": datetime},
+        "kind": {"permitted_values": ["a", "b"]},
+        "tags": {"type": list, "list_item_type": str,
+                 "permitted_values_for_list_items": ["x", "y"]},
+        "address": {"type": dict, "dict_schema": {
+            "fields": {"city": {"required": True, "type": str}}}},
+        "secret": {"allowed": False},
+    },
+    "validators": [func_and_desc(names_differ, "names differ")]
+}
+
+ROWS = [
+    {"name": "A", "age": 3, "price": "1.5", "born_at": "2020-01-01",
+     "kind": "a", "tags": ["x"], "address": {"city": "C"}},
+    {"nickname": 1, "age": -1, "price": "cheap", "kind": "c",
+     "tags": ["x", "z", 3], "address": {"town": "T"}, "secret": 1},
+    {"name": "A", "nickname": "A", "unknown": 1},
+    "not a dict",
+]
+
+
+def test_plans_give_the_errors_of_validate_dict():
+    plan = compile_schema(SCHEMA)
+    for row in ROWS:
+        for skip in (False, True):
+            assert plan.validate_dict(
+                row, allow_required_fields_to_be_skipped=skip) == validate_dict(
+                row, deepcopy(SCHEMA), allow_required_fields_to_be_skipped=skip)
+
+
+def test_plans_of_generated_schemas_look_up_the_schemas_registry(app):
+    with app.test_request_context():
+        registry = {
+            "User": User.generate_input_data_schema(),
+            "Project": Project.generate_input_data_schema()}
+    plan = compile_schema(registry["User"], registry)
+    rows = [
+        {"name": "U", "email": "u@x.com", "projects": [{"name": 1}, {}]},
+        {"name": 1, "projects": "none", "tasks": None},
+    ]
+    for row in rows:
+        assert plan.validate_dict(row) == validate_dict(
+            row, registry["User"], schemas_registry=registry)
+
+
+def test_polymorphic_fields_are_merged_without_modifying_the_schema():
+    schema = {
+        "fields": {"kind": {"type": str}, "name": {"type": str}},
+        "polymorphic_on": "kind",
+        "additional_schema_for_polymorphs": {
+            "a": {"fields": {"a_only": {"type": int}}},
+            "b": {"fields": {"b_only": {"required": True}}}
+        }
+    }
+    original = deepcopy(schema)
+    plan = compile_schema(schema)
+    assert plan.validate_dict({"kind": "a", "a_only": 1}) == (True, None)
+    is_valid, errors = plan.validate_dict({"kind": "b", "a_only": 1})
+    assert not is_valid
+    assert errors["UNKNOWN_FIELDS"] == ["a_only"]
+    assert errors["MISSING_FIELDS"] == ["b_only"]
+    assert schema == original